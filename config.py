@@ -1,4 +1,5 @@
 import os
+import tempfile
 from dotenv import load_dotenv
 
 # Load environment variables from a .env file
@@ -11,6 +12,19 @@ class Config:
 
     PEPPER = os.getenv('PEPPER')
 
+    # Process pool used for bcrypt hashing and its back-pressure limits
+    # A password history check fans out up to 15 hashes and takes about 15 / workers hash times,
+    # so the default is one worker per core up to that depth, more workers than cores do not help
+    PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', min(15, os.cpu_count() or 2)))
+    PASSWORD_HASH_MAX_QUEUE = int(os.getenv('PASSWORD_HASH_MAX_QUEUE', 32))
+    PASSWORD_HASH_QUEUE_TIMEOUT = float(os.getenv('PASSWORD_HASH_QUEUE_TIMEOUT', 5))
+
+    # Per-process cache of the identity columns loaded by Flask-Login on every request
+    # The TTL bounds how long a change to the cached columns made by another worker process can go unnoticed,
+    # the session token and active flag are re-read on every request and never go stale
+    IDENTITY_CACHE_TTL = int(os.getenv('IDENTITY_CACHE_TTL', 30))
+    IDENTITY_CACHE_SIZE = int(os.getenv('IDENTITY_CACHE_SIZE', 10000))
+
     SQLALCHEMY_DATABASE_URI = os.getenv('SQLALCHEMY_DATABASE_URI')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
@@ -20,8 +34,82 @@ class Config:
     MAIL_PASSWORD = os.getenv('MAIL_PASSWORD')
     MAIL_USE_TLS = os.getenv('MAIL_USE_TLS')
 
+    # Background delivery of the outbound mail queue
+    MAIL_DISPATCH_INTERVAL = int(os.getenv('MAIL_DISPATCH_INTERVAL', 2))
+    MAIL_DISPATCH_BATCH = int(os.getenv('MAIL_DISPATCH_BATCH', 500))
+    MAIL_MAX_ATTEMPTS = int(os.getenv('MAIL_MAX_ATTEMPTS', 5))
+    MAIL_RETRY_BASE_SECONDS = int(os.getenv('MAIL_RETRY_BASE_SECONDS', 30))
+    MAIL_RETRY_MAX_SECONDS = int(os.getenv('MAIL_RETRY_MAX_SECONDS', 3600))
+    MAIL_CONNECTIONS = int(os.getenv('MAIL_CONNECTIONS', 3))
+    MAIL_CHUNK_SIZE = int(os.getenv('MAIL_CHUNK_SIZE', 50))
+
     RECAPTCHA_SITE_KEY = os.getenv('RECAPTCHA_SITE_KEY')
     RECAPTCHA_SECRET_KEY = os.getenv('RECAPTCHA_SECRET_KEY')
+    RECAPTCHA_VERIFY_URL = os.getenv('RECAPTCHA_VERIFY_URL', 'https://www.google.com/recaptcha/api/siteverify')
+    RECAPTCHA_CONNECT_TIMEOUT = float(os.getenv('RECAPTCHA_CONNECT_TIMEOUT', 2))
+    RECAPTCHA_READ_TIMEOUT = float(os.getenv('RECAPTCHA_READ_TIMEOUT', 3))
+    RECAPTCHA_REPLAY_TTL = int(os.getenv('RECAPTCHA_REPLAY_TTL', 120))
+    RECAPTCHA_POOL_SIZE = int(os.getenv('RECAPTCHA_POOL_SIZE', 10))
     
+    # Audit events are buffered and written in batches when either threshold is reached
+    AUDIT_LOG_FLUSH_SIZE = int(os.getenv('AUDIT_LOG_FLUSH_SIZE', 100))
+    AUDIT_LOG_FLUSH_INTERVAL = int(os.getenv('AUDIT_LOG_FLUSH_INTERVAL', 2))
+    AUDIT_LOG_MAX_BUFFER = int(os.getenv('AUDIT_LOG_MAX_BUFFER', 10000))
+
+    # How long each worker caches the course start date before re-reading it
+    CALENDAR_CACHE_TTL = int(os.getenv('CALENDAR_CACHE_TTL', 60))
+
+    # Maximum rows returned by a leaderboard query
+    LEADERBOARD_LIMIT = int(os.getenv('LEADERBOARD_LIMIT', 1000))
+    # How often each worker rebuilds its in-memory boards to include other workers' updates
+    LEADERBOARD_REFRESH_SECONDS = int(os.getenv('LEADERBOARD_REFRESH_SECONDS', 60))
+
+    # Server-Sent Events push of leaderboard changes to open rankings pages
+    LIVE_LEADERBOARD_QUEUE_SIZE = int(os.getenv('LIVE_LEADERBOARD_QUEUE_SIZE', 100))
+    LIVE_LEADERBOARD_KEEPALIVE = int(os.getenv('LIVE_LEADERBOARD_KEEPALIVE', 15))
+    LIVE_LEADERBOARD_MAX_AGE = int(os.getenv('LIVE_LEADERBOARD_MAX_AGE', 300))
+    LIVE_LEADERBOARD_MAX_SUBSCRIBERS = int(os.getenv('LIVE_LEADERBOARD_MAX_SUBSCRIBERS', 1000))
+    LIVE_LEADERBOARD_POLL_INTERVAL = int(os.getenv('LIVE_LEADERBOARD_POLL_INTERVAL', 5))
+
+    # Seconds a worker trusts its cached quiz question pools before re-checking the quiz's question version
+    QUESTION_POOL_VERSION_TTL = int(os.getenv('QUESTION_POOL_VERSION_TTL', 5))
+
+    # Quiz answers are appended to a local write-ahead log and written to the database every
+    # ANSWER_LOG_FLUSH_SIZE answers or ANSWER_LOG_FLUSH_MS milliseconds, whichever comes first
+    ANSWER_LOG_DIR = os.getenv('ANSWER_LOG_DIR')  # Defaults to instance/answer_log
+    ANSWER_LOG_FLUSH_SIZE = int(os.getenv('ANSWER_LOG_FLUSH_SIZE', 200))
+    ANSWER_LOG_FLUSH_MS = int(os.getenv('ANSWER_LOG_FLUSH_MS', 500))
+    ANSWER_LOG_FSYNC = os.getenv('ANSWER_LOG_FSYNC', 'True').lower() in ['true', '1', 'yes']
+
+    # Quiz attempts kept in memory per worker, and how long an untouched attempt is kept before it is swept
+    QUIZ_ATTEMPT_CACHE_SIZE = int(os.getenv('QUIZ_ATTEMPT_CACHE_SIZE', 10000))
+    QUIZ_ATTEMPT_MAX_AGE_HOURS = int(os.getenv('QUIZ_ATTEMPT_MAX_AGE_HOURS', 24))
+
+    # Rows per page in the admin logs browser
+    LOGS_PAGE_SIZE = int(os.getenv('LOGS_PAGE_SIZE', 50))
+
+    # Logs older than the retention period are moved to gzip'd JSON Lines files, one per month
+    LOG_RETENTION_DAYS = int(os.getenv('LOG_RETENTION_DAYS', 180))
+    LOG_ARCHIVE_DIR = os.getenv('LOG_ARCHIVE_DIR')  # Defaults to instance/log_archive
+    LOG_ARCHIVE_BATCH = int(os.getenv('LOG_ARCHIVE_BATCH', 5000))
+    LOG_ARCHIVE_HOUR = int(os.getenv('LOG_ARCHIVE_HOUR', 3))
+
+    # Rate limit counters shared by all workers on the host, memory:// gives each process its own counters
+    RATELIMIT_STORAGE_URI = os.getenv('RATELIMIT_STORAGE_URI', 'grumpy+sqlite://' + os.path.join(tempfile.gettempdir(), 'grumpy-ratelimit.db'))
+    # How much of the default limit one request uses, keyed by "endpoint:METHOD" or "endpoint"
+    RATELIMIT_ROUTE_COSTS = {
+        'auth.login:POST': 5,
+        'auth.verify_otp:POST': 3,
+        'auth.resend_otp:POST': 3,
+        'auth.forget_password:POST': 5,
+        'auth.reset_password:POST': 5,
+        'auth.change_password:POST': 3,
+        'auth.reauthenticate:POST': 3,
+    }
+
+    # Addresses or CIDR ranges (IPv4 and IPv6), e.g. 10.0.0.0/8,2001:db8::/32
     BLACKLISTED_IPS = os.getenv('BLACKLISTED_IPS', '').split(',')
-    WHITELISTED_IPS = os.getenv('WHITELISTED_IPS', '').split(',')
\ No newline at end of file
+    WHITELISTED_IPS = os.getenv('WHITELISTED_IPS', '').split(',')
+    # Optional rule file with lines such as "deny 10.0.0.0/8", reloaded when it changes
+    IP_FILTER_FILE = os.getenv('IP_FILTER_FILE')
+    IP_FILTER_RELOAD_INTERVAL = int(os.getenv('IP_FILTER_RELOAD_INTERVAL', 5))
\ No newline at end of file
@@ -1,5 +1,5 @@
 from website import create_app, db
-from sqlalchemy import inspect
+from sqlalchemy import inspect, text
 
 # Import all models from models.py dynamically
 from website.models import * 
@@ -52,6 +52,43 @@ def create_tables():
             else:
                 print("Tables already exist in the database.")
                 print("Existing tables:", existing_tables)
+
+            # Add nullable columns added to existing tables since they were created
+            new_columns = []
+            insp = inspect(db.engine)
+            for Model in model_classes:
+                table_name = Model.__table__.name
+                if table_name in new_tables:
+                    continue
+                existing_columns = {column['name'] for column in insp.get_columns(table_name)}
+                for column in Model.__table__.columns:
+                    if column.name not in existing_columns and column.nullable:
+                        column_type = column.type.compile(dialect=db.engine.dialect)
+                        with db.engine.begin() as conn:
+                            conn.execute(text(f'ALTER TABLE {table_name} ADD COLUMN {column.name} {column_type}'))
+                        new_columns.append(f'{table_name}.{column.name}')
+
+            if new_columns:
+                print("New columns added:", new_columns)
+                # Fill the classroom of rankings created before the column existed
+                if 'ranking.classroom_id' in new_columns:
+                    from website.leaderboard import backfill_ranking_classrooms
+                    print("Rankings backfilled with classroom:", backfill_ranking_classrooms())
+
+            # Create indexes added to existing tables since they were created
+            new_indexes = []
+            for Model in model_classes:
+                table_name = Model.__table__.name
+                if table_name in new_tables:
+                    continue
+                existing_indexes = {index['name'] for index in insp.get_indexes(table_name)}
+                for index in Model.__table__.indexes:
+                    if index.name not in existing_indexes:
+                        index.create(db.engine)
+                        new_indexes.append(index.name)
+
+            if new_indexes:
+                print("New indexes created:", new_indexes)
             
     except Exception as e:
         print(f"Error creating tables: {e}")
@@ -0,0 +1,106 @@
+# Shared setup for the benchmark scripts in this folder, run them from the repository root,
+# e.g. python scripts/bench_emails.py
+import os
+import random
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+# Make the website package importable when a script is run by path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from sqlalchemy import event, insert
+from website import db
+
+
+def bench_app(**config):
+    # A bare app on a throwaway SQLite database, without the scheduler, mail and rate limiter that create_app starts.
+    # BENCH_DATABASE_URI points the benchmarks at another server instead, it must be an empty database
+    directory = tempfile.mkdtemp(prefix='grumpy-bench-')
+    # Named after the package so the templates folder resolves to website/templates
+    app = Flask('website', instance_path=directory)
+    app.config.update(
+        SQLALCHEMY_DATABASE_URI=os.getenv('BENCH_DATABASE_URI', 'sqlite:///' + os.path.join(directory, 'bench.db')),
+        SQLALCHEMY_TRACK_MODIFICATIONS=False,
+    )
+    app.config.update(config)
+    db.init_app(app)
+    with app.app_context():
+        from website import models  # Registers the tables with the metadata
+        db.create_all()
+    return app
+
+
+def seed_classrooms(count=8):
+    # Classrooms P01, P02, ... and their ids
+    from website.models import Classroom
+    db.session.execute(insert(Classroom.__table__), [{'code': f'P{i:02d}'} for i in range(1, count + 1)])
+    db.session.commit()
+    return [row.id for row in db.session.query(Classroom.id).order_by(Classroom.id)]
+
+
+def seed_users(count, classroom_ids, role='student'):
+    # Users inserted in bulk, students spread evenly over the classrooms, and their ids
+    from website.models import User
+    offset = db.session.query(db.func.count(User.id)).scalar()
+    db.session.execute(insert(User.__table__), [{
+        'role': role,
+        'name': f'{role.title()} {offset + i}',
+        'email': f'{role}{offset + i}@example.com',
+        'password': 'not-a-real-hash',
+        'classroom_id': classroom_ids[i % len(classroom_ids)] if role == 'student' else None,
+    } for i in range(count)])
+    db.session.commit()
+    return [row.id for row in db.session.query(User.id).filter(User.role == role).order_by(User.id)]
+
+
+def seed_rankings(week_number=1, seed=0):
+    # One ranking per student for the week with a random score, the classroom copied from the student
+    from website.models import User, Ranking
+    rng = random.Random(seed)
+    students = db.session.query(User.id, User.classroom_id).filter(User.role == 'student').order_by(User.id).all()
+    rows = []
+    for user_id, classroom_id in students:
+        score = rng.randrange(0, 101, 5)
+        rows.append({'user_id': user_id, 'week_number': week_number, 'score': score, 'module_id': week_number,
+                     'cumulative_score': score + rng.randrange(0, 100 * (week_number - 1) + 1, 5),
+                     'classroom_id': classroom_id})
+    db.session.execute(insert(Ranking.__table__), rows)
+    db.session.commit()
+    return len(rows)
+
+
+@contextmanager
+def count_statements():
+    # Every SQL statement sent to the database inside the block
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def best_of(fn, repeat=5, number=1):
+    # Seconds per call of the fastest run, the one least disturbed by anything else on the machine
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            fn()
+        best = min(best, (time.perf_counter() - started) / number)
+    return best
+
+
+def report(label, seconds, count=None):
+    # One aligned line per measurement, with the rate when the call handled several items
+    line = f'{label:<48} {seconds * 1000:10.3f} ms'
+    if count:
+        line += f'  {seconds / count * 1e6:10.2f} us/item  {count / seconds:12,.0f} items/s'
+    print(line)
@@ -0,0 +1,99 @@
+# Quiz answers per second through the answer write path. Before: the answer row committed on its own,
+# then the score, the completed quiz and the unlock each committed separately on the final answer.
+# After: the answer goes to the answer log and the attempt, scores and unlock are saved in one commit,
+# the answers reach take_quiz_answer in batches off the request path
+import argparse
+import json
+import time
+
+from _bench import bench_app, seed_classrooms, seed_users, report
+from sqlalchemy import insert
+from website import db, answer_log
+from website.answer_log import commit_with_answer
+from website.models import User, Ranking, Module, Quiz, QuizQuestion, TakeQuizAnswer
+from website.quiz_attempts import quiz_attempts
+
+QUIZ_ID = 1
+MARKS = 5
+
+
+def seed_quiz(questions):
+    db.session.add(Module(id=1, title='Week 1', week_number=1))
+    db.session.add(Quiz(id=QUIZ_ID, module_id=1, title='Week 1 quiz'))
+    db.session.flush()
+    db.session.execute(insert(QuizQuestion.__table__), [
+        {'quiz_id': QUIZ_ID, 'question': f'Question {i}', 'option_A': 'a', 'option_B': 'b', 'option_C': 'c',
+         'option_D': 'd', 'correct_option': 'A', 'marks': MARKS} for i in range(questions)])
+    db.session.commit()
+    return [row.id for row in db.session.query(QuizQuestion.id).filter(QuizQuestion.quiz_id == QUIZ_ID).order_by(QuizQuestion.id)]
+
+
+def record_result(user, total_score, commit):
+    # The writes of a quiz's final answer: score and ranking, completed quiz, then the unlock
+    user.weekly_score = json.dumps({'1': total_score})
+    user.total_score = total_score
+    db.session.add(Ranking(user_id=user.id, week_number=1, score=total_score, cumulative_score=total_score,
+                           module_id=1, classroom_id=user.classroom_id))
+    commit()
+    user.completed_quizzes = str(QUIZ_ID)
+    commit()
+    user.current_quiz = QUIZ_ID + 1
+    commit()
+
+
+def take_quiz(user_id, question_ids, single_commit):
+    # One student answering every question of an attempt correctly
+    attempt = quiz_attempts.start(user_id, QUIZ_ID, question_ids)
+    db.session.commit()
+    for _ in question_ids:
+        question_id = attempt.current_question
+        attempt.answer(True, MARKS)
+        quiz_attempts.save(attempt)
+        if single_commit:
+            if attempt.finished:
+                record_result(db.session.get(User, user_id), attempt.total_score, lambda: None)
+            commit_with_answer(user_id, QUIZ_ID, question_id, 'A', MARKS, attempt.lives)
+        else:
+            db.session.add(TakeQuizAnswer(user_id=user_id, quiz_id=QUIZ_ID, question_id=question_id,
+                                          selected_option='A', score=MARKS, lives=attempt.lives))
+            db.session.commit()
+            if attempt.finished:
+                record_result(db.session.get(User, user_id), attempt.total_score, db.session.commit)
+            db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Quiz answer throughput benchmark')
+    parser.add_argument('--students', type=int, default=50, help='students taking the quiz in each mode')
+    parser.add_argument('--questions', type=int, default=20, help='questions per attempt')
+    parser.add_argument('--no-fsync', action='store_true', help='do not fsync the answer log, ANSWER_LOG_FSYNC=False')
+    args = parser.parse_args()
+
+    app = bench_app(ANSWER_LOG_FSYNC=not args.no_fsync, ANSWER_LOG_FLUSH_SIZE=200, ANSWER_LOG_FLUSH_MS=500)
+    answer_log.init_app(app)
+    with app.app_context():
+        classroom_ids = seed_classrooms()
+        question_ids = seed_quiz(args.questions)
+        student_ids = seed_users(args.students * 2, classroom_ids)
+        answers = args.students * args.questions
+        print(f'{args.students} students x {args.questions} answers per mode, database {db.engine.url.drivername}')
+
+        for label, students, single_commit in (('commit per step (before)', student_ids[:args.students], False),
+                                               ('answer log, one commit (after)', student_ids[args.students:], True)):
+            started = time.perf_counter()
+            for user_id in students:
+                take_quiz(user_id, question_ids, single_commit)
+            report(label, time.perf_counter() - started, answers)
+
+        # Writing the logged answers happens on a background thread in production, timed here on its own
+        started = time.perf_counter()
+        answer_log.flush()
+        report('answer log drain to take_quiz_answer', time.perf_counter() - started)
+        saved = db.session.query(db.func.count(TakeQuizAnswer.id)).scalar()
+        print(f'take_quiz_answer rows: {saved}, expected {answers * 2}')
+        metrics = answer_log.metrics()
+        print(f"answer log: {metrics['flushes']} flushes, {metrics['avg_batch']:.1f} answers per insert, {metrics['buffered']} still buffered")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+# Per-classroom leaderboard at 10k students: the range scan of the (week_number, classroom_id, score)
+# index against filtering the week's rankings through a join on User.classroom_id
+import argparse
+
+from _bench import bench_app, seed_classrooms, seed_users, seed_rankings, best_of, report
+from sqlalchemy import text
+from website import db
+from website.models import User, Ranking
+from website.leaderboard import classroom_leaderboard
+
+
+def join_leaderboard(week_number, classroom_id, limit):
+    # The same board found by joining every ranking of the week to its student to read the classroom
+    rows = db.session.query(User.name, User.image_file, User.id, Ranking.score, Ranking.cumulative_score) \
+        .join(User, User.id == Ranking.user_id) \
+        .filter(Ranking.week_number == week_number, User.classroom_id == classroom_id) \
+        .order_by(Ranking.score.desc(), Ranking.id) \
+        .limit(limit).all()
+    return [{'name': row.name, 'pfp': row.image_file, 'userid': row.id, 'score': row.score,
+             'cumulative_score': row.cumulative_score} for row in rows]
+
+
+def explain(query):
+    # SQLite's plan, to show which index the query uses
+    statement = query.statement.compile(db.engine, compile_kwargs={'literal_binds': True})
+    for row in db.session.execute(text(f'EXPLAIN QUERY PLAN {statement}')):
+        print('    ' + row[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Classroom leaderboard benchmark')
+    parser.add_argument('--students', type=int, default=10000)
+    parser.add_argument('--weeks', type=int, default=8)
+    parser.add_argument('--limit', type=int, default=1000, help='LEADERBOARD_LIMIT')
+    args = parser.parse_args()
+
+    app = bench_app(LEADERBOARD_LIMIT=args.limit)
+    with app.app_context():
+        classroom_ids = seed_classrooms()
+        seed_users(args.students, classroom_ids)
+        for week in range(1, args.weeks + 1):
+            seed_rankings(week, seed=week)
+        week, classroom_id = args.weeks, classroom_ids[0]
+        print(f'{args.students} students in {len(classroom_ids)} classrooms, {args.students * args.weeks} rankings over {args.weeks} weeks')
+
+        indexed = classroom_leaderboard(week, classroom_id, args.limit)
+        joined = join_leaderboard(week, classroom_id, args.limit)
+        print(f'{len(indexed)} rows, same board from both queries: {indexed == joined}')
+
+        report('join on User.classroom_id (before)', best_of(lambda: join_leaderboard(week, classroom_id, args.limit), number=20))
+        report('(week, classroom, score) index (after)', best_of(lambda: classroom_leaderboard(week, classroom_id, args.limit), number=20))
+
+        if db.engine.dialect.name == 'sqlite':
+            print('\nPlan before')
+            explain(db.session.query(Ranking.id).join(User, User.id == Ranking.user_id)
+                    .filter(Ranking.week_number == week, User.classroom_id == classroom_id)
+                    .order_by(Ranking.score.desc(), Ranking.id))
+            print('Plan after')
+            explain(db.session.query(Ranking.id).join(User, User.id == Ranking.user_id)
+                    .filter(Ranking.week_number == week, Ranking.classroom_id == classroom_id)
+                    .order_by(Ranking.score.desc(), Ranking.id))
+
+
+if __name__ == '__main__':
+    main()
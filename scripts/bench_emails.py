@@ -0,0 +1,88 @@
+# Cost of building notification emails: the cached Jinja templates against the inline
+# f-string bodies they replaced
+import argparse
+import time
+from datetime import datetime
+
+from _bench import bench_app, best_of, report
+from flask_mail import Message
+from website.emails import build_email, SENDER
+
+# Every value any email template uses, templates ignore the ones they do not need
+CONTEXT = {
+    'recipient_name': 'Tan Ah Kow & Co <Student>',
+    'otp': '482913',
+    'timestamp': datetime(2024, 8, 1, 13, 30).strftime('%d/%m/%y %I:%M:%S %p'),
+    'token': 'a' * 32,
+    'lockout_end': datetime(2024, 8, 1, 13, 40).strftime('%d/%m/%Y %I:%M:%S %p'),
+    'attempts': [('1st', '01/08/2024 01:30:00 PM'), ('2nd', '01/08/2024 01:31:00 PM'), ('3rd', '01/08/2024 01:32:00 PM')],
+    'password': 'Temp#Passw0rd',
+}
+
+TEMPLATES = ['otp', 'first_login', 'suspicious_login', 'account_deactivation', 'forget_password', 'reset_password',
+             'reset_password_suspension', 'student_account_setup', 'staff_account_setup', 'virus_liability',
+             'deactivation_warning', 'reactivation_warning', 'forget_password_unsuccessful']
+
+
+def legacy_otp_email(recipient_name, recipient_email, otp):
+    # send_otp_email before the templates, kept here as the baseline
+    msg = Message('Your One-Time Password (OTP)', sender=SENDER, recipients=[recipient_email])
+    msg.html = f"""
+    <html>
+        <body>
+            <p>Dear {recipient_name},</p>
+            <p>Welcome to grumPY! Please use the following One-Time Password (OTP) to complete your login process:</p>
+            <p style="font-size: 1.2em;"><strong>OTP: {otp}</strong></p>
+            <p style="color: red;">Do not share this OTP with anyone.</p>
+            <p>Please note that this code will expire in 5 minutes.</p>
+            <p>If you did not request this OTP, please ignore this email.</p>
+            <p style="margin-top: 30px;">Best regards,<br>The grumPY team</p>
+            <hr>
+            <p style="color: grey; font-size: smaller;">
+                Note: This email and any attachments are confidential and may also be privileged.
+                If you are not the addressee, do not disclose, copy, circulate or in any other way use or rely on the information contained in this email or any attachments.
+                If received in error, please delete this email and any attachments from your system.
+            </p>
+            <p style="color: grey; font-size: smaller; font-style: italic;">
+                This is an auto-generated email; please do not reply.
+            </p>
+        </body>
+    </html>
+    """
+    return msg
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Email rendering benchmark')
+    parser.add_argument('--messages', type=int, default=5000, help='emails built per run')
+    args = parser.parse_args()
+
+    app = bench_app()
+    with app.app_context():
+        # The first render compiles the template, which every later email skips
+        started = time.perf_counter()
+        build_email('Your One-Time Password (OTP)', 'student@example.com', 'otp', **CONTEXT)
+        report('otp first render (compile + render)', time.perf_counter() - started)
+
+        def legacy():
+            for i in range(args.messages):
+                legacy_otp_email(CONTEXT['recipient_name'], f'student{i}@example.com', CONTEXT['otp'])
+
+        def templated():
+            for i in range(args.messages):
+                build_email('Your One-Time Password (OTP)', f'student{i}@example.com', 'otp', **CONTEXT)
+
+        print(f'{args.messages} OTP emails per run, best of 5')
+        report('otp, inline f-string (before)', best_of(legacy), args.messages)
+        report('otp, cached template (after)', best_of(templated), args.messages)
+
+        print(f'\nEvery template, {args.messages} emails per run')
+        for template in TEMPLATES:
+            def render(template=template):
+                for i in range(args.messages):
+                    build_email('Benchmark', f'student{i}@example.com', template, **CONTEXT)
+            report(template, best_of(render, repeat=3), args.messages)
+
+
+if __name__ == '__main__':
+    main()
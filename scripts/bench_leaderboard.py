@@ -0,0 +1,81 @@
+# Weekly leaderboard cost as the cohort grows: the per-row User lookups the rankings pages used to do,
+# against the single joined query that builds a board and the in-memory board that serves it afterwards.
+# Exits with 1 when the statements per page view grow with the cohort
+import argparse
+import sys
+
+from _bench import bench_app, seed_classrooms, seed_users, seed_rankings, count_statements, best_of, report
+from website import db
+from website.models import User, Ranking
+from website.leaderboard import LeaderboardEngine
+
+WEEK = 1
+
+
+def legacy_leaderboard(week_number):
+    # student.rankings before the leaderboard layer, three lookups per ranking row
+    rankings = Ranking.query.filter_by(week_number=week_number).order_by(Ranking.score.desc()).all()
+    return [
+        {
+            'name': User.query.get(rank.user_id).name,
+            'pfp': User.query.get(rank.user_id).image_file,
+            'userid': User.query.get(rank.user_id).id,
+            'score': rank.score,
+            'cumulative_score': rank.cumulative_score
+        }
+        for rank in rankings
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Leaderboard query benchmark')
+    parser.add_argument('--cohorts', type=int, nargs='+', default=[100, 800, 3200])
+    parser.add_argument('--limit', type=int, default=1000, help='LEADERBOARD_LIMIT')
+    args = parser.parse_args()
+
+    counts = {}
+    for students in args.cohorts:
+        app = bench_app(LEADERBOARD_LIMIT=args.limit)
+        with app.app_context():
+            classroom_ids = seed_classrooms()
+            seed_users(students, classroom_ids)
+            seed_rankings(WEEK)
+            print(f'\n{students} students')
+
+            # Each page view starts with an empty session, like a new request
+            def legacy():
+                db.session.remove()
+                return legacy_leaderboard(WEEK)
+
+            def cold():
+                # A worker's first view of the week, or the view after the refresh interval, builds the board
+                db.session.remove()
+                return LeaderboardEngine().top(WEEK, args.limit)
+
+            engine = LeaderboardEngine()
+            engine.top(WEEK, args.limit)
+
+            def warm():
+                return engine.top(WEEK, args.limit)
+
+            for label, view in (('per-row lookups (before)', legacy), ('board build, one query', cold),
+                                ('in-memory board', warm)):
+                with count_statements() as statements:
+                    rows = view()
+                counts.setdefault(label, []).append(len(statements))
+                print(f'  {label:<30} {len(rows):6d} rows {len(statements):6d} statements')
+            report('  per-row lookups (before)', best_of(legacy, repeat=3))
+            report('  board build, one query', best_of(cold))
+            report('  in-memory board', best_of(warm, number=100))
+
+    print()
+    failures = [label for label, values in counts.items() if label != 'per-row lookups (before)' and len(set(values)) > 1]
+    for label, values in counts.items():
+        print(f'{label:<30} statements per cohort: {values}')
+    if failures:
+        print('FAIL: statements grow with the cohort for ' + ', '.join(failures))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
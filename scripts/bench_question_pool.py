@@ -0,0 +1,99 @@
+# Picking the questions of a quiz attempt from a 5,000-question bank: the subset-sum sampler of
+# QuestionPool against the greedy random pick it replaced. The sampler is first checked against a
+# brute-force search on small random pools, exits with 1 when it misses a set or returns a wrong one
+import argparse
+import itertools
+import random
+import sys
+import time
+from collections import Counter
+
+from _bench import best_of, report
+from website.question_pool import QuestionPool, QUIZ_TOTAL_MARKS
+
+
+def legacy_greedy(rows, rng):
+    # student.quiz before the question pools, on (id, marks) rows instead of QuizQuestion objects
+    all_questions = list(rows)
+    selected_questions = []
+    total_marks = 0
+    while total_marks < 100 and all_questions:
+        question = rng.choice(all_questions)
+        all_questions.remove(question)
+        if total_marks + question[1] <= 100:
+            selected_questions.append(question[0])
+            total_marks += question[1]
+    return selected_questions if total_marks == 100 else None
+
+
+def has_exact_set(marks, target):
+    # Brute force over every subset, only usable on small pools
+    return any(sum(combination) == target
+               for size in range(1, len(marks) + 1) for combination in itertools.combinations(marks, size))
+
+
+def check_correctness(trials, rng):
+    failures = 0
+    for _ in range(trials):
+        rows = [(question_id, rng.choice([5, 10, 15, 20, 25, 30, 35, 40, 45, 50, 60, 70]))
+                for question_id in range(1, rng.randint(1, 14))]
+        marks = dict(rows)
+        pool = QuestionPool(rows)
+        selected = pool.sample(rng=rng)
+        expected = has_exact_set(list(marks.values()), QUIZ_TOTAL_MARKS)
+        if selected is None:
+            ok = not expected
+        else:
+            ok = len(set(selected)) == len(selected) and sum(marks[question_id] for question_id in selected) == QUIZ_TOTAL_MARKS
+        if not ok:
+            failures += 1
+            print(f'FAIL: marks {sorted(marks.values())}, exact set exists: {expected}, picked {selected}')
+    print(f'{trials} random small pools checked against brute force, {failures} failures')
+    return failures
+
+
+def bank(size, marks, rng):
+    return [(question_id, rng.choice(marks)) for question_id in range(1, size + 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Question selection benchmark')
+    parser.add_argument('--questions', type=int, default=5000)
+    parser.add_argument('--selections', type=int, default=200, help='selections per timed run')
+    parser.add_argument('--trials', type=int, default=2000, help='small pools checked against brute force')
+    args = parser.parse_args()
+    rng = random.Random(0)
+
+    failures = check_correctness(args.trials, rng)
+
+    # A typical bank, and one where the greedy pick gets stuck whenever it draws a 60 first
+    banks = {
+        'mixed marks 5 to 25': bank(args.questions, [5, 10, 15, 20, 25], rng),
+        'marks 50 and 60': bank(args.questions, [50, 60], rng),
+    }
+    for name, rows in banks.items():
+        print(f'\n{len(rows)} questions, {name}')
+        started = time.perf_counter()
+        pool = QuestionPool(rows)
+        report('  pool build', time.perf_counter() - started)
+
+        outcomes = Counter()
+
+        def greedy():
+            for _ in range(args.selections):
+                outcomes['greedy ok' if legacy_greedy(rows, rng) else 'greedy failed'] += 1
+
+        def sampler():
+            for _ in range(args.selections):
+                outcomes['sampler ok' if pool.sample(rng=rng) else 'sampler failed'] += 1
+
+        report('  greedy random pick (before)', best_of(greedy, repeat=3), args.selections)
+        report('  subset-sum sampler (after)', best_of(sampler, repeat=3), args.selections)
+        print('  ' + ', '.join(f'{outcome}: {count}' for outcome, count in sorted(outcomes.items())))
+        failures += outcomes['sampler failed']
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
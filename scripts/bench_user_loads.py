@@ -0,0 +1,73 @@
+# Statements sent per User load. Loading a user must not query staff_classroom as well, only the
+# pages that list classrooms load the association, with selectinload. Exits with 1 when a count regresses
+import argparse
+import sys
+
+from _bench import bench_app, seed_classrooms, seed_users, count_statements, best_of, report
+from sqlalchemy import insert
+from sqlalchemy.orm import selectinload
+from website import db
+from website.models import User, staff_classroom
+
+
+def main():
+    parser = argparse.ArgumentParser(description='User load query count check')
+    parser.add_argument('--students', type=int, default=800)
+    parser.add_argument('--staff', type=int, default=40)
+    args = parser.parse_args()
+
+    app = bench_app()
+    with app.app_context():
+        classroom_ids = seed_classrooms()
+        student_ids = seed_users(args.students, classroom_ids)
+        staff_ids = seed_users(args.staff, classroom_ids, role='staff')
+        # Every staff member teaches two classrooms
+        db.session.execute(insert(staff_classroom), [
+            {'staff_id': staff_id, 'classroom_id': classroom_ids[(i + offset) % len(classroom_ids)]}
+            for i, staff_id in enumerate(staff_ids) for offset in (0, 1)])
+        db.session.commit()
+
+        failures = []
+
+        def check(label, statements, expected):
+            ok = len(statements) == expected
+            print(f'{label:<48} {len(statements):6d} statements, expected {expected:6d}  {"ok" if ok else "FAIL"}')
+            if not ok:
+                failures.append(label)
+                for statement in statements[:5]:
+                    print('    ' + ' '.join(statement.split())[:160])
+
+        # A single load, as done by the user loader on a cache miss
+        for label, user_id in (('student load', student_ids[0]), ('staff load', staff_ids[0])):
+            db.session.remove()
+            with count_statements() as statements:
+                db.session.get(User, user_id)
+            check(label, statements, 1)
+
+        # One load per student, as in a loop over the rankings
+        db.session.remove()
+        with count_statements() as statements:
+            for user_id in student_ids:
+                db.session.get(User, user_id)
+        check(f'{len(student_ids)} student loads', statements, len(student_ids))
+
+        # The teaching team page loads every staff member's classrooms in one more statement
+        db.session.remove()
+        with count_statements() as statements:
+            staff = User.query.filter_by(role='staff').options(selectinload(User.staff_user)).all()
+            codes = [[classroom.code for classroom in member.staff_user] for member in staff]
+        check(f'teaching team, {len(codes)} staff', statements, 2)
+
+        def load_students():
+            db.session.remove()
+            for user_id in student_ids:
+                db.session.get(User, user_id)
+
+        print()
+        report(f'{len(student_ids)} student loads', best_of(load_students), len(student_ids))
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
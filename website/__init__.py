@@ -10,12 +10,27 @@ from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from config import Config
 from datetime import timedelta
+from .hashing import PasswordHasher, HashingServiceBusy
+from .recaptcha import RecaptchaVerifier
+from .identity import IdentityCache
+from .ip_filter import IPFilter
+from .ratelimit_storage import request_cost
+from .audit import AuditLogWriter
+from .answer_log import AnswerLog
+from .live_leaderboard import LeaderboardBroadcaster
 
-# Initialise SQLAlchemy, CSRFProtect, Flask-Mail, and Bcrypt
+# Initialise SQLAlchemy, CSRFProtect, Flask-Mail, Bcrypt, the password hashing pool and the reCAPTCHA verifier
 db = SQLAlchemy()
 csrf = CSRFProtect()
 mail = Mail()
 bcrypt = Bcrypt()
+password_hasher = PasswordHasher()
+recaptcha = RecaptchaVerifier()
+identity_cache = IdentityCache()
+ip_filter = IPFilter()
+audit_log = AuditLogWriter()
+answer_log = AnswerLog()
+live_leaderboard = LeaderboardBroadcaster()
 scheduler = BackgroundScheduler()
 
 def create_app():
@@ -30,21 +45,64 @@ def create_app():
         SESSION_COOKIE_HTTPONLY=True,     # Ensure cookies are only sent over HTTPS (recommended)
     )
 
-    # Initialise SQLAlchemy, CSRFProtect, Flask-Mail and Bcrypt with the app
+    # Initialise SQLAlchemy, CSRFProtect, Flask-Mail, Bcrypt, the password hashing pool and the reCAPTCHA verifier with the app
     db.init_app(app)
     csrf.init_app(app)
     mail.init_app(app)
     bcrypt.init_app(app)
+    password_hasher.init_app(app)
+    recaptcha.init_app(app)
+    identity_cache.init_app(app)
+    ip_filter.init_app(app)
+    audit_log.init_app(app)
+    answer_log.init_app(app)
+    live_leaderboard.init_app(app)
 
     # Initialize and start the APScheduler here
     scheduler.start()
 
+    # Sweep expired OTPs from all users in bulk every minute
+    from .otp import sweep_expired_otps
+    scheduler.add_job(func=sweep_expired_otps, trigger='interval', minutes=1, args=[app],
+                      id='sweep_expired_otps', replace_existing=True)
+
+    # Deliver queued emails in the background over a reused SMTP connection
+    from .mail_queue import dispatch_mail_queue
+    scheduler.add_job(func=dispatch_mail_queue, trigger='interval', seconds=app.config['MAIL_DISPATCH_INTERVAL'], args=[app],
+                      id='dispatch_mail_queue', replace_existing=True)
+
+    # Write buffered audit events even when no new event arrives to trigger a flush
+    from .audit import flush_audit_log
+    scheduler.add_job(func=flush_audit_log, trigger='interval', seconds=app.config['AUDIT_LOG_FLUSH_INTERVAL'], args=[app],
+                      id='flush_audit_log', replace_existing=True)
+
+    # Move old logs out of the hot table into compressed monthly archives once a day
+    from .log_archive import archive_old_logs
+    scheduler.add_job(func=archive_old_logs, trigger='cron', hour=app.config['LOG_ARCHIVE_HOUR'], args=[app],
+                      id='archive_old_logs', replace_existing=True)
+
+    # Write logged quiz answers to the database in batches, and replay the answer logs of workers that died
+    from .answer_log import flush_answer_log, replay_answer_log
+    scheduler.add_job(func=flush_answer_log, trigger='interval', seconds=app.config['ANSWER_LOG_FLUSH_MS'] / 1000, args=[app],
+                      id='flush_answer_log', replace_existing=True)
+    scheduler.add_job(func=replay_answer_log, trigger='interval', minutes=1, args=[app],
+                      id='replay_answer_log', replace_existing=True)
+
+    # Delete quiz attempts abandoned before the end
+    from .quiz_attempts import sweep_quiz_attempts
+    scheduler.add_job(func=sweep_quiz_attempts, trigger='interval', hours=1, args=[app],
+                      id='sweep_quiz_attempts', replace_existing=True)
+
     #Initialize Flask-Limiter
+    # Counters live in shared storage so every worker enforces the same limit and restarts keep them
     limiter = Limiter(
         key_func=get_remote_address,  # Use the IP address for rate limiting
         app=app,
-        default_limits=["30 per minute"]  # Set a default limit for all routes for each user
+        default_limits=["30 per minute"],  # Set a default limit for all routes for each user
         # default_limits=["100 per minute"]  # This was the deafult given
+        default_limits_cost=request_cost,  # Weight requests by route, e.g. login POSTs cost more than page views
+        storage_uri=app.config['RATELIMIT_STORAGE_URI'],
+        strategy='fixed-window'
     )
 
     app.extensions['limiter'] = limiter  # Store limiter in app's extensions
@@ -79,17 +137,15 @@ def create_app():
     # Import the User model
     from .models import User
 
-    # Query the database for a user with the given id
+    # Load the slim identity projection for the user with the given id, from the cache when possible
     @login_manager.user_loader
     def load_user(id):
-        return User.query.get(int(id))
+        return identity_cache.load(int(id))
     
     @app.before_request
     def check_ip():
-        ip = request.remote_addr
-        if ip in app.config['BLACKLISTED_IPS']:
-            abort(403)  # Forbidden
-        if app.config['WHITELISTED_IPS'] and ip not in app.config['WHITELISTED_IPS']:
+        # Deny rules win, and when any allow rule exists only matching addresses get through
+        if not ip_filter.is_allowed(request.remote_addr):
             abort(403)  # Forbidden
 
     @app.before_request
@@ -116,12 +172,15 @@ def create_app():
                 flash("Unauthorised access", category='danger')
                 return redirect(url_for('staff.classroom'))
             
+            # session_token and is_active come from the database on every request, see AUTH_FIELDS
             if not session_token or session_token != current_user.session_token:
+                identity_cache.invalidate(current_user.id)
                 logout_user()
                 flash('Your session has expired or is invalid.', category='danger')
                 return redirect(url_for('auth.login'))
             
         if current_user.is_active == "No":
+            identity_cache.invalidate(current_user.id)
             logout_user()
             flash('Your session has been closed.', category='danger')
             return redirect(url_for('auth.login'))
@@ -176,6 +235,12 @@ def create_app():
         logout_user()
         return render_template('errorpage.html'), 429
     
+    # Error handler for a full password hashing queue
+    @app.errorhandler(HashingServiceBusy)
+    def hashing_busy_handler(e):
+        flash('The server is busy, please try again in a moment.', category='danger')
+        return redirect(request.path)
+
     @app.errorhandler(CSRFError)
     def handle_csrf_error(e):
         # Flash the CSRF error message with a category 'danger'
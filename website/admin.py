@@ -1,13 +1,21 @@
-from flask import Blueprint, render_template, flash, redirect, url_for, request, current_app as app
+from flask import Blueprint, render_template, flash, redirect, url_for, request, jsonify, Response, stream_with_context, current_app as app
 from flask_login import login_required, current_user
+from sqlalchemy.orm import selectinload
 from datetime import datetime, timedelta
 from .session import session_timeout
-from .week import get_current_week_and_time
+from .week import get_current_week_and_time, invalidate_calendar
 from .models import User, Classroom, Logs, Quiz, QuizQuestion, Module, Labsheet, LabsheetQuestion, AdminSettings
 from .forms import AddStaffFileForm, AddStaffForm, UploadQuizForm, EditQuestionForm, DeleteQuestionForm, AddModuleForm, LabsheetForm, QuestionForm, UploadLabsheetForm, StartDateForm
-from .emails import send_staff_account_setup_email, send_deactivation_warning_email, send_reactivation_warning_email
-from .logs import log_user_activity
-from . import db, bcrypt, scheduler
+from .emails import send_staff_account_setup_email, send_deactivation_warning_email, send_reactivation_warning_email, build_deactivation_warning_email
+from .logs import log_user_activity, log_context, log_filters, logs_page, log_filter_options, serialize_log, export_logs
+from .identity import invalidate_identity
+from .mail_queue import mail_queue_stats, enqueue_bulk, batch_status
+from .ratelimit_storage import rate_limit_snapshot
+from .log_archive import search_archives, archive_stats
+from .leaderboard import engine as leaderboard_engine
+from .question_pool import pools as question_pools, questions as question_cache, bump_question_version
+from .quiz_attempts import quiz_attempts
+from . import db, bcrypt, scheduler, password_hasher, recaptcha, identity_cache, ip_filter, audit_log, answer_log, live_leaderboard
 import pandas as pd
 import random 
 import string
@@ -48,6 +56,8 @@ def dashboard():
             db.session.add(setting)
 
         db.session.commit()
+        # Recompute the week boundaries from the new start date
+        invalidate_calendar()
         flash("Start date updated successfully", category='success')
         return redirect(url_for('admin.dashboard'))
 
@@ -91,14 +101,13 @@ def deactivate_students():
     if users:
         sg_tz = pytz.timezone('Asia/Singapore')
         deactivation_time = datetime.now(sg_tz) + timedelta(minutes=5)
+        recipients = []
 
         for user in users:
             # Update the user status to "pending_deactivation"
             user.is_active = 'Pend'
             user.deactivation_time = deactivation_time
-
-            # Notify the user
-            send_deactivation_warning_email(user.email, user.name, user.deactivation_time)
+            recipients.append((user.email, user.name, deactivation_time))
             
             # Schedule the deactivation job and pass the app instance
             schedule_deactivation(app._get_current_object(), user.id, deactivation_time)
@@ -106,7 +115,10 @@ def deactivate_students():
         # Commit the changes after all students have been processed
         db.session.commit()
 
-        flash("All students will be logged out and deactivated in 5 minutes", category='success')
+        # Notify all the users in one batch
+        batch = enqueue_bulk('Deactivation notice', build_deactivation_warning_email, recipients)
+
+        flash(f"All students will be logged out and deactivated in 5 minutes (notification batch #{batch.id})", category='success')
 
     else:
         flash("No students found", category='danger')
@@ -126,14 +138,13 @@ def deactivate_all():
     if users:
         sg_tz = pytz.timezone('Asia/Singapore')
         deactivation_time = datetime.now(sg_tz) + timedelta(minutes=5)
+        recipients = []
 
         for user in users:
             # Update the user status to "pending_deactivation"
             user.is_active = 'Pend'
             user.deactivation_time = deactivation_time
-
-            # Notify the user
-            send_deactivation_warning_email(user.email, user.name, user.deactivation_time)
+            recipients.append((user.email, user.name, deactivation_time))
 
             # Schedule the deactivation job and pass the app instance
             schedule_deactivation(app._get_current_object(), user.id, deactivation_time)
@@ -141,7 +152,10 @@ def deactivate_all():
         # Commit the changes after all users have been processed
         db.session.commit()
 
-        flash("All students and staff will be logged out and deactivated in 5 minutes", category='success')
+        # Notify all the users in one batch
+        batch = enqueue_bulk('Deactivation notice', build_deactivation_warning_email, recipients)
+
+        flash(f"All students and staff will be logged out and deactivated in 5 minutes (notification batch #{batch.id})", category='success')
 
     else:
         flash("No students or staff found", category='danger')
@@ -189,6 +203,7 @@ def deactivate_user_account(app, user_id):
             user.is_active = 'No'
             user.session_token = None
             db.session.commit()
+            invalidate_identity(user.id)
 
 #Make User Active from Inactive
 @admin.route('/make_active/<string:email>', methods=['POST'])
@@ -254,7 +269,8 @@ def teaching_team():
     current_week, _ = get_current_week_and_time()
     search_query = request.args.get('query', '').strip()
     
-    staff_members_query = User.query.filter_by(role='staff')
+    # Load every staff member's classrooms in one extra query rather than one per staff member
+    staff_members_query = User.query.filter_by(role='staff').options(selectinload(User.staff_user))
 
     if search_query:
         staff_members_query = staff_members_query.filter(
@@ -505,8 +521,96 @@ def logs():
         flash("Unauthorised access", category='danger')
         return redirect(url_for('staff.classroom') if current_user.role == 'staff' else url_for('student.dashboard'))
     current_week,_ = get_current_week_and_time()
-    logs = Logs.query.order_by(Logs.timestamp.desc()).all()
-    return render_template('logs.html', user=current_user, logs=logs, current_week=current_week)
+    # Render only the first page, the rest is loaded from logs_data while scrolling
+    filters = log_filters(request.args)
+    logs, next_cursor = logs_page(filters, limit=app.config['LOGS_PAGE_SIZE'])
+    return render_template('logs.html', user=current_user, logs=logs, next_cursor=next_cursor, filters=filters,
+                           options=log_filter_options(), current_week=current_week)
+
+@admin.route('/logs/data', methods=['GET'])
+@login_required
+@session_timeout
+def logs_data():
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Unauthorised access'}), 403
+
+    # Return the page of logs after the cursor for infinite scroll
+    limit = min(request.args.get('limit', app.config['LOGS_PAGE_SIZE'], type=int), 200)
+    logs, next_cursor = logs_page(log_filters(request.args), request.args.get('cursor'), max(limit, 1))
+    return jsonify({'logs': [serialize_log(log) for log in logs], 'next_cursor': next_cursor})
+
+@admin.route('/logs/export', methods=['GET'])
+@login_required
+@session_timeout
+def logs_export():
+    if current_user.role != 'admin':
+        flash("Unauthorised access", category='danger')
+        return redirect(url_for('staff.classroom') if current_user.role == 'staff' else url_for('student.dashboard'))
+
+    # Stream the filtered logs as CSV or JSON Lines, optionally gzip'd, without holding them in memory
+    filters = log_filters(request.args)
+    fmt = 'jsonl' if request.args.get('format') == 'jsonl' else 'csv'
+    compress = request.args.get('gzip') == '1'
+    filename = f"logs-{datetime.now().strftime('%Y%m%d-%H%M%S')}.{fmt}" + ('.gz' if compress else '')
+    log_user_activity(current_user.id, 'pass', 'Export Logs', f'Exported logs as {filename}.', **log_context(current_user))
+
+    return Response(
+        stream_with_context(export_logs(filters, fmt, compress)),
+        mimetype='application/gzip' if compress else ('text/csv' if fmt == 'csv' else 'application/x-ndjson'),
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
+@admin.route('/logs/archive', methods=['GET'])
+@login_required
+@session_timeout
+def logs_archive():
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Unauthorised access'}), 403
+
+    # Search the archived logs with the same filters as the logs view, plus a text search on the description
+    limit = min(request.args.get('limit', 1000, type=int), 10000)
+    results = list(search_archives(app, log_filters(request.args), request.args.get('q'), max(limit, 1)))
+    return jsonify({'logs': results, 'count': len(results)})
+
+@admin.route('/notifications/<int:batch_id>', methods=['GET'])
+@login_required
+@session_timeout
+def notification_status(batch_id):
+    if current_user.role != 'admin':
+        flash("Unauthorised access", category='danger')
+        return redirect(url_for('staff.classroom') if current_user.role == 'staff' else url_for('student.dashboard'))
+
+    # Report the delivery status of every recipient in a bulk notification
+    status = batch_status(batch_id)
+    if not status:
+        return jsonify({'error': 'Notification batch not found'}), 404
+    return jsonify(status)
+
+@admin.route('/metrics', methods=['GET'])
+@login_required
+@session_timeout
+def metrics():
+    if current_user.role != 'admin':
+        flash("Unauthorised access", category='danger')
+        return redirect(url_for('staff.classroom') if current_user.role == 'staff' else url_for('student.dashboard'))
+
+    # Collect the runtime metrics of the background services in this worker
+    return jsonify({
+        'password_hashing': password_hasher.metrics(),
+        'mail_queue': mail_queue_stats(),
+        'recaptcha': recaptcha.metrics(),
+        'identity_cache': identity_cache.metrics(),
+        'ip_filter': ip_filter.metrics(),
+        'rate_limits': rate_limit_snapshot(),
+        'audit_log': audit_log.metrics(),
+        'answer_log': answer_log.metrics(),
+        'log_archive': archive_stats(app),
+        'leaderboard': leaderboard_engine.metrics(),
+        'live_leaderboard': live_leaderboard.metrics(),
+        'question_pools': question_pools.metrics(),
+        'question_cache': question_cache.metrics(),
+        'quiz_attempts': quiz_attempts.metrics(),
+    })
 
 
 
@@ -670,6 +774,8 @@ def add_quiz(module_id, quiz_id):
                 )
                 db.session.add(new_quiz_question)
 
+            bump_question_version(quiz_id)
+
         db.session.commit()
         flash('Questions added successfully!', category='success')
         return redirect(url_for('admin.quizzes_by_module', module_id=module_id, quiz_id=quiz_id))
@@ -697,6 +803,7 @@ def edit_question(question_id):
         question.option_C = form.option_C.data
         question.option_D = form.option_D.data
         question.correct_option = form.correct_option.data
+        bump_question_version(question.quiz_id)
         db.session.commit()
 
         flash('Question updated successfully!', category='success')
@@ -723,6 +830,7 @@ def delete_question(question_id):
 
         # Delete the question from the database
         db.session.delete(question)
+        bump_question_version(quiz_id)
         db.session.commit()
 
         flash('Question deleted successfully!', category='success')
@@ -0,0 +1,316 @@
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+from contextlib import ExitStack
+from datetime import datetime
+from .file_lock import file_lock, LockBusy
+import threading
+import logging
+import atexit
+import json
+import time
+import uuid
+import os
+
+# Columns of take_quiz_answer written for every answer
+ANSWER_FIELDS = ('entry_id', 'user_id', 'quiz_id', 'question_id', 'selected_option', 'score', 'lives', 'attempt_date')
+
+def _to_line(record):
+    return json.dumps(dict(record, attempt_date=record['attempt_date'].isoformat())) + '\n'
+
+def _from_line(line):
+    record = json.loads(line)
+    record['attempt_date'] = datetime.fromisoformat(record['attempt_date'])
+    return record
+
+
+class AnswerLog:
+    # Quiz answers are appended to a write-ahead file of this process and acknowledged straight away,
+    # then written to the take_quiz_answer table with multi-row inserts. A segment file is deleted only
+    # once its answers are in the database, so the segments left behind by a crashed worker are replayed
+
+    def __init__(self, app=None):
+        self.app = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._buffer = []
+        self._segment = None
+        self._last_flush = time.monotonic()
+        self._metrics = {'appended': 0, 'written': 0, 'flushes': 0, 'failed_flushes': 0, 'requeued': 0, 'dropped': 0,
+                         'replayed': 0, 'max_batch': 0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # Flush when the buffer reaches the size threshold or the time threshold passes
+        self.app = app
+        self.directory = app.config.get('ANSWER_LOG_DIR') or os.path.join(app.instance_path, 'answer_log')
+        self.flush_size = app.config.get('ANSWER_LOG_FLUSH_SIZE', 200)
+        self.flush_interval = app.config.get('ANSWER_LOG_FLUSH_MS', 500) / 1000
+        self.fsync = app.config.get('ANSWER_LOG_FSYNC', True)
+        # Write whatever is still buffered when the process exits
+        atexit.register(self.close)
+        app.extensions['answer_log'] = self
+
+    def _open_segment(self):
+        # Each segment is locked for as long as this process owns it, so replay skips it
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f'answers-{os.getpid()}-{uuid.uuid4().hex[:8]}.wal')
+        stack = ExitStack()
+        self._segment = (path, stack, stack.enter_context(file_lock(path, blocking=False)))
+
+    def _write_lines(self, records):
+        self._write_lines_raw(''.join(_to_line(record) for record in records))
+
+    def _write_lines_raw(self, data):
+        _, _, f = self._segment
+        f.write(data)
+        f.flush()
+        if self.fsync:
+            os.fsync(f.fileno())
+
+    def append(self, user_id, quiz_id, question_id, selected_option, score, lives):
+        record = {
+            'entry_id': uuid.uuid4().hex,
+            'user_id': user_id,
+            'quiz_id': quiz_id,
+            'question_id': question_id,
+            'selected_option': selected_option,
+            'score': score,
+            'lives': lives,
+            'attempt_date': datetime.utcnow(),
+        }
+        with self._lock:
+            if self._segment is None:
+                self._open_segment()
+            self._write_lines([record])
+            self._buffer.append(record)
+            self._metrics['appended'] += 1
+            due = len(self._buffer) >= self.flush_size or time.monotonic() - self._last_flush >= self.flush_interval
+        if due and not self._flush_lock.locked():
+            # The answer is safe in the segment, so the student does not wait for the database
+            threading.Thread(target=self.flush, daemon=True).start()
+        return record
+
+    def discard(self, record):
+        # The transaction the answer belonged to failed, so the answer must not be written.
+        # Holding the flush lock means the record is either still buffered or already in the database
+        with self._flush_lock:
+            with self._lock:
+                if record in self._buffer:
+                    self._buffer.remove(record)
+                    # The record stays in the segment, so leave a marker telling replay to skip it
+                    self._write_lines_raw(json.dumps({'discard': record['entry_id']}) + '\n')
+                    return
+            from .models import TakeQuizAnswer
+            from . import db
+            with self.app.app_context():
+                with db.engine.begin() as conn:
+                    conn.execute(TakeQuizAnswer.__table__.delete().where(TakeQuizAnswer.entry_id == record['entry_id']))
+
+    def _write(self, rows):
+        from .models import TakeQuizAnswer
+        from . import db
+        # Use a separate connection so the flush never commits the caller's session
+        with self.app.app_context():
+            with db.engine.begin() as conn:
+                conn.execute(insert(TakeQuizAnswer.__table__).values(rows))
+
+    def _insert(self, rows):
+        # Returns the rows to try again later, rows the database rejects outright are dropped
+        try:
+            self._write(rows)
+            return []
+        except Exception as e:
+            logging.error(f'Answer log batch of {len(rows)} answers failed, retrying individually: {str(e)}')
+
+        retry = []
+        for row in rows:
+            try:
+                self._write([row])
+            except IntegrityError as row_error:
+                # The question or student was deleted since the answer was given
+                logging.error(f'Dropping quiz answer {row}: {str(row_error)}')
+                with self._lock:
+                    self._metrics['dropped'] += 1
+            except Exception:
+                retry.append(row)
+        with self._lock:
+            self._metrics['failed_flushes'] += 1
+        return retry
+
+    def flush(self):
+        if self.app is None:
+            return 0
+        # Only one thread flushes at a time, the others keep appending to a fresh segment
+        with self._flush_lock:
+            with self._lock:
+                rows, self._buffer = self._buffer, []
+                self._last_flush = time.monotonic()
+                if not rows:
+                    return 0
+                old_path, old_stack, _ = self._segment
+                self._open_segment()
+
+            retry = self._insert(rows)
+            with self._lock:
+                if retry:
+                    # Keep the answers the database could not take in the new segment before the old one goes
+                    self._write_lines(retry)
+                    self._buffer[:0] = retry
+                    self._metrics['requeued'] += len(retry)
+                self._metrics['flushes'] += 1
+                self._metrics['written'] += len(rows) - len(retry)
+                self._metrics['max_batch'] = max(self._metrics['max_batch'], len(rows))
+
+            _retire(old_path, old_stack)
+            return len(rows) - len(retry)
+
+    def close(self):
+        # Give up the segment on exit, it is kept for replay only if the database did not take everything
+        self.flush()
+        with self._lock:
+            if self._segment is None:
+                return
+            path, stack, _ = self._segment
+            self._segment = None
+            if not self._buffer:
+                _retire(path, stack)
+            else:
+                stack.close()
+
+    def _segments(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return [os.path.join(self.directory, name) for name in sorted(os.listdir(self.directory)) if name.endswith('.wal')]
+
+    def _read(self, path):
+        records = []
+        discarded = set()
+        try:
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        if line.startswith('{"discard"'):
+                            discarded.add(json.loads(line)['discard'])
+                        else:
+                            records.append(_from_line(line))
+                    except ValueError:
+                        # The last line of a crashed worker's segment can be cut short
+                        continue
+        except FileNotFoundError:
+            pass
+        return [record for record in records if record['entry_id'] not in discarded]
+
+    def replay(self):
+        # Insert the answers of segments no live process owns, skipping any already in the database
+        from .models import TakeQuizAnswer
+        from . import db
+        replayed = 0
+        for path in self._segments():
+            try:
+                with file_lock(path, blocking=False):
+                    records = self._read(path)
+                    with self.app.app_context():
+                        entry_ids = [record['entry_id'] for record in records]
+                        existing = {row.entry_id for row in db.session.query(TakeQuizAnswer.entry_id)
+                                    .filter(TakeQuizAnswer.entry_id.in_(entry_ids))} if entry_ids else set()
+                        db.session.remove()
+                    missing = [{field: record[field] for field in ANSWER_FIELDS}
+                               for record in records if record['entry_id'] not in existing]
+                    if missing and self._insert(missing):
+                        # The database is unavailable, the segment is tried again on the next run
+                        continue
+                    replayed += len(missing)
+                    _remove_locked(path)
+                _remove(path)
+            except LockBusy:
+                continue
+        if replayed:
+            logging.info(f'Replayed {replayed} quiz answers from the answer log')
+        with self._lock:
+            self._metrics['replayed'] += replayed
+        return replayed
+
+    def pending(self, user_id, quiz_id):
+        # Answers not yet confirmed in the database by any worker on this host, read from the segments
+        records = {}
+        for path in self._segments():
+            for record in self._read(path):
+                if record['user_id'] == user_id and record['quiz_id'] == quiz_id:
+                    records[record['entry_id']] = record
+        return sorted(records.values(), key=lambda record: record['attempt_date'])
+
+    def metrics(self):
+        with self._lock:
+            flushes = self._metrics['flushes']
+            return {
+                'buffered': len(self._buffer),
+                'segments': len(self._segments()),
+                'appended': self._metrics['appended'],
+                'written': self._metrics['written'],
+                'flushes': flushes,
+                'failed_flushes': self._metrics['failed_flushes'],
+                'requeued': self._metrics['requeued'],
+                'dropped': self._metrics['dropped'],
+                'replayed': self._metrics['replayed'],
+                'avg_batch': self._metrics['written'] / flushes if flushes else 0.0,
+                'max_batch': self._metrics['max_batch'],
+            }
+
+
+def _remove_locked(path):
+    # Delete a segment while its lock is still held, so no replay can pick it up in between.
+    # Windows cannot delete an open file, there the file goes once the lock is released
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        # Already deleted while locked, or by a replay that got to it first
+        pass
+
+def _retire(path, stack):
+    _remove_locked(path)
+    stack.close()
+    _remove(path)
+
+def commit_with_answer(user_id, quiz_id, question_id, selected_option, score, lives):
+    # Log the answer before committing the attempt, so a crash in between cannot lose it.
+    # A failed commit takes the answer back out of the log
+    from flask import current_app
+    from . import db
+    answer_log = current_app.extensions['answer_log']
+    record = answer_log.append(user_id, quiz_id, question_id, selected_option, score, lives)
+    try:
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        answer_log.discard(record)
+        raise
+    return record
+
+def flush_answer_log(app):
+    # Scheduler job so answers are written within the interval even when no new answer triggers a flush
+    app.extensions['answer_log'].flush()
+
+def replay_answer_log(app):
+    app.extensions['answer_log'].replay()
+
+def quiz_answers(user_id, quiz_id):
+    # A student's answers to a quiz, oldest first, including answers still waiting in the answer log
+    from flask import current_app
+    from .models import TakeQuizAnswer
+    from . import db
+    # Read the log before the table, so an answer flushed in between is seen twice rather than missed
+    pending = current_app.extensions['answer_log'].pending(user_id, quiz_id)
+    rows = db.session.query(*[getattr(TakeQuizAnswer, field) for field in ANSWER_FIELDS]) \
+        .filter(TakeQuizAnswer.user_id == user_id, TakeQuizAnswer.quiz_id == quiz_id) \
+        .order_by(TakeQuizAnswer.id).all()
+    answers = [dict(row._mapping) for row in rows]
+    saved = {answer['entry_id'] for answer in answers if answer['entry_id']}
+    answers.extend(record for record in pending if record['entry_id'] not in saved)
+    return answers
@@ -0,0 +1,108 @@
+from sqlalchemy import insert
+import threading
+import logging
+import atexit
+import time
+
+
+class AuditLogWriter:
+    # Buffers audit events in memory and writes them to the logs table with multi-row inserts
+
+    def __init__(self, app=None):
+        self.app = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._buffer = []
+        self._last_flush = time.monotonic()
+        self._metrics = {'logged': 0, 'written': 0, 'flushes': 0, 'failed_flushes': 0, 'dropped': 0, 'max_batch': 0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # Flush when the buffer reaches the size threshold or the time threshold passes
+        self.app = app
+        self.flush_size = app.config.get('AUDIT_LOG_FLUSH_SIZE', 100)
+        self.flush_interval = app.config.get('AUDIT_LOG_FLUSH_INTERVAL', 2)
+        self.max_buffer = app.config.get('AUDIT_LOG_MAX_BUFFER', 10000)
+        # Write whatever is still buffered when the process exits
+        atexit.register(self.flush)
+        app.extensions['audit_log'] = self
+
+    def log(self, event):
+        with self._lock:
+            self._buffer.append(event)
+            self._metrics['logged'] += 1
+            # Cap the buffer so a stalled database cannot exhaust memory
+            overflow = len(self._buffer) - self.max_buffer
+            if overflow > 0:
+                del self._buffer[:overflow]
+                self._metrics['dropped'] += overflow
+            due = len(self._buffer) >= self.flush_size or time.monotonic() - self._last_flush >= self.flush_interval
+        if due and not self._flush_lock.locked():
+            # The request that fills the buffer does not wait for the insert
+            threading.Thread(target=self.flush, daemon=True).start()
+
+    def _write(self, rows):
+        from .models import Logs
+        from . import db
+        # Use a separate connection so the flush never commits the caller's session
+        with self.app.app_context():
+            with db.engine.begin() as conn:
+                conn.execute(insert(Logs.__table__).values(rows))
+
+    def flush(self):
+        if self.app is None:
+            return 0
+        # Only one thread flushes at a time, events logged meanwhile wait in the buffer for the next flush
+        with self._flush_lock:
+            with self._lock:
+                rows, self._buffer = self._buffer, []
+                self._last_flush = time.monotonic()
+            if not rows:
+                return 0
+
+            try:
+                self._write(rows)
+                written = len(rows)
+            except Exception as e:
+                # Retry the rows one by one so a single bad event does not block the whole batch
+                logging.error(f'Audit log batch of {len(rows)} events failed, retrying individually: {str(e)}')
+                written = 0
+                failed = []
+                for row in rows:
+                    try:
+                        self._write([row])
+                        written += 1
+                    except Exception as row_error:
+                        failed.append((row, row_error))
+                # Rows that still fail are dropped, the database is unlikely to accept them on a later flush
+                for row, row_error in failed:
+                    logging.error(f'Dropping audit event {row}: {str(row_error)}')
+                with self._lock:
+                    self._metrics['failed_flushes'] += 1
+                    self._metrics['dropped'] += len(failed)
+
+            with self._lock:
+                self._metrics['flushes'] += 1
+                self._metrics['written'] += written
+                self._metrics['max_batch'] = max(self._metrics['max_batch'], len(rows))
+            return written
+
+    def metrics(self):
+        with self._lock:
+            flushes = self._metrics['flushes']
+            return {
+                'buffered': len(self._buffer),
+                'logged': self._metrics['logged'],
+                'written': self._metrics['written'],
+                'flushes': flushes,
+                'failed_flushes': self._metrics['failed_flushes'],
+                'dropped': self._metrics['dropped'],
+                'avg_batch': self._metrics['written'] / flushes if flushes else 0.0,
+                'max_batch': self._metrics['max_batch'],
+            }
+
+
+def flush_audit_log(app):
+    # Scheduler job so quiet periods still get their events written within the interval
+    app.extensions['audit_log'].flush()
@@ -1,16 +1,18 @@
 from flask import Blueprint, render_template, flash, redirect, url_for, session, request, make_response, current_app as app, jsonify
 from .models import User
-from . import db
+from . import db, password_hasher
+from .hashing import HashingServiceBusy
 from flask_bcrypt import Bcrypt
 from flask_login import login_user, login_required, logout_user, current_user
 from .forms import LoginForm, SignUpForm, OTPForm, ChangePasswordForm, ForgetPasswordForm, ResetPasswordForm, SetupProfilePicForm
-from .otp import generate_otp
+from .otp import issue_otp, check_otp, otp_expired, clear_otp, MAX_OTP_RESENDS
 from .emails import *
 from .reset_password_token import generate_reset_password_token
 from .recaptcha import verify_recaptcha
 from .encryption import encrypt_token
 from .session import check_session, regenerate_session_token
-from .logs import log_user_activity
+from .logs import log_user_activity, log_context
+from .identity import invalidate_identity
 from datetime import datetime, timedelta
 import logging
 import time
@@ -58,7 +60,7 @@ def login():
             # Check if the account is active
             if user.is_active == 'No':
                 flash('Your account has been deactivated. Please check your email for more details.', category='danger')
-                log_user_activity(user.id, 'fail', 'Login', 'Attempted to access deactivated account.')
+                log_user_activity(user.id, 'fail', 'Login', 'Attempted to access deactivated account.', **log_context(user))
                 return render_template('login.html', form=form)
 
             # Retrieve the login attempts and last login time from the user
@@ -87,7 +89,7 @@ def login():
                 minutes, seconds = divmod(timeout.total_seconds(), 60)
                 # Display lockout message
                 flash(f'Too many login attempts. Please try again in {int(minutes)} minutes {int(seconds)} seconds.', category='danger')
-                log_user_activity(user.id, 'fail', 'Login', 'Attempted to access account when lockout in effect.')
+                log_user_activity(user.id, 'fail', 'Login', 'Attempted to access account when lockout in effect.', **log_context(user))
                 return render_template('login.html', form=form)
 
             # Retrieve the password from the form
@@ -98,16 +100,11 @@ def login():
 
             try:
                 # Check if the user exists and the password is correct
-                if bcrypt.check_password_hash(user.password, combined_password):
+                if password_hasher.check_password_hash(user.password, combined_password):
                     # Clear any existing session data
                     session.clear()
-                    # Generate an OTP
-                    otp = generate_otp()
-                    # Hash the OTP 
-                    hashed_otp = bcrypt.generate_password_hash(str(otp)).decode('utf-8')
-                    # Store the user's OTP in the database
-                    user.otp = hashed_otp
-                    user.last_otp_time = current_time
+                    # Generate an OTP and store its keyed digest in the database
+                    otp = issue_otp(user, current_time)
                     # Reset the login attempts to 0 and update to the latest login time
                     user.login_attempts = 0
                     user.last_login_time = current_time
@@ -129,7 +126,7 @@ def login():
                     session['email'] = email
 
                     # Log successful login
-                    log_user_activity(user.id, 'pass', 'Login', 'Login successful. OTP sent.')
+                    log_user_activity(user.id, 'pass', 'Login', 'Login successful. OTP sent.', **log_context(user))
 
                     return redirect(url_for('auth.verify_otp'))
                 else:
@@ -155,7 +152,7 @@ def login():
                         timeout = timedelta(minutes=10)
                         minutes, seconds = divmod(timeout.total_seconds(), 60)
                         flash(f'Too many login attempts. Please try again in {int(minutes)} minutes {int(seconds)} seconds.', category='danger')
-                        log_user_activity(user.id, 'fail', 'Login', '5 failed login attempts. Lockout in effect.')
+                        log_user_activity(user.id, 'fail', 'Login', '5 failed login attempts. Lockout in effect.', **log_context(user))
                         return render_template('login.html', form=form)
 
                     # Check if the user has 10 failed login attempts
@@ -166,7 +163,7 @@ def login():
                         # Send an account deactivation email
                         send_account_deactivation_email(user.name, email)
                         flash('Your account has been deactivated. Please check your email for more details.', category='danger')
-                        log_user_activity(user.id, 'fail', 'Login', '10 failed login attempts. Account deactivated.')
+                        log_user_activity(user.id, 'fail', 'Login', '10 failed login attempts. Account deactivated.', **log_context(user))
                         return render_template('login.html', form=form)
 
                     # If the user has fewer than 10 failed login attempts, show the appropriate message
@@ -181,7 +178,7 @@ def login():
                         flash(f'The email or password you have provided is incorrect. Please try again. You have {attempts_left} tries left before your account gets deactivated.', category='danger')
 
                     # Log failed login attempt
-                    log_user_activity(user.id, 'fail', 'Login', 'Incorrect email or password.')
+                    log_user_activity(user.id, 'fail', 'Login', 'Incorrect email or password.', **log_context(user))
 
             except ValueError as e:
                 # Handle the ValueError that might occur due to invalid salt
@@ -190,6 +187,11 @@ def login():
                 # Optionally, you can redirect to a generic error page or re-render the login page
                 return render_template('login.html', form=form)
 
+            except HashingServiceBusy:
+                # Handle a full password hashing queue without counting it as a failed attempt
+                flash('The server is busy, please try again in a moment.', category='danger')
+                return render_template('login.html', form=form)
+
         else:
             flash('The email or password you have provided is incorrect. Please try again.', category='danger')
 
@@ -239,7 +241,7 @@ def verify_otp():
             db.session.commit()
             session.clear()
             flash('Your session has expired. Please login again.', category='danger')
-            log_user_activity(user.id, 'fail', 'Verify OTP', 'Session expired.')
+            log_user_activity(user.id, 'fail', 'Verify OTP', 'Session expired.', **log_context(user))
             return redirect(url_for('auth.login'))
     else:
         session['otp_start_time'] = datetime.now().strftime('%d/%m/%Y %H:%M:%S')
@@ -263,12 +265,8 @@ def verify_otp():
         # Retrieve the OTP from the form
         otp = form.otp.data
 
-        # Retrieve the stored OTP and its timing from the database
-        stored_otp = user.otp
-        otp_time = user.last_otp_time
-
         # Check if the OTP has expired
-        if datetime.now() - otp_time > timedelta(minutes=5):
+        if otp_expired(user):
             flash('OTP has expired, please login again to request a new OTP.', category='danger')
             user.otp = None
             user.last_otp_time = datetime.now()
@@ -276,17 +274,14 @@ def verify_otp():
             user.session_token = None
             db.session.commit()
             session.clear()
-            log_user_activity(user.id, 'fail', 'Verify OTP', 'OTP expired.')
+            log_user_activity(user.id, 'fail', 'Verify OTP', 'OTP expired.', **log_context(user))
             return redirect(url_for('auth.login'))
 
         # Check if the OTP is correct
-        if bcrypt.check_password_hash(stored_otp, otp):
+        if check_otp(user, otp):
             # Log the user in
             login_user(user, remember=True)
-            user.otp = None
-            user.last_otp_time = datetime.now()
-            user.otp_attempts = 0
-            user.resend_otp_attempts = 0
+            clear_otp(user)
 
             db.session.commit()
 
@@ -295,24 +290,24 @@ def verify_otp():
 
             # Check if the user has logged in for the first time
             if user.first_login == 'Yes':
-                log_user_activity(user.id, 'pass', 'Verify OTP', 'First login - redirecting to setup profile picture.')
+                log_user_activity(user.id, 'pass', 'Verify OTP', 'First login - redirecting to setup profile picture.', **log_context(user))
                 return redirect(url_for('auth.setupProfilePic'))
 
             # Redirect to the appropriate dashboard based on the role
             if user.role == 'staff':
                 flash('Login successful!', category='success')
-                log_user_activity(user.id, 'pass', 'Verify OTP', 'Login successful - redirecting to staff dashboard.')
+                log_user_activity(user.id, 'pass', 'Verify OTP', 'Login successful - redirecting to staff dashboard.', **log_context(user))
                 return redirect(url_for('staff.classroom'))
             elif user.role == 'student':
                 flash('Login successful!', category='success')
-                log_user_activity(user.id, 'pass', 'Verify OTP', 'Login successful - redirecting to student dashboard.')
+                log_user_activity(user.id, 'pass', 'Verify OTP', 'Login successful - redirecting to student dashboard.', **log_context(user))
                 return redirect(url_for('student.dashboard'))
             elif user.role == 'admin':
                 flash('Login successful!', category='success')
-                log_user_activity(user.id, 'pass', 'Verify OTP', 'Login successful - redirecting to admin dashboard.')
+                log_user_activity(user.id, 'pass', 'Verify OTP', 'Login successful - redirecting to admin dashboard.', **log_context(user))
                 return redirect(url_for('admin.dashboard'))
             else:
-                log_user_activity(user.id, 'fail', 'Verify OTP', 'Unknown role after successful login.')
+                log_user_activity(user.id, 'fail', 'Verify OTP', 'Unknown role after successful login.', **log_context(user))
                 return redirect(url_for('auth.login'))
         else:
             # Increment the OTP attempts
@@ -327,11 +322,11 @@ def verify_otp():
                 user.session_token = None
                 db.session.commit()
                 session.clear()
-                log_user_activity(user.id, 'fail', 'Verify OTP', 'Too many incorrect OTP attempts.')
+                log_user_activity(user.id, 'fail', 'Verify OTP', 'Too many incorrect OTP attempts.', **log_context(user))
                 return redirect(url_for('auth.login'))
             flash('Invalid OTP, please try again.', category='danger')
             form.otp.data = ''
-            log_user_activity(user.id, 'fail', 'Verify OTP', 'Incorrect OTP.')
+            log_user_activity(user.id, 'fail', 'Verify OTP', 'Incorrect OTP.', **log_context(user))
 
     # Split email into username and domain
     name = email.split('@')[0]
@@ -362,7 +357,7 @@ def resend_otp():
         current_time = datetime.now()
 
         # Check if the time elapsed since the last OTP request is 5 minutes or more
-        if current_time - user.last_otp_time >= timedelta(minutes=5):
+        if otp_expired(user, current_time):
             flash('Current OTP has expired, please login again to request a new OTP.', category='danger')
             # Clear the OTP and update the time, then reset the resend attempts
             user.otp = None
@@ -370,11 +365,11 @@ def resend_otp():
             user.resend_otp_attempts = 0
             user.session_token = None
             db.session.commit()
-            log_user_activity(user.id, 'fail', 'Resend OTP', 'OTP expired - request for new OTP failed.')
+            log_user_activity(user.id, 'fail', 'Resend OTP', 'OTP expired - request for new OTP failed.', **log_context(user))
             return redirect(url_for('auth.login'))
 
         # Check if the maximum number of resend attempts has been reached
-        if user.resend_otp_attempts >= 3:
+        if user.resend_otp_attempts >= MAX_OTP_RESENDS:
             flash('Maximum resend attempts reached, please login again to request a new OTP.', category='danger')
             # Clear the OTP and update the time, then reset the resend attempts
             user.otp = None
@@ -382,16 +377,11 @@ def resend_otp():
             user.resend_otp_attempts = 0
             user.session_token = None
             db.session.commit()
-            log_user_activity(user.id, 'fail', 'Resend OTP', 'Maximum resend attempts reached.')
+            log_user_activity(user.id, 'fail', 'Resend OTP', 'Maximum resend attempts reached.', **log_context(user))
             return redirect(url_for('auth.login'))
 
-        # Generate a new OTP
-        otp = generate_otp()
-        # Hash the OTP 
-        hashed_otp = bcrypt.generate_password_hash(str(otp)).decode('utf-8')
-        # Store the newly generated OTP in the database
-        user.otp = hashed_otp
-        user.last_otp_time = current_time
+        # Generate a new OTP and store its keyed digest in the database
+        otp = issue_otp(user, current_time)
         user.resend_otp_attempts += 1
         db.session.commit()
 
@@ -403,7 +393,7 @@ def resend_otp():
         # Send the new OTP via email
         send_otp_email(user.name, email, otp)
         flash('A new OTP has been sent to your email.', category='info')
-        log_user_activity(user.id, 'pass', 'Resend OTP', 'New OTP generated and sent via email.')
+        log_user_activity(user.id, 'pass', 'Resend OTP', 'New OTP generated and sent via email.', **log_context(user))
     else:
         flash('Invalid email address.', category='danger')
 
@@ -423,7 +413,7 @@ def setupProfilePic():
 
     # Check if the email exists
     if not email:
-        log_user_activity(current_user.id, 'fail', 'Setup Profile', 'Email not found in session - redirecting to login.')
+        log_user_activity(current_user.id, 'fail', 'Setup Profile', 'Email not found in session - redirecting to login.', **log_context(current_user))
         return redirect(url_for('auth.login'))
 
     # Fetch the user associated with the provided email
@@ -437,7 +427,7 @@ def setupProfilePic():
             user.session_token = None
             db.session.commit()
             session.clear()
-            log_user_activity(user.id, 'fail', 'Setup Profile', 'Session expired - redirecting to login.')
+            log_user_activity(user.id, 'fail', 'Setup Profile', 'Session expired - redirecting to login.', **log_context(user))
             flash('Your session has expired. Please log in again to complete the setup.', category='danger')
             return redirect(url_for('auth.login'))
     else:
@@ -445,13 +435,13 @@ def setupProfilePic():
         session['setup_start_time'] = datetime.now().strftime('%d/%m/%Y %H:%M:%S')
 
     if current_user.first_login == "Yes":
-        log_user_activity(user.id, 'pass', 'Setup Profile', 'Accessed setup profile picture page.')
+        log_user_activity(user.id, 'pass', 'Setup Profile', 'Accessed setup profile picture page.', **log_context(user))
         pass
     else:
         # Check whether the user is logged in
         redirect_response = check_session()
         if redirect_response:
-            log_user_activity(user.id, 'fail', 'Setup Profile', 'Account already set up - redirecting to dashboard.')
+            log_user_activity(user.id, 'fail', 'Setup Profile', 'Account already set up - redirecting to dashboard.', **log_context(user))
             flash('Your account has already been setup!', category='danger')
             return redirect_response
 
@@ -466,19 +456,19 @@ def setupProfilePic():
         if profile_picture:
             # Process the selected image (e.g., save to user's profile)
             session['pfp'] = profile_picture
-            log_user_activity(user.id, 'pass', 'Setup Profile', f'Selected profile picture: {profile_picture}')
+            log_user_activity(user.id, 'pass', 'Setup Profile', f'Selected profile picture: {profile_picture}', **log_context(user))
             return redirect(url_for('auth.change_password'))
 
         elif selected_pic:
             session['pfp'] = selected_pic
-            log_user_activity(user.id, 'pass', 'Setup Profile', f'Selected profile picture from session: {selected_pic}')
+            log_user_activity(user.id, 'pass', 'Setup Profile', f'Selected profile picture from session: {selected_pic}', **log_context(user))
             return redirect(url_for('auth.change_password'))
         
             # Redirect to the next step
 
         else:
             flash('Please choose a profile picture.')
-            log_user_activity(user.id, 'fail', 'Setup Profile', 'No profile picture selected.')
+            log_user_activity(user.id, 'fail', 'Setup Profile', 'No profile picture selected.', **log_context(user))
 
     # Create a response object
     response = make_response(render_template('ProfilePic.html', form=form, profile_pics=profile_pics, selected_pic=selected_pic))
@@ -514,7 +504,7 @@ def change_password():
 
     # Check if the email exists
     if not email:
-        log_user_activity(current_user.id, 'fail', 'Change Password', 'Email not found in session - redirecting to login.')
+        log_user_activity(current_user.id, 'fail', 'Change Password', 'Email not found in session - redirecting to login.', **log_context(current_user))
         return redirect(url_for('auth.login'))
 
     # Fetch the user associated with the provided email
@@ -528,7 +518,7 @@ def change_password():
             user.session_token = None
             db.session.commit()
             session.clear()
-            log_user_activity(user.id, 'fail', 'Change Password', 'Session expired - redirecting to login.')
+            log_user_activity(user.id, 'fail', 'Change Password', 'Session expired - redirecting to login.', **log_context(user))
             flash('Your session has expired. Please log in again to change your password.', category='danger')
             return redirect(url_for('auth.login'))
     else:
@@ -536,13 +526,13 @@ def change_password():
         session['change_password_start_time'] = datetime.now().strftime('%d/%m/%Y %H:%M:%S')
 
     if current_user.first_login == "Yes":
-        log_user_activity(user.id, 'pass', 'Change Password', 'Accessed change password page for the first login.')
+        log_user_activity(user.id, 'pass', 'Change Password', 'Accessed change password page for the first login.', **log_context(user))
         pass
     else:
         # Checker whether the user is logged in
         redirect_response = check_session()
         if redirect_response:
-            log_user_activity(user.id, 'fail', 'Change Password', 'Account already set up - redirecting to dashboard.')
+            log_user_activity(user.id, 'fail', 'Change Password', 'Account already set up - redirecting to dashboard.', **log_context(user))
             flash('Your account has already been setup!', category='danger')
             return redirect_response
 
@@ -561,35 +551,35 @@ def change_password():
 
         # Check if the password was changed within one day of the last password change
         if current_user.last_password_change and (datetime.now() - current_user.last_password_change < timedelta(days=1)):
-            log_user_activity(user.id, 'fail', 'Change Password', 'Password change attempt within 24 hours - rejected.')
+            log_user_activity(user.id, 'fail', 'Change Password', 'Password change attempt within 24 hours - rejected.', **log_context(user))
             flash('You can only change your password once every 24 hours.', category='danger')
         # Check if the password have 12 or more characters
         elif len(newPassword) < 12:
-            log_user_activity(user.id, 'fail', 'Change Password', 'New password too short - must be at least 12 characters.')
+            log_user_activity(user.id, 'fail', 'Change Password', 'New password too short - must be at least 12 characters.', **log_context(user))
             flash('New password must be at least 12 characters long.', category='danger')
         # Check if the password have at least 1 uppercase letter
         elif not re.search(r'[A-Z]', newPassword):
-            log_user_activity(user.id, 'fail', 'Change Password', 'New password lacks uppercase letter.')
+            log_user_activity(user.id, 'fail', 'Change Password', 'New password lacks uppercase letter.', **log_context(user))
             flash('New password must contain at least one uppercase letter.', category='danger')
         # Check if the password have at least 1 lowercase letter
         elif not re.search(r'[a-z]', newPassword):
-            log_user_activity(user.id, 'fail', 'Change Password', 'New password lacks lowercase letter.')
+            log_user_activity(user.id, 'fail', 'Change Password', 'New password lacks lowercase letter.', **log_context(user))
             flash('New password must contain at least one lowercase letter.', category='danger')
         # Check if the password have at least 1 number
         elif not re.search(r'[0-9]', newPassword):
-            log_user_activity(user.id, 'fail', 'Change Password', 'New password lacks number.')
+            log_user_activity(user.id, 'fail', 'Change Password', 'New password lacks number.', **log_context(user))
             flash('New password must contain at least one number.', category='danger')
         # Check if the password have at least 1 special character
         elif not re.search(r'[!@#$%^&*()]', newPassword):
-            log_user_activity(user.id, 'fail', 'Change Password', 'New password lacks special character.')
+            log_user_activity(user.id, 'fail', 'Change Password', 'New password lacks special character.', **log_context(user))
             flash('New password must contain at least one special character.', category='danger')
         # Check if both passwords match
         elif newPassword != confirmPassword:
-            log_user_activity(user.id, 'fail', 'Change Password', 'New passwords do not match.')
+            log_user_activity(user.id, 'fail', 'Change Password', 'New passwords do not match.', **log_context(user))
             flash('Passwords don\'t match.', category='danger')
         # Check if the new password is the same as the existing password
-        elif bcrypt.check_password_hash(current_user.password, newPassword + pepper):
-            log_user_activity(user.id, 'fail', 'Change Password', 'New password same as current password.')
+        elif password_hasher.check_password_hash(current_user.password, newPassword + pepper):
+            log_user_activity(user.id, 'fail', 'Change Password', 'New password same as current password.', **log_context(user))
             flash('New password cannot be the same as the current password.', category='danger')
 
         elif any(sub in newPassword.lower() for sub in email_substrings):
@@ -597,11 +587,14 @@ def change_password():
         else:
 
             password_history = json.loads(current_user.password_history or '[]')
-            if any(bcrypt.check_password_hash(pw, newPassword) for pw in password_history):
+            # Check the password history in parallel, stopping at the first match
+            reused, elapsed = password_hasher.check_password_history(password_history, newPassword)
+            logging.info(f'Password history check for user {user.id} took {elapsed:.3f}s')
+            if reused:
                 flash('New password cannot be the same as any of the last used passwords.', category='danger')
             else:
                 # Hash the new password
-                hashed_password = bcrypt.generate_password_hash(newPassword).decode('utf-8')
+                hashed_password = password_hasher.generate_password_hash(newPassword)
                 # Update the user's password and password history
                 user = User.query.filter_by(email=email).first()
                 password_history.append(hashed_password)
@@ -615,7 +608,7 @@ def change_password():
                 # Combine new password with pepper
                 combined_new_password = newPassword + pepper
                 # Hash the new password
-                hashed_password = bcrypt.generate_password_hash(combined_new_password).decode('utf-8')
+                hashed_password = password_hasher.generate_password_hash(combined_new_password)
                 # Fetch the user associated with the provided email
                 user = User.query.filter_by(email=email).first()
                 # Update the user's password and first login status
@@ -638,7 +631,7 @@ def change_password():
                 del session['pfp']
 
                 # Log the successful password change
-                log_user_activity(user.id, 'pass', 'Change Password', 'Password changed successfully.')
+                log_user_activity(user.id, 'pass', 'Change Password', 'Password changed successfully.', **log_context(user))
 
             # Redirect to the appropriate dashboard based on the user's role
             if user.role == 'staff':
@@ -696,7 +689,7 @@ def forget_password():
                     minutes, seconds = divmod(remaining_time.total_seconds(), 60)
                     # Display an error message
                     flash(f'Too many password reset attempts. Please try again in {int(minutes)} minutes {int(seconds)} seconds.', category='danger')
-                    log_user_activity(user.id, 'fail', 'Forget Password', 'Maximum password reset attempts exceeded.')
+                    log_user_activity(user.id, 'fail', 'Forget Password', 'Maximum password reset attempts exceeded.', **log_context(user))
                     return render_template('forget_password.html', form=form)
                 else:
                     user.forget_password_attempts = 0
@@ -708,7 +701,7 @@ def forget_password():
                 db.session.commit()
                 # Send the unsuccessful password reset email
                 send_forget_password_unsuccessful_email(user.name, email)
-                log_user_activity(user.id, 'fail', 'Forget Password', 'Password reset email not sent (first login).')
+                log_user_activity(user.id, 'fail', 'Forget Password', 'Password reset email not sent (first login).', **log_context(user))
                 # Delay form processing by 2 seconds for consistent handling
                 time.sleep(2)
                 form.email.data = ''
@@ -725,7 +718,7 @@ def forget_password():
 
                 # Send the password reset email to the user
                 send_forget_password_email(user.name, email, token)
-                log_user_activity(user.id, 'pass', 'Forget Password', 'Password reset email sent successfully.')
+                log_user_activity(user.id, 'pass', 'Forget Password', 'Password reset email sent successfully.', **log_context(user))
 
         # Delay form processing by 2 seconds for consistent handling
         time.sleep(2)
@@ -760,7 +753,7 @@ def reset_password(token):
         if datetime.now() - user.last_forget_password_time > timedelta(minutes=20):
             user.reset_password_token = None
             db.session.commit()
-            log_user_activity(user.id, 'fail', 'Reset Password', 'Reset password link expired.')
+            log_user_activity(user.id, 'fail', 'Reset Password', 'Reset password link expired.', **log_context(user))
             flash('This reset link has expired, please request a new one.', category='danger')
             return redirect(url_for('auth.forget_password'))
         
@@ -771,7 +764,7 @@ def reset_password(token):
             # Calculate the timestamp for when the password reset will be available again
             available_reset_time = user.last_password_change + timedelta(days=1)
             send_reset_password_suspension_email(user.email, user.name, available_reset_time)
-            log_user_activity(user.id, 'fail', 'Reset Password', 'Password change attempted too soon.')
+            log_user_activity(user.id, 'fail', 'Reset Password', 'Password change attempted too soon.', **log_context(user))
             flash('You can only change your password once every 24 hours. Please try again later.', category='danger')
             return redirect(url_for('auth.login'))
 
@@ -787,37 +780,40 @@ def reset_password(token):
             # Check if the password has 12 or more characters
             if len(newPassword) < 12:
                 flash('New password must be at least 12 characters long.', category='danger')
-                log_user_activity(user.id, 'fail', 'Reset Password', 'New password too short.')
+                log_user_activity(user.id, 'fail', 'Reset Password', 'New password too short.', **log_context(user))
             # Check if the password has at least 1 uppercase letter
             elif not re.search(r'[A-Z]', newPassword):
                 flash('New password must contain at least one uppercase letter.', category='danger')
-                log_user_activity(user.id, 'fail', 'Reset Password', 'New password missing uppercase letter.')
+                log_user_activity(user.id, 'fail', 'Reset Password', 'New password missing uppercase letter.', **log_context(user))
             # Check if the password has at least 1 lowercase letter
             elif not re.search(r'[a-z]', newPassword):
-                log_user_activity(user.id, 'fail', 'Reset Password', 'New password missing lowercase letter.')
+                log_user_activity(user.id, 'fail', 'Reset Password', 'New password missing lowercase letter.', **log_context(user))
                 flash('New password must contain at least one lowercase letter.', category='danger')
             # Check if the password has at least 1 number
             elif not re.search(r'[0-9]', newPassword):
-                log_user_activity(user.id, 'fail', 'Reset Password', 'New password missing number.')
+                log_user_activity(user.id, 'fail', 'Reset Password', 'New password missing number.', **log_context(user))
                 flash('New password must contain at least one number.', category='danger')
             # Check if the password has at least 1 special character
             elif not re.search(r'[!@#$%^&*()]', newPassword):
-                log_user_activity(user.id, 'fail', 'Reset Password', 'New password missing special character.') 
+                log_user_activity(user.id, 'fail', 'Reset Password', 'New password missing special character.', **log_context(user)) 
                 flash('New password must contain at least one special character.', category='danger') 
             # Check if both passwords match
             elif newPassword != confirmPassword:
-                log_user_activity(user.id, 'fail', 'Reset Password', 'Passwords do not match.')
+                log_user_activity(user.id, 'fail', 'Reset Password', 'Passwords do not match.', **log_context(user))
                 flash('Passwords don\'t match.', category='danger')
             # Check if the new password is the same as the existing password 
-            elif bcrypt.check_password_hash(user.password, newPassword):
-                log_user_activity(user.id, 'fail', 'Reset Password', 'New password same as current password.')
+            elif password_hasher.check_password_hash(user.password, newPassword):
+                log_user_activity(user.id, 'fail', 'Reset Password', 'New password same as current password.', **log_context(user))
                 flash('New password cannot be the same as the current password.', category='danger')
             elif any(sub in newPassword.lower() for sub in email_substrings):
                 flash('New password cannot contain parts of your email address.', category='danger')
                 
             else:
                 password_history = json.loads(user.password_history or '[]')
-                if any(bcrypt.check_password_hash(pw, newPassword) for pw in password_history):
+                # Check the password history in parallel, stopping at the first match
+                reused, elapsed = password_hasher.check_password_history(password_history, newPassword)
+                logging.info(f'Password history check for user {user.id} took {elapsed:.3f}s')
+                if reused:
                     flash('New password cannot be the same as any of the last used passwords.', category='danger')
                 else:
                     password_history.append(user.password)  # Add the old password to history
@@ -827,7 +823,7 @@ def reset_password(token):
                         password_history.pop(0)  # Maintain a maximum of 15 passwords
 
                     user.password_history = json.dumps(password_history)   
-                    hashed_password = bcrypt.generate_password_hash(newPassword + pepper).decode('utf-8')
+                    hashed_password = password_hasher.generate_password_hash(newPassword + pepper)
                     # Update the user's password in the database
                     user.password = hashed_password
                     user.reset_password_token = None
@@ -843,10 +839,11 @@ def reset_password(token):
                     user.login_attempts = 0
                     user.is_active = 'Yes'
                     db.session.commit()
+                    invalidate_identity(user.id)
 
                 # Send the reset password confirmation email to the user
                 send_reset_password_email(user.name, user.email)
-                log_user_activity(user.id, 'pass', 'Reset Password', 'Password reset successfully.')
+                log_user_activity(user.id, 'pass', 'Reset Password', 'Password reset successfully.', **log_context(user))
                 flash('Password reset successfully, you may login with the new password.', category='success')
                 return redirect(url_for('auth.login'))
 
@@ -872,7 +869,8 @@ def logout():
     if user:
         user.session_token = None
         db.session.commit()
-        log_user_activity(user.id, 'pass', 'Logout', 'Session token cleared.')
+        invalidate_identity(user.id)
+        log_user_activity(user.id, 'pass', 'Logout', 'Session token cleared.', **log_context(user))
 
     # Clear all session data
     session.clear()
@@ -881,7 +879,7 @@ def logout():
     logout_user()
 
     # Log the successful logout event
-    log_user_activity(user.id, 'pass', 'Logout', 'User logged out successfully.')
+    log_user_activity(user.id, 'pass', 'Logout', 'User logged out successfully.', **log_context(user))
 
     # Check if the request is expecting a JSON response
     if request.method == 'POST' and request.is_json:
@@ -978,7 +976,7 @@ def reauthenticate():
 
         if user:
             combined_password = password + pepper
-            if bcrypt.check_password_hash(user.password, combined_password):
+            if password_hasher.check_password_hash(user.password, combined_password):
                 session_token = str(uuid.uuid4())
                 iv, encrypted_session_token, tag = encrypt_token(session_token)
 
@@ -1001,6 +999,9 @@ def reauthenticate():
             flash('User not found. Please try again.', 'danger')
             return jsonify({'status': 'error', 'message': 'User not found. Please try again.'}), 401
 
+    except HashingServiceBusy:
+        return jsonify({'status': 'error', 'message': 'The server is busy, please try again in a moment.'}), 503
+
     except Exception as e:
         logging.error(f'An unexpected error occurred: {str(e)}')
         return jsonify({'status': 'error', 'message': 'An unexpected error occurred. Please try again later.'}), 500
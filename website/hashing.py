@@ -0,0 +1,157 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing
+import threading
+import hmac
+import os
+import time
+import bcrypt
+
+
+class HashingServiceBusy(Exception):
+    # Raised when the hashing queue is full and no slot frees up in time
+    pass
+
+
+def _check_password_hash(pw_hash, password):
+    # Runs inside a worker process, so it only uses the bcrypt package directly
+    started = time.time()
+    pw_hash = pw_hash.encode('utf-8')
+    matched = hmac.compare_digest(bcrypt.hashpw(password.encode('utf-8'), pw_hash), pw_hash)
+    return matched, started, time.time()
+
+
+def _generate_password_hash(password, rounds):
+    # Runs inside a worker process, so it only uses the bcrypt package directly
+    started = time.time()
+    pw_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=rounds)).decode('utf-8')
+    return pw_hash, started, time.time()
+
+
+class PasswordHasher:
+    # Runs bcrypt on a sized process pool so request threads are not pinned on hashing
+
+    def __init__(self, app=None):
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._metrics_lock = threading.Lock()
+        self._slots = None
+        self._in_flight = 0
+        self._metrics = {
+            'completed': 0,
+            'rejected': 0,
+            'total_queue_wait': 0.0,
+            'max_queue_wait': 0.0,
+            'total_hash_time': 0.0,
+            'max_hash_time': 0.0,
+            'history_checks': 0,
+            'total_history_time': 0.0,
+            'max_history_time': 0.0,
+        }
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # Load the pool size, queue depth and back-pressure timeout from the config
+        self.workers = app.config.get('PASSWORD_HASH_WORKERS', min(15, os.cpu_count() or 2))
+        self.max_queue = app.config.get('PASSWORD_HASH_MAX_QUEUE', 32)
+        self.queue_timeout = app.config.get('PASSWORD_HASH_QUEUE_TIMEOUT', 5)
+        self.rounds = app.config.get('BCRYPT_LOG_ROUNDS', 12)
+        self._slots = threading.BoundedSemaphore(self.max_queue)
+        app.extensions['password_hasher'] = self
+
+    def _get_executor(self):
+        # Create the pool lazily so it is started inside each web worker process
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    # Forking a threaded web worker can copy a held lock into the child, so start the
+                    # hashing processes clean. forkserver is not available on Windows
+                    method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                         mp_context=multiprocessing.get_context(method))
+        return self._executor
+
+    def _submit(self, fn, *args):
+        # Apply back-pressure: wait for a free queue slot, then give up
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            with self._metrics_lock:
+                self._metrics['rejected'] += 1
+            raise HashingServiceBusy('Password hashing queue is full.')
+
+        submitted = time.time()
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._metrics_lock:
+            self._in_flight += 1
+        future.add_done_callback(lambda f: self._job_done(f, submitted))
+        return future
+
+    def _job_done(self, future, submitted):
+        self._slots.release()
+        with self._metrics_lock:
+            self._in_flight -= 1
+            if future.cancelled() or future.exception() is not None:
+                return
+            _, started, finished = future.result()
+            queue_wait = max(0.0, started - submitted)
+            hash_time = finished - started
+            self._metrics['completed'] += 1
+            self._metrics['total_queue_wait'] += queue_wait
+            self._metrics['max_queue_wait'] = max(self._metrics['max_queue_wait'], queue_wait)
+            self._metrics['total_hash_time'] += hash_time
+            self._metrics['max_hash_time'] = max(self._metrics['max_hash_time'], hash_time)
+
+    def check_password_hash(self, pw_hash, password):
+        # Raises ValueError for a malformed hash, like Flask-Bcrypt does
+        matched, _, _ = self._submit(_check_password_hash, pw_hash, password).result()
+        return matched
+
+    def generate_password_hash(self, password):
+        pw_hash, _, _ = self._submit(_generate_password_hash, password, self.rounds).result()
+        return pw_hash
+
+    def check_password_history(self, password_history, password):
+        # Verify the password against every old hash in parallel and stop at the first match
+        started = time.perf_counter()
+        futures = []
+        matched = False
+        try:
+            for pw_hash in password_history:
+                futures.append(self._submit(_check_password_hash, pw_hash, password))
+            for future in as_completed(futures):
+                if future.result()[0]:
+                    matched = True
+                    break
+        finally:
+            # Cancel the checks that have not started yet
+            for future in futures:
+                future.cancel()
+
+        elapsed = time.perf_counter() - started
+        with self._metrics_lock:
+            self._metrics['history_checks'] += 1
+            self._metrics['total_history_time'] += elapsed
+            self._metrics['max_history_time'] = max(self._metrics['max_history_time'], elapsed)
+        return matched, elapsed
+
+    def metrics(self):
+        with self._metrics_lock:
+            completed = self._metrics['completed']
+            return {
+                'workers': self.workers,
+                'max_queue': self.max_queue,
+                'in_flight': self._in_flight,
+                'completed': completed,
+                'rejected': self._metrics['rejected'],
+                'avg_queue_wait': self._metrics['total_queue_wait'] / completed if completed else 0.0,
+                'max_queue_wait': self._metrics['max_queue_wait'],
+                'avg_hash_time': self._metrics['total_hash_time'] / completed if completed else 0.0,
+                'max_hash_time': self._metrics['max_hash_time'],
+                'history_checks': self._metrics['history_checks'],
+                'avg_history_time': self._metrics['total_history_time'] / self._metrics['history_checks'] if self._metrics['history_checks'] else 0.0,
+                'max_history_time': self._metrics['max_history_time'],
+            }
@@ -0,0 +1,175 @@
+from collections import OrderedDict
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+import threading
+import time
+
+# Columns every request needs to authenticate and route the user
+# name, email and image_file are included because the base templates and session_timeout read them on every page
+# classroom_id lets audit logging resolve a student's classroom without loading the full row
+IDENTITY_FIELDS = ('id', 'role', 'is_active', 'session_token', 'current_module', 'name', 'email', 'image_file', 'classroom_id')
+
+# Columns that decide whether a session is still allowed in. They are read from the database on every
+# request, so a login elsewhere or a deactivation in another worker takes effect straight away
+AUTH_FIELDS = ('session_token', 'is_active')
+
+
+class UserIdentity:
+    # Slim stand-in for User that only loads the full row when a view reads a column outside the projection
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, fields):
+        self.__dict__.update(fields)
+        self.__dict__['_user'] = None
+
+    def get_id(self):
+        return str(self.id)
+
+    def _full_user(self):
+        from .models import User
+        from . import db
+        if self.__dict__['_user'] is None:
+            self.__dict__['_user'] = db.session.get(User, self.id)
+        return self.__dict__['_user']
+
+    def __getattr__(self, name):
+        # Only called for attributes that are not part of the projection
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self._full_user(), name)
+
+    def __setattr__(self, name, value):
+        # Writes go to the real row so they are persisted on commit
+        setattr(self._full_user(), name, value)
+        if name in IDENTITY_FIELDS:
+            self.__dict__[name] = value
+
+    def __eq__(self, other):
+        if hasattr(other, 'get_id'):
+            return self.get_id() == other.get_id()
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
+
+    __hash__ = object.__hash__
+
+
+class IdentityCache:
+    # Per-process cache of identity projections keyed by user id, only the AUTH_FIELDS are never served from it
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._listening = False
+        self._metrics = {'hits': 0, 'misses': 0, 'invalidations': 0, 'refreshes': 0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # Entries expire so a change to the display columns made by another worker process is picked up within the TTL
+        self.ttl = app.config.get('IDENTITY_CACHE_TTL', 30)
+        self.max_size = app.config.get('IDENTITY_CACHE_SIZE', 10000)
+        self._listen()
+        app.extensions['identity_cache'] = self
+
+    def _listen(self):
+        # Invalidate whenever an identity column is changed through the ORM in this process
+        if self._listening:
+            return
+        from .models import User
+
+        def on_set(target, value, oldvalue, initiator):
+            if target.id is None:
+                return
+            self.invalidate(target.id)
+            # Invalidate again after commit so a read racing the transaction cannot keep the old value
+            session = object_session(target)
+            if session is not None:
+                session.info.setdefault('dirty_identities', set()).add(target.id)
+
+        for field in IDENTITY_FIELDS[1:]:
+            event.listen(getattr(User, field), 'set', on_set)
+
+        @event.listens_for(Session, 'after_commit')
+        def on_commit(session):
+            for user_id in session.info.pop('dirty_identities', ()):
+                self.invalidate(user_id)
+
+        self._listening = True
+
+    def _fetch(self, user_id):
+        from .models import User
+        from . import db
+        row = db.session.query(*[getattr(User, field) for field in IDENTITY_FIELDS]).filter(User.id == user_id).first()
+        return dict(row._mapping) if row else None
+
+    def _fetch_auth(self, user_id):
+        from .models import User
+        from . import db
+        row = db.session.query(*[getattr(User, field) for field in AUTH_FIELDS]).filter(User.id == user_id).first()
+        return dict(row._mapping) if row else None
+
+    def _store(self, user_id, fields):
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.ttl, fields)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def load(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry and entry[0] > now:
+                self._metrics['hits'] += 1
+                self._entries.move_to_end(user_id)
+            else:
+                entry = None
+                self._metrics['misses'] += 1
+
+        if entry is not None:
+            # A hit still reads the session token and active flag, a one-row primary key lookup of two columns
+            auth = self._fetch_auth(user_id)
+            if auth is None:
+                self.invalidate(user_id)
+                return None
+            if all(entry[1][field] == auth[field] for field in AUTH_FIELDS):
+                return UserIdentity(dict(entry[1]))
+            # Changed by another worker, so the rest of the entry is likely stale too
+            with self._lock:
+                self._metrics['refreshes'] += 1
+
+        fields = self._fetch(user_id)
+        if fields is None:
+            self.invalidate(user_id)
+            return None
+        self._store(user_id, fields)
+        return UserIdentity(dict(fields))
+
+    def invalidate(self, user_id):
+        with self._lock:
+            if self._entries.pop(user_id, None) is not None:
+                self._metrics['invalidations'] += 1
+
+    def metrics(self):
+        with self._lock:
+            lookups = self._metrics['hits'] + self._metrics['misses']
+            return {
+                'size': len(self._entries),
+                'ttl': self.ttl,
+                'hits': self._metrics['hits'],
+                'misses': self._metrics['misses'],
+                'hit_rate': self._metrics['hits'] / lookups if lookups else 0.0,
+                'invalidations': self._metrics['invalidations'],
+                'refreshes': self._metrics['refreshes'],
+            }
+
+
+def invalidate_identity(user_id):
+    from flask import current_app
+    current_app.extensions['identity_cache'].invalidate(user_id)
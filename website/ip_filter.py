@@ -0,0 +1,179 @@
+from bisect import bisect_right
+import ipaddress
+import threading
+import logging
+import time
+import os
+
+
+def _parse_network(rule):
+    # Accept single addresses and CIDR ranges, ignoring host bits such as 10.0.0.1/8
+    network = ipaddress.ip_network(rule.strip(), strict=False)
+    if network.version == 6 and network.network_address.ipv4_mapped and network.prefixlen >= 96:
+        network = ipaddress.ip_network(f'{network.network_address.ipv4_mapped}/{network.prefixlen - 96}')
+    return network
+
+
+def _compile(networks):
+    # CIDR blocks are either nested or disjoint, so a stack sweep flattens them into
+    # sorted, disjoint intervals owned by the most specific block
+    blocks = sorted(((int(network.network_address), int(network.broadcast_address), index)
+                     for network, index in networks), key=lambda block: (block[0], -block[1]))
+    starts, ends, owners = [], [], []
+
+    def emit(low, high, owner):
+        if low <= high:
+            starts.append(low)
+            ends.append(high)
+            owners.append(owner)
+
+    stack = []
+    cursor = 0
+    for start, end, index in blocks:
+        # Close the enclosing blocks that finish before this one starts
+        while stack and stack[-1][1] < start:
+            _, closed_end, closed_index = stack.pop()
+            emit(cursor, closed_end, closed_index)
+            cursor = closed_end + 1
+        if stack:
+            emit(cursor, start - 1, stack[-1][2])
+        stack.append((start, end, index))
+        cursor = start
+    while stack:
+        _, closed_end, closed_index = stack.pop()
+        emit(cursor, closed_end, closed_index)
+        cursor = closed_end + 1
+    return starts, ends, owners
+
+
+def _lookup(table, address):
+    starts, ends, owners = table
+    position = bisect_right(starts, address) - 1
+    if position >= 0 and address <= ends[position]:
+        return owners[position]
+    return None
+
+
+class IPFilter:
+    # Allow and deny rules compiled into sorted interval tables for O(log n) lookups
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._rules = []
+        self._tables = {}
+        self._has_allow = False
+        self._hits = {}
+        self._totals = {'allowed': 0, 'denied': 0}
+        self._file_mtime = None
+        self._next_check = 0.0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # The env lists keep working, the rule file adds rules that can change without a restart
+        self.env_rules = [('deny', rule) for rule in app.config.get('BLACKLISTED_IPS', []) if rule.strip()] + \
+                         [('allow', rule) for rule in app.config.get('WHITELISTED_IPS', []) if rule.strip()]
+        self.rule_file = app.config.get('IP_FILTER_FILE')
+        self.reload_interval = app.config.get('IP_FILTER_RELOAD_INTERVAL', 5)
+        self.reload(force=True)
+        app.extensions['ip_filter'] = self
+
+    def _read_rule_file(self):
+        # One rule per line, e.g. "deny 10.0.0.0/8" or "allow 2001:db8::/32", with # comments
+        rules = []
+        with open(self.rule_file) as f:
+            for line_number, line in enumerate(f, start=1):
+                line = line.split('#', 1)[0].strip()
+                if not line:
+                    continue
+                parts = line.split()
+                if len(parts) != 2 or parts[0].lower() not in ('allow', 'deny'):
+                    logging.warning(f'Ignoring malformed IP filter rule on line {line_number} of {self.rule_file}')
+                    continue
+                rules.append((parts[0].lower(), parts[1]))
+        return rules
+
+    def reload(self, force=False):
+        # Recompile only when the rule file changed since the last load
+        rules = list(self.env_rules)
+        mtime = None
+        if self.rule_file:
+            try:
+                mtime = os.stat(self.rule_file).st_mtime
+                if not force and mtime == self._file_mtime:
+                    return False
+                rules += self._read_rule_file()
+            except OSError as e:
+                logging.error(f'Could not read IP filter file {self.rule_file}: {str(e)}')
+                if not force:
+                    return False
+        elif not force:
+            return False
+
+        compiled_rules = []
+        networks = {('deny', 4): [], ('deny', 6): [], ('allow', 4): [], ('allow', 6): []}
+        for action, rule in rules:
+            try:
+                network = _parse_network(rule)
+            except ValueError:
+                logging.warning(f'Ignoring invalid IP filter rule: {action} {rule}')
+                continue
+            networks[(action, network.version)].append((network, len(compiled_rules)))
+            compiled_rules.append((action, str(network)))
+
+        tables = {key: _compile(value) for key, value in networks.items()}
+
+        # Swap the tables in one step so requests never see a half-built filter
+        with self._lock:
+            self._rules = compiled_rules
+            self._tables = tables
+            self._has_allow = any(action == 'allow' for action, _ in compiled_rules)
+            self._file_mtime = mtime
+            # Keep the counters of rules that survived the reload
+            self._hits = {rule: self._hits.get(rule, 0) for rule in compiled_rules}
+        logging.info(f'Loaded {len(compiled_rules)} IP filter rules')
+        return True
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if self.rule_file and now >= self._next_check:
+            self._next_check = now + self.reload_interval
+            self.reload()
+
+    def _match(self, tables, action, address):
+        owner = _lookup(tables[(action, address.version)], int(address))
+        return self._rules[owner] if owner is not None else None
+
+    def is_allowed(self, ip):
+        self._maybe_reload()
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return False
+        if address.version == 6 and address.ipv4_mapped:
+            address = address.ipv4_mapped
+
+        with self._lock:
+            tables = self._tables
+            # Deny rules win over allow rules
+            rule = self._match(tables, 'deny', address)
+            if rule is None and self._has_allow:
+                rule = self._match(tables, 'allow', address)
+                allowed = rule is not None
+            else:
+                allowed = rule is None
+            if rule is not None:
+                self._hits[rule] += 1
+            self._totals['allowed' if allowed else 'denied'] += 1
+        return allowed
+
+    def metrics(self):
+        with self._lock:
+            return {
+                'rules': len(self._rules),
+                'rule_file': self.rule_file,
+                'allowed': self._totals['allowed'],
+                'denied': self._totals['denied'],
+                'hits': [{'action': action, 'network': network, 'hits': hits}
+                         for (action, network), hits in self._hits.items()],
+            }
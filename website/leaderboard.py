@@ -0,0 +1,209 @@
+from flask import current_app
+from bisect import bisect_left, insort
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from .models import User, Ranking
+from .live_leaderboard import leaderboard_delta
+from . import db, live_leaderboard
+import threading
+import time
+
+# Board key for the cumulative totals, weekly boards are keyed by week number
+TOTAL = 'total'
+
+class SortedBoard:
+    # Entries kept sorted as (-score, tiebreak, user_id) so the highest score comes first
+    # and a user's rank is a binary search away
+
+    def __init__(self):
+        self._entries = []
+        self._by_user = {}
+        self.values = {}
+
+    def update(self, user_id, score, tiebreak, values):
+        old = self._by_user.get(user_id)
+        if old is not None:
+            del self._entries[bisect_left(self._entries, old)]
+        entry = (-score, tiebreak, user_id)
+        insort(self._entries, entry)
+        self._by_user[user_id] = entry
+        self.values[user_id] = values
+
+    def top(self, n):
+        return [entry[2] for entry in self._entries[:n]]
+
+    def rank_of(self, user_id):
+        entry = self._by_user.get(user_id)
+        return bisect_left(self._entries, entry) + 1 if entry is not None else None
+
+    def around(self, user_id, radius):
+        # The user's neighbours with their 1-based ranks
+        rank = self.rank_of(user_id)
+        if rank is None:
+            return []
+        start = max(0, rank - 1 - radius)
+        return [(start + offset + 1, entry[2]) for offset, entry in enumerate(self._entries[start:rank + radius])]
+
+    def __len__(self):
+        return len(self._entries)
+
+class LeaderboardEngine:
+    # Weekly and cumulative boards loaded from the database on first use, updated in place on every
+    # quiz completion and rebuilt periodically to pick up completions handled by other workers
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._boards = {}
+        self._profiles = {}
+        # One lock per board so only one thread rebuilds it, and the scores recorded while it is being loaded
+        self._build_locks = {}
+        self._building = {}
+        self._metrics = {'rebuilds': 0, 'updates': 0, 'queries': 0}
+
+    def _load(self, key):
+        # Runs without the engine lock, so the profiles are returned rather than stored
+        board = SortedBoard()
+        profiles = {}
+        if key == TOTAL:
+            rows = db.session.query(User.id, User.name, User.image_file, User.total_score) \
+                .filter(User.role == 'student').all()
+            for row in rows:
+                profiles[row.id] = (row.name, row.image_file)
+                board.update(row.id, row.total_score, row.id, (row.total_score, row.total_score))
+        else:
+            rows = db.session.query(Ranking.id, Ranking.score, Ranking.cumulative_score, User.id.label('user_id'),
+                                    User.name, User.image_file) \
+                .join(User, User.id == Ranking.user_id) \
+                .filter(Ranking.week_number == key).all()
+            for row in rows:
+                profiles[row.user_id] = (row.name, row.image_file)
+                board.update(row.user_id, row.score, row.id, (row.score, row.cumulative_score))
+        return board, profiles
+
+    def board(self, key):
+        with self._lock:
+            self._metrics['queries'] += 1
+            cached = self._boards.get(key)
+            if cached is not None and cached[0] > time.monotonic():
+                return cached[1]
+            build_lock = self._build_locks.setdefault(key, threading.Lock())
+
+        # Only one thread rebuilds a board, the others keep reading the expired copy while there is one
+        if not build_lock.acquire(blocking=cached is None):
+            return cached[1]
+        try:
+            with self._lock:
+                cached = self._boards.get(key)
+                if cached is not None and cached[0] > time.monotonic():
+                    return cached[1]
+                self._building[key] = []
+            try:
+                # The database query runs outside the engine lock, so the other boards and record_score are not held up
+                board, profiles = self._load(key)
+            except Exception:
+                with self._lock:
+                    self._building.pop(key, None)
+                raise
+            with self._lock:
+                # Scores committed after the query read the table would otherwise be missing until the next rebuild
+                for update in self._building.pop(key):
+                    board.update(*update)
+                self._profiles.update(profiles)
+                self._boards[key] = (time.monotonic() + current_app.config.get('LEADERBOARD_REFRESH_SECONDS', 60), board)
+                self._metrics['rebuilds'] += 1
+            return board
+        finally:
+            build_lock.release()
+
+    def _row(self, board, user_id, rank=None):
+        # Same keys the ranking templates already use
+        name, image_file = self._profiles.get(user_id, (None, None))
+        score, cumulative_score = board.values[user_id]
+        row = {'name': name, 'pfp': image_file, 'userid': user_id, 'score': score, 'cumulative_score': cumulative_score}
+        if rank is not None:
+            row['rank'] = rank
+        return row
+
+    def top(self, key, n):
+        board = self.board(key)
+        with self._lock:
+            return [self._row(board, user_id) for user_id in board.top(n)]
+
+    def position(self, key, user_id, radius=2):
+        board = self.board(key)
+        with self._lock:
+            return {
+                'rank': board.rank_of(user_id),
+                'total': len(board),
+                'neighbours': [self._row(board, neighbour, rank) for rank, neighbour in board.around(user_id, radius)]
+            }
+
+    def record_score(self, user_id, name, image_file, week_number, ranking_id, score, cumulative_score, total_score):
+        # Apply a committed quiz result to the boards that are already loaded
+        with self._lock:
+            self._profiles[user_id] = (name, image_file)
+            for key, update in ((week_number, (user_id, score, ranking_id, (score, cumulative_score))),
+                                (TOTAL, (user_id, total_score, user_id, (total_score, total_score)))):
+                if key in self._boards:
+                    self._boards[key][1].update(*update)
+                if key in self._building:
+                    self._building[key].append(update)
+            self._metrics['updates'] += 1
+
+    def metrics(self):
+        with self._lock:
+            return {
+                'boards': {str(key): len(board) for key, (_, board) in self._boards.items()},
+                'rebuilds': self._metrics['rebuilds'],
+                'updates': self._metrics['updates'],
+                'queries': self._metrics['queries'],
+            }
+
+engine = LeaderboardEngine()
+
+def queue_score(user, week_number, ranking, score, cumulative_score, total_score):
+    # Applied to the boards and pushed to open rankings pages once the caller's transaction commits
+    db.session.info.setdefault('leaderboard_scores', []).append(
+        (user.id, user.name, user.image_file, user.classroom_id, week_number, ranking, score, cumulative_score, total_score))
+
+@event.listens_for(Session, 'after_commit')
+def _publish_scores(session):
+    for user_id, name, image_file, classroom_id, week_number, ranking, score, cumulative_score, total_score \
+            in session.info.pop('leaderboard_scores', ()):
+        # The identity key holds the id of a new ranking without loading the expired row again
+        ranking_id = inspect(ranking).identity[0]
+        engine.record_score(user_id, name, image_file, week_number, ranking_id, score, cumulative_score, total_score)
+        live_leaderboard.publish(week_number, classroom_id, leaderboard_delta(user_id, name, image_file, score, cumulative_score))
+
+@event.listens_for(Session, 'after_rollback')
+def _drop_scores(session):
+    session.info.pop('leaderboard_scores', None)
+
+def weekly_leaderboard(week_number, limit=None):
+    # Top of the week from the in-memory board instead of re-sorting the week's rankings
+    return engine.top(week_number, limit or current_app.config.get('LEADERBOARD_LIMIT', 1000))
+
+def cumulative_leaderboard(limit=None):
+    return engine.top(TOTAL, limit or current_app.config.get('LEADERBOARD_LIMIT', 1000))
+
+def leaderboard_position(user_id, week_number, radius=2):
+    # A student's rank and the students just above and below, without loading the whole cohort
+    return engine.position(week_number, user_id, radius)
+
+def classroom_leaderboard(week_number, classroom_id, limit=None):
+    # One range scan of the (week_number, classroom_id, score) index, no join on User.classroom_id to filter
+    limit = limit or current_app.config.get('LEADERBOARD_LIMIT', 1000)
+    rows = db.session.query(User.name, User.image_file, User.id, Ranking.score, Ranking.cumulative_score) \
+        .join(User, User.id == Ranking.user_id) \
+        .filter(Ranking.week_number == week_number, Ranking.classroom_id == classroom_id) \
+        .order_by(Ranking.score.desc(), Ranking.id) \
+        .limit(limit).all()
+    return [{'name': row.name, 'pfp': row.image_file, 'userid': row.id, 'score': row.score,
+             'cumulative_score': row.cumulative_score} for row in rows]
+
+def backfill_ranking_classrooms():
+    # Copy each student's classroom onto rankings created before the column existed
+    classroom = db.session.query(User.classroom_id).filter(User.id == Ranking.user_id).scalar_subquery()
+    updated = Ranking.query.filter(Ranking.classroom_id.is_(None)).update({'classroom_id': classroom}, synchronize_session=False)
+    db.session.commit()
+    return updated
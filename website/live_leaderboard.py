@@ -0,0 +1,143 @@
+from datetime import datetime
+import threading
+import logging
+import queue
+import json
+import time
+
+
+class LeaderboardBroadcaster:
+    # Fans leaderboard deltas out to every open rankings page of a week from one place in the process
+    # Subscribers are keyed by (week_number, classroom_id), with classroom_id None for the whole cohort
+
+    def __init__(self, app=None):
+        self.app = None
+        self._lock = threading.Lock()
+        self._subscribers = {}
+        self._poller = None
+        self._metrics = {'published': 0, 'delivered': 0, 'dropped_subscribers': 0, 'polls': 0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.queue_size = app.config.get('LIVE_LEADERBOARD_QUEUE_SIZE', 100)
+        self.keepalive = app.config.get('LIVE_LEADERBOARD_KEEPALIVE', 15)
+        self.max_age = app.config.get('LIVE_LEADERBOARD_MAX_AGE', 300)
+        self.max_subscribers = app.config.get('LIVE_LEADERBOARD_MAX_SUBSCRIBERS', 1000)
+        self.poll_interval = app.config.get('LIVE_LEADERBOARD_POLL_INTERVAL', 5)
+        app.extensions['live_leaderboard'] = self
+
+    def _count(self):
+        return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    def subscribe(self, key):
+        with self._lock:
+            if self._count() >= self.max_subscribers:
+                return None
+            subscriber = queue.Queue(maxsize=self.queue_size)
+            self._subscribers.setdefault(key, set()).add(subscriber)
+            # Start watching for updates made by other workers once someone is listening
+            if self._poller is None or not self._poller.is_alive():
+                self._poller = threading.Thread(target=self._poll, daemon=True)
+                self._poller.start()
+            return subscriber
+
+    def unsubscribe(self, key, subscriber):
+        with self._lock:
+            subscribers = self._subscribers.get(key)
+            if subscribers:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._subscribers[key]
+
+    def publish(self, week_number, classroom_id, delta):
+        # Queue the delta for the cohort page and the class page of that week
+        message = json.dumps(delta)
+        with self._lock:
+            self._metrics['published'] += 1
+            for key in {(week_number, None), (week_number, classroom_id)}:
+                for subscriber in list(self._subscribers.get(key, ())):
+                    try:
+                        subscriber.put_nowait(message)
+                        self._metrics['delivered'] += 1
+                    except queue.Full:
+                        # A client that stopped reading is disconnected rather than slowing everyone down
+                        self._subscribers[key].discard(subscriber)
+                        self._metrics['dropped_subscribers'] += 1
+
+    def stream(self, key, subscriber):
+        # Server-Sent Events body, closed after max_age so the browser reconnects and login is checked again
+        deadline = time.monotonic() + self.max_age
+        try:
+            yield 'retry: 5000\n\n'
+            while time.monotonic() < deadline:
+                try:
+                    message = subscriber.get(timeout=self.keepalive)
+                    yield f'data: {message}\n\n'
+                except queue.Empty:
+                    # Keep proxies from closing an idle connection, and notice disconnected clients
+                    yield ': keepalive\n\n'
+                    with self._lock:
+                        if subscriber not in self._subscribers.get(key, ()):
+                            return
+        finally:
+            self.unsubscribe(key, subscriber)
+
+    def _poll(self):
+        # One query per interval for the whole process picks up rankings saved by other workers
+        from .models import Ranking, User
+        from . import db
+
+        with self.app.app_context():
+            last_seen = db.session.query(db.func.max(Ranking.ranking_time)).scalar() or datetime.min
+            sent = set()
+            db.session.remove()
+
+            while True:
+                time.sleep(self.poll_interval)
+                with self._lock:
+                    weeks = {week_number for week_number, _ in self._subscribers}
+                    if not weeks:
+                        self._poller = None
+                        return
+                    self._metrics['polls'] += 1
+                try:
+                    rows = db.session.query(Ranking.id, Ranking.week_number, Ranking.classroom_id, Ranking.score,
+                                            Ranking.cumulative_score, Ranking.ranking_time, User.id.label('user_id'),
+                                            User.name, User.image_file) \
+                        .join(User, User.id == Ranking.user_id) \
+                        .filter(Ranking.ranking_time >= last_seen, Ranking.week_number.in_(weeks)) \
+                        .order_by(Ranking.ranking_time).all()
+                except Exception as e:
+                    logging.error(f'Live leaderboard poll failed: {str(e)}')
+                    rows = []
+                finally:
+                    db.session.remove()
+
+                for row in rows:
+                    # Rows stamped with the same time as the last poll were already sent
+                    marker = (row.id, row.score, row.cumulative_score)
+                    if row.ranking_time == last_seen and marker in sent:
+                        continue
+                    if row.ranking_time > last_seen:
+                        last_seen, sent = row.ranking_time, set()
+                    sent.add(marker)
+                    self.publish(row.week_number, row.classroom_id, leaderboard_delta(
+                        row.user_id, row.name, row.image_file, row.score, row.cumulative_score))
+
+    def metrics(self):
+        with self._lock:
+            return {
+                'subscribers': self._count(),
+                'channels': len(self._subscribers),
+                'published': self._metrics['published'],
+                'delivered': self._metrics['delivered'],
+                'dropped_subscribers': self._metrics['dropped_subscribers'],
+                'polls': self._metrics['polls'],
+            }
+
+
+def leaderboard_delta(user_id, name, image_file, score, cumulative_score):
+    # Same keys as the rows rendered by the rankings page
+    return {'userid': user_id, 'name': name, 'pfp': image_file, 'score': score, 'cumulative_score': cumulative_score}
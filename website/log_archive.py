@@ -0,0 +1,156 @@
+from datetime import datetime, timedelta
+from .models import Logs
+from .file_lock import file_lock, LockBusy
+from . import db
+import logging
+import gzip
+import json
+import zlib
+import os
+import re
+
+# Archive files hold one month of logs each, e.g. logs-2024-08.jsonl.gz
+ARCHIVE_NAME = re.compile(r'^logs-(\d{4})-(\d{2})\.jsonl\.gz$')
+
+def archive_dir(app):
+    return app.config.get('LOG_ARCHIVE_DIR') or os.path.join(app.instance_path, 'log_archive')
+
+def _archive_path(directory, month):
+    return os.path.join(directory, f'logs-{month}.jsonl.gz')
+
+def _to_record(log):
+    return {
+        'id': log.id,
+        'user_id': log.user_id,
+        'user_role': log.user_role,
+        'classroom_code': log.classroom_code,
+        'status': log.status,
+        'activity_type': log.activity_type,
+        'description': log.description,
+        'timestamp': log.timestamp.isoformat(),
+    }
+
+def _append(path, records):
+    # Each append adds a new gzip member, so existing data is never rewritten
+    with gzip.open(path, 'at', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+def archive_old_logs(app):
+    # Move logs older than the retention period into monthly archives, one bounded batch at a time
+    with app.app_context():
+        directory = archive_dir(app)
+        os.makedirs(directory, exist_ok=True)
+        cutoff = datetime.now() - timedelta(days=app.config.get('LOG_RETENTION_DAYS', 180))
+        batch_size = app.config.get('LOG_ARCHIVE_BATCH', 5000)
+        archived = 0
+
+        try:
+            # Every worker runs the scheduler, so only the one holding the lock archives
+            with file_lock(os.path.join(directory, '.archive.lock'), blocking=False):
+                while True:
+                    logs = Logs.query.filter(Logs.timestamp < cutoff) \
+                        .order_by(Logs.timestamp, Logs.id).limit(batch_size).all()
+                    if not logs:
+                        break
+
+                    months = {}
+                    for log in logs:
+                        months.setdefault(log.timestamp.strftime('%Y-%m'), []).append(_to_record(log))
+                    # Write to the archive before deleting, a crash in between only duplicates rows
+                    for month, records in months.items():
+                        _append(_archive_path(directory, month), records)
+
+                    Logs.query.filter(Logs.id.in_([log.id for log in logs])).delete(synchronize_session=False)
+                    db.session.commit()
+                    archived += len(logs)
+        except LockBusy:
+            return 0
+
+        if archived:
+            logging.info(f'Archived {archived} log rows older than {cutoff:%d/%m/%Y}')
+        return archived
+
+def _archive_months(directory, start=None, end=None):
+    # Pick the archive files whose month overlaps the requested range
+    if not os.path.isdir(directory):
+        return []
+    months = []
+    for name in sorted(os.listdir(directory)):
+        match = ARCHIVE_NAME.match(name)
+        if not match:
+            continue
+        month_start = datetime(int(match.group(1)), int(match.group(2)), 1)
+        month_end = (month_start + timedelta(days=32)).replace(day=1)
+        if (start and month_end <= start) or (end and month_start >= end):
+            continue
+        months.append(os.path.join(directory, name))
+    return months
+
+def _member_lines(path, chunk_size=1 << 16):
+    # Yield (member number, line) for every line of the archive, gzip.open hides where one appended member ends
+    member = 0
+    decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+    partial = b''
+    with open(path, 'rb') as f:
+        data = f.read(chunk_size)
+        while data:
+            *lines, partial = (partial + decompressor.decompress(data)).split(b'\n')
+            for line in lines:
+                yield member, line
+            if decompressor.eof:
+                if partial:
+                    yield member, partial
+                    partial = b''
+                # Whatever follows the end of this member is the start of the next one
+                data = decompressor.unused_data or f.read(chunk_size)
+                decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+                member += 1
+            else:
+                data = f.read(chunk_size)
+
+def search_archives(app, filters, text=None, limit=1000):
+    # Stream matching records straight from the compressed files without loading them into the database
+    directory = archive_dir(app)
+    start, end = filters.get('start'), filters.get('end')
+    fields = {'role': 'user_role', 'status': 'status', 'activity_type': 'activity_type', 'classroom_code': 'classroom_code'}
+    text = text.lower() if text else None
+    found = 0
+
+    for path in _archive_months(directory, start, end):
+        # An archive run interrupted between writing and deleting writes the same batch again as the
+        # next member, so only the ids of the previous member are needed to report such rows once
+        previous, current, member = set(), set(), 0
+        for index, line in _member_lines(path):
+            if index != member:
+                previous, current, member = current, set(), index
+            if not line:
+                continue
+            record = json.loads(line)
+            current.add(record['id'])
+            if record['id'] in previous:
+                continue
+            if any(name in filters and record[field] != filters[name] for name, field in fields.items()):
+                continue
+            timestamp = datetime.fromisoformat(record['timestamp'])
+            if (start and timestamp < start) or (end and timestamp >= end):
+                continue
+            if text and text not in (record['description'] or '').lower():
+                continue
+            yield record
+            found += 1
+            if found >= limit:
+                return
+
+def archive_stats(app):
+    directory = archive_dir(app)
+    files = _archive_months(directory)
+    return {
+        'files': len(files),
+        'bytes': sum(os.path.getsize(path) for path in files),
+        'oldest': os.path.basename(files[0]) if files else None,
+        'newest': os.path.basename(files[-1]) if files else None,
+        'retention_days': app.config.get('LOG_RETENTION_DAYS', 180),
+    }
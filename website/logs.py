@@ -1,15 +1,183 @@
-from .models import Logs, User, Classroom
-from . import db
-
-def log_user_activity(user_id, status, activity_type, description=None):
-    user = User.query.get(user_id)
-    role = user.role if user else None
-    classroom_code = None
-    
-    if user and user.role == 'student' and user.classroom_id:
-        classroom = Classroom.query.get(user.classroom_id)
-        classroom_code = classroom.code if classroom else None
-    
-    activity = Logs(user_id=user_id, activity_type=activity_type, description=description, user_role=role, classroom_code=classroom_code, status=status)
-    db.session.add(activity)
-    db.session.commit()
\ No newline at end of file
+from .models import User, Classroom, Logs
+from . import db, audit_log
+from sqlalchemy import or_, and_
+from datetime import datetime, timedelta
+import zlib
+import json
+import csv
+import io
+
+# Classroom codes by id, loaded once since classrooms are rarely added
+_classroom_codes = {}
+
+def lookup_classroom_code(classroom_id):
+    if classroom_id is None:
+        return None
+    if classroom_id not in _classroom_codes:
+        _classroom_codes.update(db.session.query(Classroom.id, Classroom.code).all())
+    return _classroom_codes.get(classroom_id)
+
+def log_context(user):
+    # Role and classroom code of a user the caller already has, so logging needs no lookups
+    return {
+        'role': user.role,
+        'classroom_code': lookup_classroom_code(user.classroom_id) if user.role == 'student' else None
+    }
+
+def log_user_activity(user_id, status, activity_type, description=None, role=None, classroom_code=None):
+    # Fall back to a single lookup when the caller did not pass the role
+    if role is None:
+        user = db.session.query(User.role, User.classroom_id).filter(User.id == user_id).first() if user_id else None
+        role = user.role if user else None
+        if user and user.role == 'student':
+            classroom_code = lookup_classroom_code(user.classroom_id)
+
+    # Capture the timestamp now, the event is written later in a batch
+    audit_log.log({
+        'user_id': user_id,
+        'activity_type': activity_type,
+        'description': description,
+        'user_role': role,
+        'classroom_code': classroom_code,
+        'status': status,
+        'timestamp': datetime.now()
+    })
+
+# Filters accepted by the logs browser, mapped to their columns
+LOG_FILTERS = {
+    'role': Logs.user_role,
+    'status': Logs.status,
+    'activity_type': Logs.activity_type,
+    'classroom_code': Logs.classroom_code,
+}
+
+# How far past a parsed time its input still reaches, by the precision of the format it was written in
+TIME_FORMATS = (
+    ('%Y-%m-%dT%H:%M', timedelta(minutes=1)),
+    ('%Y-%m-%dT%H:%M:%S', timedelta(seconds=1)),
+    ('%Y-%m-%d', timedelta(days=1)),
+)
+
+def _parse_time(value):
+    # Accept both date inputs (2024-08-01) and datetime-local inputs (2024-08-01T13:30), returning the
+    # time and the exclusive end of the period it names, e.g. the whole day for a date
+    for fmt, precision in TIME_FORMATS:
+        try:
+            parsed = datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+        return parsed, parsed + precision
+    return None
+
+def log_filters(args):
+    # Read the filters from the query string, ignoring empty and malformed values.
+    # 'start' is inclusive and 'end' exclusive, so an end of 2024-08-01 keeps the whole day
+    filters = {name: args.get(name, '').strip() for name in LOG_FILTERS}
+    filters = {name: value for name, value in filters.items() if value}
+    start = _parse_time(args.get('start', '').strip())
+    if start:
+        filters['start'] = start[0]
+    end = _parse_time(args.get('end', '').strip())
+    if end:
+        filters['end'] = end[1]
+    return filters
+
+def filtered_logs_query(filters):
+    # Project only the displayed columns and join the user name instead of loading each user
+    query = db.session.query(
+        Logs.id, Logs.timestamp, User.name, Logs.user_role, Logs.classroom_code,
+        Logs.status, Logs.activity_type, Logs.description
+    ).outerjoin(User, User.id == Logs.user_id)
+
+    for name, column in LOG_FILTERS.items():
+        if name in filters:
+            query = query.filter(column == filters[name])
+    if 'start' in filters:
+        query = query.filter(Logs.timestamp >= filters['start'])
+    if 'end' in filters:
+        query = query.filter(Logs.timestamp < filters['end'])
+    return query
+
+def encode_cursor(timestamp, log_id):
+    return f"{timestamp.strftime('%Y%m%d%H%M%S%f')}-{log_id}"
+
+def decode_cursor(cursor):
+    try:
+        timestamp, log_id = cursor.split('-')
+        return datetime.strptime(timestamp, '%Y%m%d%H%M%S%f'), int(log_id)
+    except (AttributeError, ValueError):
+        return None
+
+def logs_page(filters, cursor=None, limit=50):
+    # Keyset pagination on (timestamp, id): each page starts right after the last row of the previous one
+    query = filtered_logs_query(filters)
+    position = decode_cursor(cursor) if cursor else None
+    if position:
+        timestamp, log_id = position
+        query = query.filter(or_(Logs.timestamp < timestamp, and_(Logs.timestamp == timestamp, Logs.id < log_id)))
+
+    # Fetch one extra row to know whether another page exists
+    rows = query.order_by(Logs.timestamp.desc(), Logs.id.desc()).limit(limit + 1).all()
+    next_cursor = encode_cursor(rows[limit - 1].timestamp, rows[limit - 1].id) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+def log_filter_options():
+    # Values for the filter dropdowns, activity types come from the index rather than a table scan
+    activity_types = [row[0] for row in db.session.query(Logs.activity_type).distinct().order_by(Logs.activity_type)]
+    classroom_codes = [row[0] for row in db.session.query(Classroom.code).order_by(Classroom.code)]
+    return {
+        'roles': ['admin', 'staff', 'student'],
+        'statuses': ['pass', 'fail'],
+        'activity_types': activity_types,
+        'classroom_codes': classroom_codes,
+    }
+
+def serialize_log(row):
+    return {
+        'id': row.id,
+        'timestamp': row.timestamp.strftime('%d/%m/%Y %H:%M:%S'),
+        'name': row.name,
+        'role': row.user_role,
+        'classroom_code': row.classroom_code,
+        'status': row.status,
+        'activity_type': row.activity_type,
+        'description': row.description,
+    }
+
+# Columns written by the log export, in order
+EXPORT_COLUMNS = ['id', 'timestamp', 'name', 'user_role', 'classroom_code', 'status', 'activity_type', 'description']
+
+def _export_values(row):
+    return [row.id, row.timestamp.strftime('%Y-%m-%d %H:%M:%S'), row.name, row.user_role, row.classroom_code,
+            row.status, row.activity_type, row.description]
+
+def _export_chunks(filters, fmt, chunk_rows=500):
+    # Read through a server-side cursor in batches and emit the text of a chunk of rows at a time
+    query = filtered_logs_query(filters).order_by(Logs.timestamp, Logs.id).execution_options(yield_per=chunk_rows)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if fmt == 'csv':
+        writer.writerow(EXPORT_COLUMNS)
+
+    for count, row in enumerate(query, start=1):
+        if fmt == 'csv':
+            writer.writerow(_export_values(row))
+        else:
+            buffer.write(json.dumps(dict(zip(EXPORT_COLUMNS, _export_values(row)))) + '\n')
+        if count % chunk_rows == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def export_logs(filters, fmt='csv', compress=False):
+    # Yield the export as bytes, gzip'd on the fly when requested
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    for text in _export_chunks(filters, fmt):
+        data = text.encode('utf-8')
+        if compressor:
+            data = compressor.compress(data)
+        if data:
+            yield data
+    if compressor:
+        yield compressor.flush()
@@ -0,0 +1,229 @@
+from flask import current_app
+from flask_mail import Message
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from sqlalchemy import or_, and_, insert, update
+from .models import MailQueue, MailBatch
+from .encryption import encrypt_token, decrypt_token
+from . import db, mail
+import logging
+import uuid
+
+# Messages left in 'sending' longer than this belong to a dispatcher that died.
+# A dispatcher refreshes its claim before every chunk, so only a single chunk has to fit in this time
+STALE_CLAIM_TIMEOUT = timedelta(minutes=10)
+
+def _queue_values(msg, batch_id=None):
+    # Encrypt the body since emails carry OTPs, reset links and temporary passwords
+    iv, encrypted_html, tag = encrypt_token(msg.html)
+    return {
+        'batch_id': batch_id,
+        'subject': msg.subject,
+        'sender': msg.sender,
+        'recipients': ','.join(msg.recipients),
+        'html': f"{iv}:{encrypted_html}:{tag}",
+    }
+
+def _queue_entry(msg, batch_id=None):
+    return MailQueue(**_queue_values(msg, batch_id))
+
+def enqueue_mail(msg):
+    # Insert on a separate connection so queuing an email never commits the caller's unit of work
+    with db.engine.begin() as conn:
+        result = conn.execute(insert(MailQueue.__table__).values(**_queue_values(msg)))
+    return result.inserted_primary_key[0]
+
+def enqueue_bulk(name, build_message_fn, recipients):
+    # Render one message per recipient and queue them all under one batch in a single commit
+    batch = MailBatch(name=name, total=len(recipients))
+    db.session.add(batch)
+    db.session.flush()
+    db.session.add_all([_queue_entry(build_message_fn(*recipient), batch.id) for recipient in recipients])
+    db.session.commit()
+    return batch
+
+def _due_filter(now):
+    # Pending messages whose retry time has passed, or messages claimed by a dead dispatcher
+    return or_(
+        and_(MailQueue.status == 'pending', MailQueue.next_attempt_at <= now),
+        and_(MailQueue.status == 'sending', MailQueue.claimed_at < now - STALE_CLAIM_TIMEOUT)
+    )
+
+def claim_due_mail(limit):
+    # Claim a batch atomically so several dispatchers never send the same message
+    now = datetime.now()
+    due_ids = [row.id for row in MailQueue.query.filter(_due_filter(now)).with_entities(MailQueue.id)
+               .order_by(MailQueue.id).limit(limit).all()]
+    if not due_ids:
+        return []
+
+    claim = str(uuid.uuid4())
+    MailQueue.query.filter(MailQueue.id.in_(due_ids), _due_filter(now)).update(
+        {'status': 'sending', 'claimed_by': claim, 'claimed_at': now},
+        synchronize_session=False
+    )
+    db.session.commit()
+    return MailQueue.query.filter_by(claimed_by=claim).order_by(MailQueue.id).all()
+
+def build_message(queued):
+    msg = Message(queued.subject, sender=queued.sender, recipients=queued.recipients.split(','))
+    iv, encrypted_html, tag = queued.html.split(':')
+    msg.html = decrypt_token(iv, encrypted_html, tag)
+    return msg
+
+def mark_sent(queued, now):
+    queued.status = 'sent'
+    queued.sent_at = now
+    queued.attempts += 1
+    queued.html = ''  # Drop the body once delivered
+    queued.last_error = None
+
+def mark_failed(queued, error, now):
+    queued.attempts += 1
+    queued.last_error = str(error)[:500]
+    queued.status = 'failed'
+    queued.claimed_by = None
+    logging.error(f'Giving up on email {queued.id}, the message could not be built: {error}')
+
+def mark_retry(queued, error, now):
+    config = current_app.config
+    queued.attempts += 1
+    queued.last_error = str(error)[:500]
+    if queued.attempts >= config.get('MAIL_MAX_ATTEMPTS', 5):
+        queued.status = 'failed'
+        logging.error(f'Giving up on email {queued.id} after {queued.attempts} attempts: {error}')
+    else:
+        # Back off exponentially between retries
+        delay = min(config.get('MAIL_RETRY_BASE_SECONDS', 30) * 2 ** (queued.attempts - 1),
+                    config.get('MAIL_RETRY_MAX_SECONDS', 3600))
+        queued.status = 'pending'
+        queued.next_attempt_at = now + timedelta(seconds=delay)
+    queued.claimed_by = None
+
+def refresh_claim(claim):
+    # Push the claim time forward so a long batch is not taken for one left by a dead dispatcher
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(update(MailQueue.__table__)
+                         .where(MailQueue.claimed_by == claim, MailQueue.status == 'sending')
+                         .values(claimed_at=datetime.now()))
+    except Exception as e:
+        logging.error(f'Could not refresh mail claim {claim}: {str(e)}')
+
+def send_chunks(app, chunks, claim):
+    # Send every chunk over one persistent SMTP connection and report the outcome per message
+    results = []
+    with app.app_context():
+        try:
+            with mail.connect() as conn:
+                for chunk in chunks:
+                    refresh_claim(claim)
+                    for queued_id, msg in chunk:
+                        try:
+                            conn.send(msg)
+                            results.append((queued_id, None, datetime.now()))
+                        except Exception as e:
+                            results.append((queued_id, e, datetime.now()))
+        except Exception as e:
+            # The connection itself failed, so retry everything that was not sent
+            done = {queued_id for queued_id, _, _ in results}
+            results.extend((queued_id, e, datetime.now()) for chunk in chunks for queued_id, _ in chunk
+                           if queued_id not in done)
+    return results
+
+def send_claimed(app, queued_messages):
+    config = app.config
+    connections = max(1, config.get('MAIL_CONNECTIONS', 3))
+    chunk_size = max(1, config.get('MAIL_CHUNK_SIZE', 50))
+
+    claim = queued_messages[0].claimed_by
+
+    # Build each message on its own, a row that cannot be decrypted or rendered must not stall the batch
+    messages = []
+    for queued in queued_messages:
+        try:
+            messages.append((queued.id, build_message(queued)))
+        except Exception as e:
+            # Retrying would fail the same way
+            mark_failed(queued, e, datetime.now())
+    if not messages:
+        return
+
+    # Split the claimed messages into chunks and spread the chunks across the connections
+    chunks = [messages[i:i + chunk_size] for i in range(0, len(messages), chunk_size)]
+    assignments = [chunks[i::connections] for i in range(min(connections, len(chunks)))]
+
+    if len(assignments) == 1:
+        results = send_chunks(app, assignments[0], claim)
+    else:
+        with ThreadPoolExecutor(max_workers=len(assignments)) as executor:
+            results = [result for outcome in executor.map(lambda assigned: send_chunks(app, assigned, claim), assignments)
+                       for result in outcome]
+
+    # Record the delivery status of each message
+    queued_by_id = {queued.id: queued for queued in queued_messages}
+    for queued_id, error, finished in results:
+        if error is None:
+            mark_sent(queued_by_id[queued_id], finished)
+        else:
+            mark_retry(queued_by_id[queued_id], error, finished)
+
+def dispatch_mail_queue(app):
+    with app.app_context():
+        queued_messages = claim_due_mail(app.config.get('MAIL_DISPATCH_BATCH', 500))
+        if not queued_messages:
+            return
+        send_claimed(app, queued_messages)
+        db.session.commit()
+
+def batch_status(batch_id):
+    batch = MailBatch.query.get(batch_id)
+    if not batch:
+        return None
+
+    recipients = MailQueue.query.filter_by(batch_id=batch_id).with_entities(
+        MailQueue.recipients, MailQueue.status, MailQueue.attempts, MailQueue.last_error, MailQueue.sent_at
+    ).order_by(MailQueue.id).all()
+
+    counts = {}
+    for recipient in recipients:
+        counts[recipient.status] = counts.get(recipient.status, 0) + 1
+
+    return {
+        'id': batch.id,
+        'name': batch.name,
+        'total': batch.total,
+        'created_at': batch.created_at.strftime('%d/%m/%Y %H:%M:%S'),
+        'counts': counts,
+        'recipients': [
+            {
+                'email': recipient.recipients,
+                'status': recipient.status,
+                'attempts': recipient.attempts,
+                'last_error': recipient.last_error,
+                'sent_at': recipient.sent_at.strftime('%d/%m/%Y %H:%M:%S') if recipient.sent_at else None
+            }
+            for recipient in recipients
+        ]
+    }
+
+def mail_queue_stats():
+    now = datetime.now()
+    depth = MailQueue.query.filter(MailQueue.status.in_(['pending', 'sending'])).count()
+    failed = MailQueue.query.filter_by(status='failed').count()
+    oldest = MailQueue.query.filter(MailQueue.status.in_(['pending', 'sending'])) \
+        .with_entities(db.func.min(MailQueue.created_at)).scalar()
+
+    # Latency from enqueue to delivery over the last hour
+    recent = MailQueue.query.filter(MailQueue.status == 'sent', MailQueue.sent_at >= now - timedelta(hours=1)) \
+        .with_entities(MailQueue.created_at, MailQueue.sent_at).all()
+    latencies = [(sent_at - created_at).total_seconds() for created_at, sent_at in recent]
+
+    return {
+        'depth': depth,
+        'failed': failed,
+        'oldest_pending_age': (now - oldest).total_seconds() if oldest else 0.0,
+        'sent_last_hour': len(latencies),
+        'avg_latency': sum(latencies) / len(latencies) if latencies else 0.0,
+        'max_latency': max(latencies) if latencies else 0.0,
+    }
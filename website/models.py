@@ -47,7 +47,8 @@ class User(db.Model, UserMixin):
     student_user = db.relationship('Classroom', back_populates='students', overlaps="classroom,student_user")
 
     # Relationship to the Classroom table for staff (many-to-many)
-    staff_user = db.relationship('Classroom', secondary=staff_classroom, lazy='subquery',
+    # Loaded on access, pages that list staff classrooms use selectinload instead
+    staff_user = db.relationship('Classroom', secondary=staff_classroom, lazy='select',
                                  back_populates='staff', overlaps="classroom,staff_user")
 
 class AdminSettings(db.Model):
@@ -62,7 +63,8 @@ class Classroom(db.Model):
     students = db.relationship('User', back_populates='student_user', overlaps="classroom,student_user", cascade="all, delete-orphan")
     
     # Relationship to the User table (staff, many-to-many)
-    staff = db.relationship('User', secondary=staff_classroom, lazy='subquery',
+    # Loaded on access, pages that list classroom staff use selectinload instead
+    staff = db.relationship('User', secondary=staff_classroom, lazy='select',
                             back_populates='staff_user', overlaps="classroom,staff_user")
     
 class Logs(db.Model):
@@ -77,6 +79,15 @@ class Logs(db.Model):
     
     user = db.relationship('User', backref=db.backref('logs', lazy=True))
 
+    # Each filter column leads an index ending in (timestamp, id), so a filtered page is one index range scan
+    __table_args__ = (
+        db.Index('ix_logs_timestamp_id', 'timestamp', 'id'),
+        db.Index('ix_logs_role_timestamp_id', 'user_role', 'timestamp', 'id'),
+        db.Index('ix_logs_status_timestamp_id', 'status', 'timestamp', 'id'),
+        db.Index('ix_logs_activity_timestamp_id', 'activity_type', 'timestamp', 'id'),
+        db.Index('ix_logs_classroom_timestamp_id', 'classroom_code', 'timestamp', 'id'),
+    )
+
 class Module(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(255), nullable=False)
@@ -107,6 +118,7 @@ class Quiz(db.Model):
     locked = db.Column(db.Boolean, default=True)  # Controls access
     boss_file = db.Column(db.String(255), nullable=True)  # Add this line
     boss_width = db.Column(db.Integer, nullable=True)  # Add this line
+    question_version = db.Column(db.Integer, nullable=True, default=0)  # Bumped whenever the quiz's questions change
     module = db.relationship('Module', backref=db.backref('quizzes', lazy=True, cascade='all, delete-orphan'))
     
 class QuizQuestion(db.Model):
@@ -130,10 +142,33 @@ class TakeQuizAnswer(db.Model):
     attempt_date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     score = db.Column(db.Integer)
     lives = db.Column(db.Integer, nullable=False, default=3)
+    entry_id = db.Column(db.String(32), nullable=True)  # Id given by the answer log, so a replayed answer is inserted once
     user = db.relationship('User', backref=db.backref('quiz_attempts', lazy=True, cascade='all, delete-orphan'))
     quiz = db.relationship('Quiz', backref=db.backref('attempts', lazy=True, cascade='all, delete-orphan'))
     question = db.relationship('QuizQuestion')
 
+    __table_args__ = (
+        db.Index('ix_take_quiz_answer_entry_id', 'entry_id', unique=True),
+        # Read a student's answers to one quiz for the revision and result pages
+        db.Index('ix_take_quiz_answer_user_quiz', 'user_id', 'quiz_id'),
+    )
+
+class QuizAttempt(db.Model):
+    # Server-side state of a quiz in progress, the browser only holds the attempt id
+    id = db.Column(db.String(32), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', onupdate='CASCADE', ondelete='CASCADE'), nullable=False)
+    quiz_id = db.Column(db.Integer, db.ForeignKey('quiz.id', onupdate='CASCADE', ondelete='CASCADE'), nullable=False)
+    questions = db.Column(db.LargeBinary, nullable=False)  # Selected question ids packed as 32-bit ints
+    current_question_index = db.Column(db.Integer, nullable=False, default=0)
+    total_score = db.Column(db.Integer, nullable=False, default=0)
+    lives = db.Column(db.Integer, nullable=False, default=3)
+    boss_health = db.Column(db.Integer, nullable=False, default=20)
+    revision = db.Column(db.Integer, nullable=False, default=0)  # Bumped on every save so stale copies are detected
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+
+    # Find abandoned attempts to sweep
+    __table_args__ = (db.Index('ix_quiz_attempt_updated_at', 'updated_at'),)
+
 class Ranking(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id', onupdate='CASCADE', ondelete='CASCADE'), nullable=False)
@@ -142,4 +177,37 @@ class Ranking(db.Model):
     cumulative_score = db.Column(db.Integer, nullable=False,default=0)  # Added cumulative_score field
     module_id = db.Column(db.Integer, nullable=False, default=1)  # Default to 1
     ranking_time = db.Column(db.DateTime)
-    user = db.relationship('User', backref=db.backref('ranking', lazy=True, cascade='all, delete-orphan'))
\ No newline at end of file
+    classroom_id = db.Column(db.Integer, db.ForeignKey('classroom.id', ondelete='SET NULL'), nullable=True)  # Copied from the student for class leaderboards
+    user = db.relationship('User', backref=db.backref('ranking', lazy=True, cascade='all, delete-orphan'))
+
+    # Serve the weekly and per-classroom leaderboards ordered by score
+    __table_args__ = (
+        db.Index('ix_ranking_week_score', 'week_number', 'score'),
+        db.Index('ix_ranking_week_classroom_score', 'week_number', 'classroom_id', 'score'),
+    )
+
+class MailBatch(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)  # e.g., "Deactivation notice"
+    total = db.Column(db.Integer, default=0, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.now, nullable=False)
+
+class MailQueue(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    batch_id = db.Column(db.Integer, db.ForeignKey('mail_batch.id', ondelete='CASCADE'), nullable=True)  # Only for bulk notifications
+    subject = db.Column(db.String(255), nullable=False)
+    sender = db.Column(db.String(150), nullable=False)
+    recipients = db.Column(db.Text, nullable=False)  # Comma-separated email addresses
+    html = db.Column(db.Text, nullable=False)  # Encrypted body stored as iv:ciphertext:tag
+    status = db.Column(db.String(10), default='pending', nullable=False)  # 'pending', 'sending', 'sent' or 'failed'
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    last_error = db.Column(db.Text, nullable=True)
+    claimed_by = db.Column(db.String(36), nullable=True)
+    claimed_at = db.Column(db.DateTime, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.now, nullable=False)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.now, nullable=False)
+    sent_at = db.Column(db.DateTime, nullable=True)
+
+    batch = db.relationship('MailBatch', backref=db.backref('messages', lazy=True, cascade='all, delete-orphan'))
+
+    __table_args__ = (db.Index('ix_mail_queue_status_next_attempt', 'status', 'next_attempt_at'),)
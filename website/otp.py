@@ -1,7 +1,56 @@
+from flask import current_app
+from .models import User
+from . import db
+from datetime import datetime, timedelta
 import secrets
 import string
+import hashlib
+import hmac
+
+# OTPs expire after 5 minutes and can be resent at most 3 times
+OTP_TTL = timedelta(minutes=5)
+MAX_OTP_RESENDS = 3
 
 def generate_otp(length=6):
     alphabet = string.ascii_letters + string.digits
     otp = ''.join(secrets.choice(alphabet) for i in range(length))
-    return otp
\ No newline at end of file
+    return otp
+
+def hash_otp(user_id, otp):
+    # Key the digest with the app secret and bind it to the user so digests cannot be swapped
+    key = current_app.config['SECRET_KEY'].encode('utf-8')
+    message = f"{user_id}:{otp}".encode('utf-8')
+    return hmac.new(key, message, hashlib.sha256).hexdigest()
+
+def issue_otp(user, current_time):
+    # Generate an OTP and store only its keyed digest on the user
+    otp = generate_otp()
+    user.otp = hash_otp(user.id, otp)
+    user.last_otp_time = current_time
+    return otp
+
+def check_otp(user, otp):
+    # Reject missing or expired OTPs before comparing the digests in constant time
+    if not user.otp or not user.last_otp_time or otp_expired(user):
+        return False
+    return hmac.compare_digest(user.otp, hash_otp(user.id, otp))
+
+def otp_expired(user, current_time=None):
+    current_time = current_time or datetime.now()
+    return current_time - user.last_otp_time > OTP_TTL
+
+def clear_otp(user, current_time=None):
+    user.otp = None
+    user.last_otp_time = current_time or datetime.now()
+    user.otp_attempts = 0
+    user.resend_otp_attempts = 0
+
+def sweep_expired_otps(app):
+    # Clear every expired OTP in a single bulk update
+    with app.app_context():
+        cutoff = datetime.now() - OTP_TTL
+        User.query.filter(User.otp.isnot(None), User.last_otp_time < cutoff).update(
+            {'otp': None, 'otp_attempts': 0, 'resend_otp_attempts': 0},
+            synchronize_session=False
+        )
+        db.session.commit()
@@ -0,0 +1,188 @@
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from collections import namedtuple
+from array import array
+from .models import Quiz, QuizQuestion
+from . import db
+import threading
+import random
+import time
+
+# Every quiz attempt is made of questions worth exactly this many marks
+QUIZ_TOTAL_MARKS = 100
+
+# Immutable copy of a quiz question, with the same attribute names as the QuizQuestion model
+QuestionRecord = namedtuple('QuestionRecord', ['id', 'quiz_id', 'question', 'option_A', 'option_B', 'option_C',
+                                               'option_D', 'correct_option', 'marks'])
+
+class QuestionPool:
+    # Ids and marks of one quiz's questions in compact arrays
+
+    __slots__ = ('ids', 'marks')
+
+    def __init__(self, rows):
+        self.ids = array('i')
+        self.marks = array('i')
+        for question_id, marks in rows:
+            # Questions worth more than a whole quiz can never be picked
+            if 0 <= marks <= QUIZ_TOTAL_MARKS:
+                self.ids.append(question_id)
+                self.marks.append(marks)
+
+    def sample(self, target=QUIZ_TOTAL_MARKS, rng=random):
+        # Randomised subset-sum: visit the questions in a random order and keep, for every prefix,
+        # a bitset of the totals it can reach. Walking back from the target then picks a random
+        # set adding up to exactly the target, and finds one whenever the pool has one
+        order = list(range(len(self.ids)))
+        mask = (1 << (target + 1)) - 1
+        reachable = [1]
+        for position in range(len(order)):
+            # Shuffle one step at a time and stop at the first prefix that reaches the target,
+            # which on a typical bank is a few dozen questions rather than the whole pool
+            swap = rng.randrange(position, len(order))
+            order[position], order[swap] = order[swap], order[position]
+            reachable.append((reachable[-1] | (reachable[-1] << self.marks[order[position]])) & mask)
+            if reachable[-1] >> target & 1:
+                break
+        else:
+            return None
+
+        selected = []
+        remaining = target
+        for position in range(len(reachable) - 1, 0, -1):
+            if remaining == 0:
+                break
+            index = order[position - 1]
+            marks = self.marks[index]
+            can_skip = reachable[position - 1] >> remaining & 1
+            can_take = marks <= remaining and reachable[position - 1] >> (remaining - marks) & 1
+            if can_take and (not can_skip or rng.random() < 0.5):
+                selected.append(self.ids[index])
+                remaining -= marks
+        return selected
+
+    def __len__(self):
+        return len(self.ids)
+
+class VersionedQuizCache:
+    # Per-process values built from a quiz's questions, tagged with the quiz's question version and
+    # rebuilt when it changes. The version is re-read at most every QUESTION_POOL_VERSION_TTL
+    # seconds, so an edit made through another worker is picked up within that time
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._metrics = {'hits': 0, 'misses': 0, 'builds': 0, 'version_checks': 0, 'invalidations': 0}
+
+    def _build(self, quiz_id):
+        raise NotImplementedError
+
+    def get(self, quiz_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(quiz_id)
+            if entry is not None and now - entry[1] < current_app.config.get('QUESTION_POOL_VERSION_TTL', 5):
+                self._metrics['hits'] += 1
+                return entry[2]
+
+        version = question_version(quiz_id)
+        if entry is None or entry[0] != version:
+            value = self._build(quiz_id)
+            with self._lock:
+                self._metrics['misses'] += 1
+                self._metrics['builds'] += 1
+        else:
+            value = entry[2]
+            with self._lock:
+                self._metrics['hits'] += 1
+        with self._lock:
+            self._metrics['version_checks'] += 1
+            self._entries[quiz_id] = (version, now, value)
+        return value
+
+    def invalidate(self, quiz_id):
+        with self._lock:
+            if self._entries.pop(quiz_id, None) is not None:
+                self._metrics['invalidations'] += 1
+
+    def metrics(self):
+        with self._lock:
+            lookups = self._metrics['hits'] + self._metrics['misses']
+            return {
+                'quizzes': len(self._entries),
+                'questions': sum(len(entry[2]) for entry in self._entries.values()),
+                'hits': self._metrics['hits'],
+                'misses': self._metrics['misses'],
+                'hit_rate': self._metrics['hits'] / lookups if lookups else 0.0,
+                'builds': self._metrics['builds'],
+                'version_checks': self._metrics['version_checks'],
+                'invalidations': self._metrics['invalidations'],
+            }
+
+class QuestionPoolIndex(VersionedQuizCache):
+    # Question pools used to pick the questions of a new quiz attempt
+
+    def __init__(self):
+        super().__init__()
+        self._metrics.update({'samples': 0, 'unsatisfiable': 0})
+
+    def _build(self, quiz_id):
+        rows = db.session.query(QuizQuestion.id, QuizQuestion.marks) \
+            .filter(QuizQuestion.quiz_id == quiz_id).order_by(QuizQuestion.id).all()
+        return QuestionPool(rows)
+
+    def select(self, quiz_id, target=QUIZ_TOTAL_MARKS):
+        # Question ids adding up to exactly the target, or None when no such set exists
+        selected = self.get(quiz_id).sample(target)
+        with self._lock:
+            self._metrics['samples'] += 1
+            if selected is None:
+                self._metrics['unsatisfiable'] += 1
+        return selected
+
+    def metrics(self):
+        metrics = super().metrics()
+        with self._lock:
+            metrics.update(samples=self._metrics['samples'], unsatisfiable=self._metrics['unsatisfiable'])
+        return metrics
+
+class QuestionCache(VersionedQuizCache):
+    # Question records shown to students and used to check their answers, keyed by question id
+
+    def _build(self, quiz_id):
+        rows = db.session.query(*[getattr(QuizQuestion, field) for field in QuestionRecord._fields]) \
+            .filter(QuizQuestion.quiz_id == quiz_id).all()
+        return {row.id: QuestionRecord(*row) for row in rows}
+
+    def questions(self, quiz_id):
+        return self.get(quiz_id)
+
+    def question(self, quiz_id, question_id):
+        return self.get(quiz_id).get(question_id)
+
+pools = QuestionPoolIndex()
+questions = QuestionCache()
+
+def question_version(quiz_id):
+    return db.session.query(db.func.coalesce(Quiz.question_version, 0)).filter(Quiz.id == quiz_id).scalar() or 0
+
+def bump_question_version(quiz_id):
+    # Called in the same transaction as any change to a quiz's questions, so every worker sees the new version
+    Quiz.query.filter(Quiz.id == quiz_id).update(
+        {'question_version': db.func.coalesce(Quiz.question_version, 0) + 1}, synchronize_session=False)
+    db.session.info.setdefault('stale_question_pools', set()).add(quiz_id)
+
+@event.listens_for(Session, 'after_commit')
+def _drop_stale_pools(session):
+    # Rebuild this worker's pools and question records straight after the change is committed instead of waiting for the TTL
+    for quiz_id in session.info.pop('stale_question_pools', ()):
+        pools.invalidate(quiz_id)
+        questions.invalidate(quiz_id)
+
+@event.listens_for(Session, 'after_rollback')
+def _keep_pools(session):
+    session.info.pop('stale_question_pools', None)
+
+def select_quiz_questions(quiz_id):
+    return pools.select(quiz_id)
@@ -0,0 +1,195 @@
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from array import array
+from .models import QuizAttempt
+from . import db
+import threading
+import uuid
+
+# Lives restored after every correct answer, and the boss's health at the start of a quiz
+START_LIVES = 3
+BOSS_HEALTH = 20
+
+class StaleAttempt(Exception):
+    # The attempt was saved by another worker since this copy was read
+    pass
+
+class AttemptState:
+    # One quiz in progress, with the selected question ids packed in an int array
+
+    __slots__ = ('id', 'user_id', 'quiz_id', 'questions', 'current_question_index', 'total_score', 'lives',
+                 'boss_health', 'revision')
+
+    def __init__(self, id, user_id, quiz_id, questions, current_question_index=0, total_score=0,
+                 lives=START_LIVES, boss_health=BOSS_HEALTH, revision=0):
+        self.id = id
+        self.user_id = user_id
+        self.quiz_id = quiz_id
+        self.questions = questions
+        self.current_question_index = current_question_index
+        self.total_score = total_score
+        self.lives = lives
+        self.boss_health = boss_health
+        self.revision = revision
+
+    def copy(self):
+        # The question array is never changed after the attempt starts, so it can be shared
+        return AttemptState(*(getattr(self, name) for name in self.__slots__))
+
+    @property
+    def finished(self):
+        return self.current_question_index >= len(self.questions)
+
+    @property
+    def current_question(self):
+        return self.questions[self.current_question_index]
+
+    def answer(self, is_correct, score):
+        if is_correct:
+            self.total_score += score
+            self.current_question_index += 1
+            self.lives = START_LIVES
+            self.boss_health -= 1
+        else:
+            self.lives -= 1
+
+def _unpack(data):
+    questions = array('i')
+    questions.frombytes(data)
+    return questions
+
+class QuizAttemptStore:
+    # Attempts live in the quiz_attempt table so they survive restarts and work across workers.
+    # Each worker keeps the attempts it served recently in memory, so an answer costs one small
+    # conditional UPDATE of the counters instead of reading the attempt back first
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._metrics = {'hits': 0, 'misses': 0, 'started': 0, 'saves': 0, 'conflicts': 0, 'swept': 0}
+
+    def _cache(self, state):
+        with self._lock:
+            self._entries[state.id] = state
+            self._entries.move_to_end(state.id)
+            while len(self._entries) > current_app.config.get('QUIZ_ATTEMPT_CACHE_SIZE', 10000):
+                self._entries.popitem(last=False)
+
+    def forget(self, attempt_id):
+        with self._lock:
+            self._entries.pop(attempt_id, None)
+
+    def _pending(self, attempt_id, state):
+        # Only committed state is cached, see the session hooks below
+        db.session.info.setdefault('quiz_attempts', {})[attempt_id] = state
+
+    def start(self, user_id, quiz_id, question_ids):
+        state = AttemptState(uuid.uuid4().hex, user_id, quiz_id, array('i', question_ids))
+        db.session.add(QuizAttempt(id=state.id, user_id=user_id, quiz_id=quiz_id, questions=state.questions.tobytes(),
+                                   current_question_index=0, total_score=0, lives=START_LIVES,
+                                   boss_health=BOSS_HEALTH, revision=0, updated_at=datetime.now()))
+        self._pending(state.id, state.copy())
+        with self._lock:
+            self._metrics['started'] += 1
+        return state
+
+    def load(self, attempt_id, user_id, quiz_id):
+        # A private copy of the attempt, or None when it does not exist or belongs to someone else
+        if not attempt_id:
+            return None
+        with self._lock:
+            state = self._entries.get(attempt_id)
+            if state is not None:
+                self._entries.move_to_end(attempt_id)
+                self._metrics['hits'] += 1
+            else:
+                self._metrics['misses'] += 1
+
+        if state is None:
+            row = db.session.query(QuizAttempt.id, QuizAttempt.user_id, QuizAttempt.quiz_id, QuizAttempt.questions,
+                                   QuizAttempt.current_question_index, QuizAttempt.total_score, QuizAttempt.lives,
+                                   QuizAttempt.boss_health, QuizAttempt.revision) \
+                .filter(QuizAttempt.id == attempt_id).first()
+            if row is None:
+                return None
+            state = AttemptState(row.id, row.user_id, row.quiz_id, _unpack(row.questions), row.current_question_index,
+                                 row.total_score, row.lives, row.boss_health, row.revision)
+            self._cache(state)
+
+        if state.user_id != user_id or state.quiz_id != quiz_id:
+            return None
+        return state.copy()
+
+    def save(self, state):
+        # Write the counters in the caller's transaction, only if nobody saved the attempt since it was read
+        updated = QuizAttempt.query.filter(QuizAttempt.id == state.id, QuizAttempt.revision == state.revision).update({
+            'current_question_index': state.current_question_index,
+            'total_score': state.total_score,
+            'lives': state.lives,
+            'boss_health': state.boss_health,
+            'revision': state.revision + 1,
+            'updated_at': datetime.now(),
+        }, synchronize_session=False)
+        if not updated:
+            self.forget(state.id)
+            with self._lock:
+                self._metrics['conflicts'] += 1
+            raise StaleAttempt(state.id)
+        state.revision += 1
+        self._pending(state.id, state.copy())
+        with self._lock:
+            self._metrics['saves'] += 1
+
+    def discard(self, state):
+        QuizAttempt.query.filter(QuizAttempt.id == state.id).delete(synchronize_session=False)
+        self._pending(state.id, None)
+
+    def sweep(self, max_age):
+        # Delete attempts that were abandoned mid-quiz
+        cutoff = datetime.now() - max_age
+        ids = [row.id for row in db.session.query(QuizAttempt.id).filter(QuizAttempt.updated_at < cutoff)]
+        if ids:
+            QuizAttempt.query.filter(QuizAttempt.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+        for attempt_id in ids:
+            self.forget(attempt_id)
+        with self._lock:
+            self._metrics['swept'] += len(ids)
+        return len(ids)
+
+    def metrics(self):
+        with self._lock:
+            lookups = self._metrics['hits'] + self._metrics['misses']
+            return {
+                'cached': len(self._entries),
+                'hits': self._metrics['hits'],
+                'misses': self._metrics['misses'],
+                'hit_rate': self._metrics['hits'] / lookups if lookups else 0.0,
+                'started': self._metrics['started'],
+                'saves': self._metrics['saves'],
+                'conflicts': self._metrics['conflicts'],
+                'swept': self._metrics['swept'],
+            }
+
+quiz_attempts = QuizAttemptStore()
+
+@event.listens_for(Session, 'after_commit')
+def _cache_committed_attempts(session):
+    for attempt_id, state in session.info.pop('quiz_attempts', {}).items():
+        if state is None:
+            quiz_attempts.forget(attempt_id)
+        else:
+            quiz_attempts._cache(state)
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_rolled_back_attempts(session):
+    # The database copy is the one to trust after a failed transaction
+    for attempt_id in session.info.pop('quiz_attempts', {}):
+        quiz_attempts.forget(attempt_id)
+
+def sweep_quiz_attempts(app):
+    with app.app_context():
+        quiz_attempts.sweep(timedelta(hours=app.config.get('QUIZ_ATTEMPT_MAX_AGE_HOURS', 24)))
@@ -0,0 +1,109 @@
+from flask import current_app, request
+from limits.storage import Storage
+import threading
+import sqlite3
+import time
+
+
+class SQLiteStorage(Storage):
+    # Rate limit counters kept in a SQLite file so every worker process on the host shares them
+    # Registered with limits under the grumpy+sqlite:// scheme, e.g. grumpy+sqlite:///var/run/grumpy/ratelimit.db
+
+    STORAGE_SCHEME = ['grumpy+sqlite']
+
+    # Expired counters are purged after this many increments
+    PURGE_EVERY = 500
+
+    def __init__(self, uri, wrap_exceptions=False, **options):
+        self.path = uri.split('://', 1)[1] or ':memory:'
+        self.busy_timeout = options.pop('busy_timeout', 5)
+        self._local = threading.local()
+        self._increments = 0
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        with self._connection() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS ratelimit (key TEXT PRIMARY KEY, count INTEGER NOT NULL, expires_at REAL NOT NULL)')
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    def _connection(self):
+        # One connection per thread, in autocommit mode so transactions are controlled explicitly
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def incr(self, key, expiry, elastic_expiry=False, amount=1):
+        now = time.time()
+        conn = self._connection()
+        # BEGIN IMMEDIATE takes the write lock up front, so the read-modify-write is atomic across processes
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT count, expires_at FROM ratelimit WHERE key = ?', (key,)).fetchone()
+            if row is None or row[1] <= now:
+                count, expires_at = amount, now + expiry
+            else:
+                count = row[0] + amount
+                expires_at = now + expiry if elastic_expiry else row[1]
+            conn.execute('INSERT OR REPLACE INTO ratelimit (key, count, expires_at) VALUES (?, ?, ?)',
+                         (key, count, expires_at))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+        self._increments += 1
+        if self._increments % self.PURGE_EVERY == 0:
+            self.purge_expired()
+        return count
+
+    def get(self, key):
+        row = self._connection().execute('SELECT count FROM ratelimit WHERE key = ? AND expires_at > ?',
+                                         (key, time.time())).fetchone()
+        return row[0] if row else 0
+
+    def get_expiry(self, key):
+        row = self._connection().execute('SELECT expires_at FROM ratelimit WHERE key = ?', (key,)).fetchone()
+        return int(row[0]) if row else int(time.time())
+
+    def check(self):
+        try:
+            self._connection().execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self):
+        return self._connection().execute('DELETE FROM ratelimit').rowcount
+
+    def clear(self, key):
+        self._connection().execute('DELETE FROM ratelimit WHERE key = ?', (key,))
+
+    def purge_expired(self):
+        return self._connection().execute('DELETE FROM ratelimit WHERE expires_at <= ?', (time.time(),)).rowcount
+
+    def snapshot(self, limit=100):
+        # Live counters with the busiest keys first, for operators
+        now = time.time()
+        rows = self._connection().execute(
+            'SELECT key, count, expires_at FROM ratelimit WHERE expires_at > ? ORDER BY count DESC LIMIT ?',
+            (now, limit)
+        ).fetchall()
+        return [{'key': key, 'count': count, 'resets_in': round(expires_at - now, 1)} for key, count, expires_at in rows]
+
+
+def request_cost():
+    # Weight each request by its route so expensive endpoints use up the limit faster
+    costs = current_app.config.get('RATELIMIT_ROUTE_COSTS', {})
+    return costs.get(f'{request.endpoint}:{request.method}', costs.get(request.endpoint, 1))
+
+
+def rate_limit_snapshot(limit=100):
+    storage = current_app.extensions['limiter'].storage
+    if not hasattr(storage, 'snapshot'):
+        return {'storage': type(storage).__name__, 'keys': None}
+    return {'storage': type(storage).__name__, 'keys': storage.snapshot(limit)}
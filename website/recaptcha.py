@@ -1,21 +1,107 @@
+from flask import current_app, request
+from requests.adapters import HTTPAdapter
 import requests
-import os
+import threading
+import hashlib
+import logging
+import time
 
-def verify_recaptcha(response):
-    # Retrieve the reCAPTCHA secret key from the environment variables
-    secret_key = os.getenv('RECAPTCHA_SECRET_KEY')
+class RecaptchaVerifier:
+    # Verifies reCAPTCHA tokens over a pooled HTTP session with strict timeouts
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._verified = {}
+        self._metrics = {
+            'requests': 0,
+            'passed': 0,
+            'failed': 0,
+            'replayed': 0,
+            'errors': 0,
+            'total_latency': 0.0,
+            'max_latency': 0.0,
+        }
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # The verify URL is configurable so tests can point it at a local stand-in server
+        self.verify_url = app.config.get('RECAPTCHA_VERIFY_URL', 'https://www.google.com/recaptcha/api/siteverify')
+        self.secret_key = app.config.get('RECAPTCHA_SECRET_KEY')
+        self.timeout = (app.config.get('RECAPTCHA_CONNECT_TIMEOUT', 2), app.config.get('RECAPTCHA_READ_TIMEOUT', 3))
+        self.replay_ttl = app.config.get('RECAPTCHA_REPLAY_TTL', 120)
+
+        # Keep connections to the verify endpoint alive across requests
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=app.config.get('RECAPTCHA_POOL_SIZE', 10))
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        app.extensions['recaptcha'] = self
+
+    def _seen(self, token_key, now):
+        # Drop expired entries, then check whether this token already passed verification
+        with self._lock:
+            for key in [key for key, expires in self._verified.items() if expires <= now]:
+                del self._verified[key]
+            return token_key in self._verified
 
-    # Create a payload with the secret key and the user's response
-    payload = {
-        'secret': secret_key,
-        'response': response
-    }
+    def verify(self, token, remote_ip=None):
+        if not token:
+            return False
 
-    # Send a POST request to the reCAPTCHA API to verify the response
-    response = requests.post("https://www.google.com/recaptcha/api/siteverify", data=payload)
+        now = time.monotonic()
+        token_key = hashlib.sha256(token.encode('utf-8')).hexdigest()
+        if self._seen(token_key, now):
+            # A token that already passed cannot be replayed
+            with self._lock:
+                self._metrics['replayed'] += 1
+            return False
 
-    # Parse the JSON response from the API
-    result = response.json()
+        # Create a payload with the secret key and the user's response
+        payload = {
+            'secret': self.secret_key,
+            'response': token
+        }
+        if remote_ip:
+            payload['remoteip'] = remote_ip
 
-    # Return the success status of the verification, default to False if not found
-    return result.get("success", False)
\ No newline at end of file
+        started = time.perf_counter()
+        try:
+            response = self.session.post(self.verify_url, data=payload, timeout=self.timeout)
+            success = bool(response.json().get('success', False))
+        except (requests.RequestException, ValueError) as e:
+            # Fail closed when the verify endpoint is slow, unreachable or returns garbage
+            logging.error(f'reCAPTCHA verification failed: {str(e)}')
+            with self._lock:
+                self._metrics['errors'] += 1
+            return False
+        latency = time.perf_counter() - started
+
+        with self._lock:
+            self._metrics['requests'] += 1
+            self._metrics['total_latency'] += latency
+            self._metrics['max_latency'] = max(self._metrics['max_latency'], latency)
+            if success:
+                self._metrics['passed'] += 1
+                self._verified[token_key] = now + self.replay_ttl
+            else:
+                self._metrics['failed'] += 1
+        return success
+
+    def metrics(self):
+        with self._lock:
+            requests_made = self._metrics['requests']
+            return {
+                'requests': requests_made,
+                'passed': self._metrics['passed'],
+                'failed': self._metrics['failed'],
+                'replayed': self._metrics['replayed'],
+                'errors': self._metrics['errors'],
+                'avg_latency': self._metrics['total_latency'] / requests_made if requests_made else 0.0,
+                'max_latency': self._metrics['max_latency'],
+                'cached_tokens': len(self._verified),
+            }
+
+def verify_recaptcha(response):
+    # Verify the user's reCAPTCHA response with the app's verifier
+    return current_app.extensions['recaptcha'].verify(response, request.remote_addr)
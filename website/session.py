@@ -4,6 +4,7 @@ from flask_login import current_user
 from datetime import datetime, timedelta
 from .models import User
 from .encryption import encrypt_token
+from .identity import invalidate_identity
 from . import db
 import uuid
 
@@ -23,6 +24,8 @@ def session_timeout(f):
                     session.pop('session_token')
                 User.query.filter_by(email=current_user.email).update({'session_token': None})
                 db.session.commit()
+                # Bulk updates skip the ORM events, so drop the cached identity explicitly
+                invalidate_identity(current_user.id)
                 session.clear()
                 
                 # Flash a message and redirect to login
@@ -68,4 +71,7 @@ def regenerate_session_token(user):
     session['session_token'] = f"{iv}:{encrypted_session_token}:{tag}"
     
     # Commit the changes to the database
-    db.session.commit()
\ No newline at end of file
+    db.session.commit()
+
+    # Drop the cached identity so the next request sees the new token
+    invalidate_identity(user.id)
\ No newline at end of file
@@ -1,11 +1,13 @@
 from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app as app
-from sqlalchemy import select
+from sqlalchemy import select, func
+from sqlalchemy.orm import selectinload
 from flask_login import login_required, current_user
 from .models import User, Classroom,Quiz,QuizQuestion, staff_classroom, Module, Labsheet, LabsheetQuestion
 from .forms import AddStudentsForm, AddStudentsFileForm, LabsheetForm, QuestionForm
 from .session import session_timeout
 from .emails import send_student_account_setup_email
 from .week import get_current_week_and_time
+from .leaderboard import classroom_leaderboard
 from .logs import log_user_activity
 from . import db, bcrypt
 import pandas as pd
@@ -26,27 +28,19 @@ def classroom():
 # Get the current week and time
     current_week, _ = get_current_week_and_time()
 
-    # Step 1: Fetch all classrooms associated with the current user
-    
-    stmt = select(staff_classroom.c.classroom_id).where(staff_classroom.c.staff_id == current_user.id)
-    result = db.session.execute(stmt)
-    classroom_ids = [row[0] for row in result.fetchall()]
-
-    # Step 2: Initialize an empty list to store classroom data
-    classroom_data = []
-
-    # Step 3: Fetch details for each classroom_id
-    for classroom_id in classroom_ids:
-        details = Classroom.query.filter_by(id=classroom_id).first()
-        
-        if details:
-            student_count = len(details.students)  # Assuming Classroom has a 'students' relationship
-            classroom_data.append({
-                'code': details.code, 
-                'student_count': student_count
-            })
-
-        # Now `classroom_data` contains the code and student count for each classroom
+    # Fetch the code and student count of every classroom assigned to the current user in one query
+    stmt = (
+        select(Classroom.code, func.count(User.id))
+        .join(staff_classroom, staff_classroom.c.classroom_id == Classroom.id)
+        .outerjoin(User, User.classroom_id == Classroom.id)
+        .where(staff_classroom.c.staff_id == current_user.id)
+        .group_by(Classroom.id, Classroom.code)
+        .order_by(Classroom.id)
+    )
+    classroom_data = [
+        {'code': code, 'student_count': student_count}
+        for code, student_count in db.session.execute(stmt)
+    ]
 
 
     return render_template("classroom.html", 
@@ -65,7 +59,10 @@ def classroom_details(code):
         flash("Unauthorised access.", category='danger')
         return redirect(url_for('admin.dashboard') if current_user.role == 'admin' else url_for('student.dashboard'))
     
-    classroom = Classroom.query.filter_by(code=code).first_or_404()
+    # Load the students and staff of the classroom together with it
+    classroom = Classroom.query.filter_by(code=code).options(
+        selectinload(Classroom.students), selectinload(Classroom.staff)
+    ).first_or_404()
 
     # Get the list of classroom IDs the current user has access to
     stmt = select(staff_classroom.c.classroom_id).where(staff_classroom.c.staff_id == current_user.id)
@@ -79,7 +76,6 @@ def classroom_details(code):
     # Retrieve the classroom details by code (e.g. P01)
     current_week, _ = get_current_week_and_time()
 
-    classroom = Classroom.query.filter_by(code=code).first_or_404()
     students = classroom.students
     staff = classroom.staff
 
@@ -101,7 +97,10 @@ def classroom_details(code):
         })
     student_count = len(students_data)
 
-    return render_template("classroom_details.html", user=current_user, classroom=classroom, students_data=students_data, staff=staff, student_count=student_count,current_week=current_week)
+    # Leaderboard of this class for the current week
+    rankings = classroom_leaderboard(current_week, classroom.id)
+
+    return render_template("classroom_details.html", user=current_user, classroom=classroom, students_data=students_data, staff=staff, student_count=student_count,current_week=current_week, rankings=rankings)
 
 
 @staff.route('/classroom/<string:code>/search', methods=['GET'])
@@ -0,0 +1,77 @@
+// Keep the rankings table up to date from the live leaderboard stream
+(function () {
+    const config = document.getElementById('rankingsLive');
+    if (!config || !window.EventSource) {
+        return;
+    }
+
+    const tbody = document.querySelector('.rankingtable tbody');
+    const currentUserId = parseInt(config.dataset.userId, 10);
+    const pfpUrl = config.dataset.pfpUrl;
+    const rankings = JSON.parse(config.textContent);
+    const highlight = '#4c6444a4';
+
+    function cell(text, isCurrentUser) {
+        const td = document.createElement('td');
+        td.textContent = text;
+        if (isCurrentUser) {
+            td.style.color = 'var(--color-welcome-text)';
+            td.style.backgroundColor = highlight;
+        }
+        return td;
+    }
+
+    function nameCell(rank, isCurrentUser) {
+        const td = document.createElement('td');
+        td.className = 'rank-name';
+        const pic = document.createElement('div');
+        pic.className = 'profile-pic';
+        const img = document.createElement('img');
+        img.src = pfpUrl + rank.pfp;
+        img.alt = 'Profile Picture';
+        pic.appendChild(img);
+        const name = document.createElement('span');
+        name.className = 'name-text';
+        name.textContent = isCurrentUser ? '(You)' : rank.name;
+        if (isCurrentUser) {
+            td.style.backgroundColor = highlight;
+            name.style.color = 'var(--color-welcome-text)';
+        }
+        td.appendChild(pic);
+        td.appendChild(name);
+        return td;
+    }
+
+    function render() {
+        const rows = rankings.map(function (rank, index) {
+            const isCurrentUser = rank.userid === currentUserId;
+            const tr = document.createElement('tr');
+            tr.appendChild(cell(index + 1, isCurrentUser));
+            tr.appendChild(nameCell(rank, isCurrentUser));
+            tr.appendChild(cell(rank.score, isCurrentUser));
+            tr.appendChild(cell(rank.cumulative_score, isCurrentUser));
+            return tr;
+        });
+        tbody.replaceChildren.apply(tbody, rows);
+    }
+
+    const source = new EventSource(config.dataset.streamUrl);
+    source.onmessage = function (event) {
+        const delta = JSON.parse(event.data);
+        if (!tbody) {
+            // The page showed no rankings yet, so load the table once the first score arrives
+            window.location.reload();
+            return;
+        }
+
+        const existing = rankings.find(function (rank) { return rank.userid === delta.userid; });
+        if (existing) {
+            Object.assign(existing, delta);
+        } else {
+            rankings.push(delta);
+        }
+        // Stable sort keeps the server's order for equal scores
+        rankings.sort(function (a, b) { return b.score - a.score; });
+        render();
+    };
+})();
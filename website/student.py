@@ -1,14 +1,18 @@
 import pytz
 from datetime import datetime, timedelta
-from flask import Blueprint, render_template, redirect, url_for, flash, session, request, abort, jsonify
+from flask import Blueprint, render_template, redirect, url_for, flash, session, request, abort, jsonify, Response
 from flask_login import login_required, current_user
 from .models import *
 from datetime import datetime
 from .session import session_timeout
 from .forms import QuizForm, RestartQuizForm, CurrentModForm, RankingWeekForm, ChangepfpForm
+from .leaderboard import weekly_leaderboard, classroom_leaderboard, leaderboard_position, queue_score
 from .week import get_current_week_number
+from .question_pool import select_quiz_questions, questions as quiz_questions
+from .quiz_attempts import quiz_attempts, StaleAttempt
+from .answer_log import quiz_answers, commit_with_answer
+from . import live_leaderboard
 import logging
-import random
 import json
 
 student = Blueprint('student', __name__)
@@ -34,7 +38,6 @@ def unlock_next_module(user):
             if next_module:
                 next_module.locked = False
                 user.current_module = next_module_id
-                db.session.commit()
                 print(f"Unlocked module {next_module_id}")
             else:
                 print(f"No module found with ID {next_module_id}")
@@ -55,7 +58,6 @@ def mark_quiz_complete(user, quiz_id):
     if str(quiz_id) not in completed_quizzes:
         completed_quizzes.append(str(quiz_id))
         user.completed_quizzes = ','.join(completed_quizzes)
-        db.session.commit()
 
 
 
@@ -120,6 +122,8 @@ def update_ranking_and_scores(user, quiz_id, total_marks):
     if ranking:
         ranking.score = highest_weekly_score
         ranking.cumulative_score = new_total_score
+        # Stamp the change so live leaderboards in other workers pick it up
+        ranking.ranking_time = datetime.now(sg_tz)
     else:
         ranking = Ranking(
             user_id=user.id,
@@ -127,11 +131,13 @@ def update_ranking_and_scores(user, quiz_id, total_marks):
             score=highest_weekly_score,
             cumulative_score=new_total_score,
             module_id=user.current_module,
-            ranking_time=datetime.now(sg_tz)
+            ranking_time=datetime.now(sg_tz),
+            classroom_id=user.classroom_id
         )
         db.session.add(ranking)
 
-    db.session.commit()
+    # Move the student on the in-memory and live leaderboards once the caller commits the score
+    queue_score(user, current_week, ranking, highest_weekly_score, new_total_score, new_total_score)
 
 
 
@@ -152,18 +158,8 @@ def dashboard(week_number):
         if current_week < 1 or current_week > 8:
             current_week = get_current_week_number()
 
-        rankings = Ranking.query.filter_by(week_number=current_week).order_by(Ranking.score.desc()).all()
-        ranking_data = [
-            {
-                'name': User.query.get(rank.user_id).name, 
-                'pfp': User.query.get(rank.user_id).image_file,
-                'userid': User.query.get(rank.user_id).id,
-                'score': rank.score, 
-                'cumulative_score': rank.cumulative_score
-            } 
-                         
-            for rank in rankings
-        ]
+        ranking_data = weekly_leaderboard(current_week)
+        position = leaderboard_position(current_user.id, current_week)
 
         completed_quizzes = [int(quiz) for quiz in current_user.completed_quizzes.split(',')] if current_user.completed_quizzes else []
         completed_modules = [int(modules) for modules in current_user.completed_modules.split(',')] if current_user.completed_modules else []
@@ -178,6 +174,7 @@ def dashboard(week_number):
                                modules=modules, 
                                quiz=quiz,
                                rankings=ranking_data, 
+                               position=position,
                                completed_modules=completed_modules,
                                completed_quizzes=completed_quizzes, 
                                progBarQuiz = progBarQuiz,
@@ -353,23 +350,31 @@ def rankings():
          flash('Weeks must be between 1 to 8', 'error')
          return redirect(url_for('student.rankings', ranking_week=get_current_week_number()))
 
-    rankings = Ranking.query.filter_by(week_number=selected_week).order_by(Ranking.score.desc()).all()
+    # Either the whole cohort or only the student's own class
+    scope = 'class' if request.args.get('scope') == 'class' and current_user.classroom_id else 'all'
+    if scope == 'class':
+        ranking_data = classroom_leaderboard(selected_week, current_user.classroom_id)
+    else:
+        ranking_data = weekly_leaderboard(selected_week)
+
+    return render_template('rankings.html', form=form, rankings=ranking_data, selected_ranking_week=selected_week, scope=scope)
 
-    if not rankings:
-       pass
+@student.route('/rankings/stream/<int:week_number>', methods=['GET'])
+@login_required
+def rankings_stream(week_number):
+    # Server-Sent Events stream of score changes for the rankings page
+    if current_user.role != 'student' or not (1 <= week_number <= 8):
+        abort(403)
 
-    ranking_data = [
-        {
-            'name': User.query.get(rank.user_id).name, 
-            'pfp': User.query.get(rank.user_id).image_file,
-            'userid': User.query.get(rank.user_id).id,
-            'score': rank.score, 
-            'cumulative_score': rank.cumulative_score
-        } 
-        for rank in rankings
-    ]
+    classroom_id = current_user.classroom_id if request.args.get('scope') == 'class' else None
+    key = (week_number, classroom_id)
+    subscriber = live_leaderboard.subscribe(key)
+    if subscriber is None:
+        # Too many open streams, the page still works without live updates
+        return Response(status=503)
 
-    return render_template('rankings.html', form=form, rankings=ranking_data, selected_ranking_week=selected_week)
+    return Response(live_leaderboard.stream(key, subscriber), mimetype='text/event-stream',
+                    headers={'X-Accel-Buffering': 'no'})
 
 
 
@@ -406,100 +411,83 @@ def quiz(quiz_id):
 
     form = QuizForm()
 
-    # Clear session data to reset the quiz
-    session.pop('selected_questions', None)
-    session.pop('current_question_index', None)
-    session.pop('total_score', None)
-    session.pop('lives', None)
-    session.pop('boss_health', None)
-
-    if 'selected_questions' not in session or session.get('quiz_id') != quiz_id:
-        session['selected_questions'] = []
-        session['quiz_id'] = quiz_id
-
-        all_questions = QuizQuestion.query.filter_by(quiz_id=quiz_id).all()
-        selected_questions = []
-        total_marks = 0
-
-        while total_marks < 100 and all_questions:
-            question = random.choice(all_questions)
-            all_questions.remove(question)
-            if total_marks + question.marks <= 100:
-                selected_questions.append(question.id)
-                total_marks += question.marks
-
-        if total_marks < 100:
-            return "Unable to fetch quiz questions totaling 100 marks", 400
+    # The attempt travels in the form when answering without JavaScript and in the URL otherwise,
+    # so refreshing the page continues the same attempt
+    if request.method == 'POST':
+        attempt = quiz_attempts.load(request.form.get('attempt_id'), current_user.id, quiz_id)
+    else:
+        attempt = quiz_attempts.load(request.args.get('attempt'), current_user.id, quiz_id)
 
-        session['selected_questions'] = selected_questions
-        session['current_question_index'] = 0
-        session['total_score'] = 0
-        session['lives'] = 3
-        session['boss_health'] = 20 - session['current_question_index']
+    if attempt is None:
+        # Pick a random set of questions worth exactly 100 marks from the quiz's cached pool
+        selected_questions = select_quiz_questions(quiz_id)
+
+        if selected_questions is None:
+            return "Unable to fetch quiz questions totaling 100 marks", 400
 
-    current_question_index = session.get('current_question_index', 0)
-    lives = session.get('lives', 3)
-    selected_questions = session['selected_questions']
-    boss_health = session.get('boss_health', 20 - current_question_index)
+        attempt = quiz_attempts.start(current_user.id, quiz_id, selected_questions)
+        db.session.commit()
+        # An answer posted for an attempt that no longer exists is not applied to the new one
+        return redirect(url_for('student.quiz', quiz_id=quiz_id, attempt=attempt.id))
 
-    if current_question_index >= len(selected_questions):
-        return redirect(url_for('student.quiz_result', quiz_id=quiz_id))
+    if attempt.finished:
+        return redirect(url_for('student.quiz_result', quiz_id=quiz_id, attempt=attempt.id))
 
-    question_id = selected_questions[current_question_index]
-    question = QuizQuestion.query.get(question_id)
+    question_id = attempt.current_question
+    question = quiz_questions.question(quiz_id, question_id)
+    if question is None:
+        # The question was deleted since the attempt started
+        quiz_attempts.discard(attempt)
+        db.session.commit()
+        flash("This quiz was changed while you were taking it. Please start it again.", category='info')
+        return redirect(url_for('student.displayQuiz'))
 
     if form.validate_on_submit():
         selected_option = form.selected_option.data
         is_correct = selected_option == question.correct_option
         score = question.marks if is_correct else 0
+        attempt.answer(is_correct, score)
 
-        if is_correct:
-            session['total_score'] += score
-            session['current_question_index'] += 1
-            session['lives'] = 3
-            session['boss_health'] -= 1
-        else:
-            session['lives'] -= 1
-
-            if session['lives'] <= 0:
+        try:
+            quiz_attempts.save(attempt)
+        except StaleAttempt:
+            db.session.rollback()
+            flash("This quiz was answered from another page. Please try again.", category='danger')
+            return redirect(url_for('student.displayQuiz'))
+
+        if not is_correct:
+            if attempt.lives <= 0:
+                db.session.commit()
                 flash("You've run out of lives for this question. Please review your results.", category='danger')
-                return redirect(url_for('student.quiz_result', quiz_id=quiz_id))
+                return redirect(url_for('student.quiz_result', quiz_id=quiz_id, attempt=attempt.id))
 
             flash("Incorrect answer. You have lost a life.", category='danger')
 
-        take_quiz_answer = TakeQuizAnswer(
-            user_id=current_user.id,
-            quiz_id=quiz_id,
-            question_id=question_id,
-            selected_option=selected_option,
-            score=score,
-            lives=session['lives']
-        )
-        db.session.add(take_quiz_answer)
-        db.session.commit()
-
-        if session['current_question_index'] >= len(session['selected_questions']):
-            total_score = session['total_score']
+        if attempt.finished:
+            total_score = attempt.total_score
             update_ranking_and_scores(current_user, quiz_id, total_score)
             mark_quiz_complete(current_user, quiz_id)
             if total_score == 100:
                 unlock_next_module(current_user)
-            db.session.commit()
-            return redirect(url_for('student.quiz_result', quiz_id=quiz_id))
 
-        db.session.commit()
-        return redirect(url_for('student.quiz', quiz_id=quiz_id))
+        # The answer goes to the answer log first, then the attempt, the scores and any unlock are saved together
+        commit_with_answer(current_user.id, quiz_id, question_id, selected_option, score, attempt.lives)
+
+        if attempt.finished:
+            return redirect(url_for('student.quiz_result', quiz_id=quiz_id, attempt=attempt.id))
+        return redirect(url_for('student.quiz', quiz_id=quiz_id, attempt=attempt.id))
 
     return render_template(
         'startQuiz.html',
-        boss_health=boss_health,
+        boss_health=attempt.boss_health,
         completed_quizzes=completed_quizzes,
         modules=modules,
         current_week=get_current_week_number(),
         quiz=quiz,
         question=question,
-        lives=lives,
-        current_question_index=current_question_index,
+        lives=attempt.lives,
+        current_question_index=attempt.current_question_index,
+        attempt_id=attempt.id,
         form=form,
         quiz_id=quiz_id  # Ensure quiz_id is passed to the template
     )
@@ -521,7 +509,6 @@ def unlock_next_quiz(user):
 
             if next_quiz_id <= 8:
                 user.current_quiz = next_quiz_id
-                db.session.commit()
                 print(f"Unlocked quiz {next_quiz_id}")
             else:
                 print(f"No quiz found with ID {next_quiz_id}")
@@ -535,70 +522,67 @@ def unlock_next_quiz(user):
 @session_timeout
 def submit_quiz(quiz_id):
     try:
-        if 'selected_questions' not in session or session.get('quiz_id') != quiz_id:
-            return jsonify({'error': 'Invalid quiz session'}), 400
-
-        quiz = Quiz.query.get_or_404(quiz_id)
-        current_question_index = session.get('current_question_index', 0)
-        lives = session.get('lives', 3)
-       
-        selected_questions = session['selected_questions']
-
-        if current_question_index >= len(selected_questions):
-            return jsonify({'error': 'No more questions'}), 400
-
-        question_id = selected_questions[current_question_index]
-        question = QuizQuestion.query.get_or_404(question_id)
-
+        attempt_id = request.form.get('attempt_id')
         selected_option = request.form.get('selected_option')
-        is_correct = selected_option == question.correct_option
-        score = question.marks if is_correct else 0
 
-        if is_correct:
-            
-            session['total_score'] += score
-            session['current_question_index'] += 1
-            session['lives'] = 3  # Reset lives on correct answer
-            session['boss_health'] -= 1
-        else:
-            
-            session['lives'] -= 1
-            if session['lives'] <= 0:
-                return jsonify({
-                    'redirect_url': url_for('student.quiz_result', quiz_id=quiz_id) ,
-                     'lives':lives # Ensure quiz_result route exists
-                })
-
-        take_quiz_answer = TakeQuizAnswer(
-            user_id=current_user.id,
-            quiz_id=quiz_id,
-            question_id=question_id,
-            selected_option=selected_option,
-            score=score,
-            lives=session['lives']
-        )
-        db.session.add(take_quiz_answer)
-        db.session.commit()
+        # A copy cached by this worker can be behind one saved by another worker, in which case
+        # the save is refused and the answer is checked again against the saved attempt
+        for retry in (False, True):
+            attempt = quiz_attempts.load(attempt_id, current_user.id, quiz_id)
+            if attempt is None:
+                return jsonify({'error': 'Invalid quiz session'}), 400
+
+            if attempt.finished:
+                return jsonify({'error': 'No more questions'}), 400
+
+            lives = attempt.lives
+            question_id = attempt.current_question
+            question = quiz_questions.question(quiz_id, question_id)
+            if question is None:
+                return jsonify({'error': 'Question not found'}), 404
+
+            is_correct = selected_option == question.correct_option
+            score = question.marks if is_correct else 0
+            attempt.answer(is_correct, score)
+
+            try:
+                quiz_attempts.save(attempt)
+                break
+            except StaleAttempt:
+                db.session.rollback()
+                if retry:
+                    return jsonify({'error': 'Quiz was answered from another page'}), 409
+
+        if not is_correct and attempt.lives <= 0:
+            db.session.commit()
+            return jsonify({
+                'redirect_url': url_for('student.quiz_result', quiz_id=quiz_id, attempt=attempt.id) ,
+                 'lives':lives # Ensure quiz_result route exists
+            })
 
-        if session['current_question_index'] >= len(selected_questions):
-            total_score = session['total_score']
+        if attempt.finished:
+            total_score = attempt.total_score
             update_ranking_and_scores(current_user, quiz_id, total_score)
             mark_quiz_complete(current_user, quiz_id)
             if total_score == 100:
                 unlock_next_quiz(current_user)
-            db.session.commit()
+            # One commit records the attempt, the scores and the unlock, after the answer is logged
+            commit_with_answer(current_user.id, quiz_id, question_id, selected_option, score, attempt.lives)
             return jsonify({
-                'redirect_url': url_for('student.quiz_result', quiz_id=quiz_id)  # Ensure quiz_result route exists
+                'redirect_url': url_for('student.quiz_result', quiz_id=quiz_id, attempt=attempt.id)  # Ensure quiz_result route exists
             })
 
-        db.session.commit()
-        next_question_id = selected_questions[session['current_question_index']]
-        next_question = QuizQuestion.query.get(next_question_id)
+        # One commit records the attempt, the answer is written to the database in a later batch
+        commit_with_answer(current_user.id, quiz_id, question_id, selected_option, score, attempt.lives)
+        next_question = quiz_questions.question(quiz_id, attempt.current_question)
+        if next_question is None:
+            # The quiz page tells the student the quiz was changed
+            return jsonify({'redirect_url': url_for('student.quiz', quiz_id=quiz_id, attempt=attempt.id)})
 
         return jsonify({
-            'current_question_index': session['current_question_index'],
-            'lives': session['lives'],
-            'boss_health':session['boss_health'],
+            'current_question_index': attempt.current_question_index,
+            'lives': attempt.lives,
+            'boss_health':attempt.boss_health,
             'result': is_correct,
             'next_question': {
 
@@ -642,20 +626,16 @@ def quiz_result(quiz_id):
     
    
     form = RestartQuizForm()
-    total_score = session.get('total_score', 0)
-    correct_answers = TakeQuizAnswer.query.filter_by(user_id=current_user.id, quiz_id=quiz_id).count()
+    attempt = quiz_attempts.load(request.args.get('attempt'), current_user.id, quiz_id)
+    total_score = attempt.total_score if attempt else 0
     passed = total_score == 100
 
-    if 'total_score' not in session or session.get('quiz_id') != quiz_id:
+    if attempt is None:
         flash("Invalid access to quiz result. Complete the quiz first.", category='warning')
         return redirect(url_for('student.displayQuiz'))
     
-    # Clear quiz session but keep answers for result display
-    session.pop('selected_questions', None)
-    session.pop('quiz_id', None)
-    session.pop('current_question_index', None)
-    session.pop('total_score', None)
-    session.pop('lives', None)
+    # The attempt is over, the answers are kept for the result display
+    quiz_attempts.discard(attempt)
     db.session.commit()
 
    
@@ -682,36 +662,28 @@ def revise(quiz_id):
         flash(f"You have not gotten 100 marks for the quiz. Please do so to be able to revise for week {quiz_id}'s quiz. ", category='warning')
         return redirect(url_for('student.displayQuiz'))
     
-    # Fetch the unique question IDs with incorrect answers for the given quiz_id
-    incorrect_question_ids = db.session.query(TakeQuizAnswer.question_id).filter_by(
-        user_id=current_user.id,
-        quiz_id=quiz_id,
-        score=0  # Assuming score=0 for incorrect answers
-    ).distinct().all()
+    # The first wrong answer to each question, including answers not yet written from the answer log
+    wrong_answers = {}
+    for answer in quiz_answers(current_user.id, quiz_id):
+        if answer['score'] == 0:  # Assuming score=0 for incorrect answers
+            wrong_answers.setdefault(answer['question_id'], answer['selected_option'])
     
     # Extract question IDs from the result
-    question_ids = [qid[0] for qid in incorrect_question_ids]
-    
-    # Fetch the details of these questions
-    questions = QuizQuestion.query.filter(QuizQuestion.id.in_(question_ids)).all()
+    question_ids = list(wrong_answers)
     
-    # Create a dictionary to easily access question details
-    questions_dict = {q.id: q for q in questions}
+    # Question details come from the quiz's cached question records
+    questions_dict = quiz_questions.questions(quiz_id)
     
     # Prepare data for the template
     revision_data = []
-    for i, question_id in enumerate(question_ids, start=1):
+    for question_id in question_ids:
         question = questions_dict.get(question_id)
-        # Find the user's selected option for this question (there should be only one entry per question)
-        user_answer = TakeQuizAnswer.query.filter_by(
-            user_id=current_user.id,
-            quiz_id=quiz_id,
-            question_id=question_id,
-            score=0  # Assuming score=0 for incorrect answers
-        ).first()
+        if question is None:
+            # Deleted since it was answered
+            continue
         
         revision_data.append({
-            'number': i,
+            'number': len(revision_data) + 1,
             'question': question.question,
             'options': {
                 'A': question.option_A,
@@ -719,7 +691,7 @@ def revise(quiz_id):
                 'C': question.option_C,
                 'D': question.option_D
             },
-            'selected_option': user_answer.selected_option if user_answer else None,
+            'selected_option': wrong_answers[question_id],
             'correct_option': question.correct_option
         })
     
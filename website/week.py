@@ -1,61 +1,65 @@
-from datetime import datetime
+from datetime import datetime, timedelta
+from flask import current_app
+from bisect import bisect_right
+import threading
+import time
 import pytz
 from .models import AdminSettings
 
 # Define the Singapore timezone
 sg_tz = pytz.timezone('Asia/Singapore')
 
-def get_current_week_and_time():
-    # Fetch the start date from the database
-    setting = AdminSettings.query.first()
-    
-    if not setting or not setting.start_date:
-        # Use a default start date if no setting is found
-        default_start_date = sg_tz.localize(datetime(2024, 7, 20))
-        current_date = datetime.now(sg_tz)
-    else:
-        # Use the start date from the setting if found
-        start_date = setting.start_date
-        if start_date.tzinfo is None:
-            start_date = sg_tz.localize(start_date)
-        current_date = datetime.now(sg_tz)
-        
-        # Calculate the difference in days between the current date and the start date
-        delta = current_date - start_date
-        # Calculate the current week number, ensuring it's within the valid range (1 to 8)
-        current_week = (delta.days // 7) + 1
-        current_week = max(1, min(8, current_week))
-        return current_week, current_date.strftime('%A %d %B %H:%M:%S')
-    
-    # If no start date is set, use the default start date
-    delta = current_date - default_start_date
-    # Calculate the week number based on the default start date
-    current_week = (delta.days // 7) + 1
-    current_week = max(1, min(8, current_week))
-    
-    return current_week, current_date.strftime('%A %d %B %H:%M:%S')
+# Used when the admin has not set a start date yet
+DEFAULT_START_DATE = datetime(2024, 7, 20)
+COURSE_WEEKS = 8
 
-def get_current_week_number():
-    # Fetch the start date from the database
-    setting = AdminSettings.query.first()
-    
-    if setting and setting.start_date:
-        start_date = setting.start_date
+class CourseCalendar:
+    # Week boundaries of the course, computed once from the start date
+
+    def __init__(self, start_date):
         if start_date.tzinfo is None:
             start_date = sg_tz.localize(start_date)
-    else:
-        # Handle the case where no start date is set in the database
-        # Use a default start date if no setting is found
-        default_start_date = sg_tz.localize(datetime(2024, 7, 20))
-        start_date = default_start_date
-    
-    # Get the current date in Singapore timezone
+        self.start_date = start_date
+        self.week_starts = [start_date + timedelta(weeks=week) for week in range(COURSE_WEEKS)]
+
+    def week_of(self, timestamp):
+        # Week number of a timestamp, clamped to the valid range (1 to 8)
+        if timestamp.tzinfo is None:
+            timestamp = sg_tz.localize(timestamp)
+        # Number of weeks that have started by the timestamp
+        return max(1, bisect_right(self.week_starts, timestamp))
+
+_calendar = None
+_expires_at = 0.0
+_lock = threading.Lock()
+
+def get_calendar():
+    # Reload the start date once the cached calendar expires, so changes saved by other workers are picked up
+    global _calendar, _expires_at
+    now = time.monotonic()
+    calendar = _calendar
+    if calendar is None or now >= _expires_at:
+        with _lock:
+            calendar = _calendar
+            if calendar is None or now >= _expires_at:
+                setting = AdminSettings.query.first()
+                start_date = setting.start_date if setting and setting.start_date else DEFAULT_START_DATE
+                calendar = _calendar = CourseCalendar(start_date)
+                _expires_at = now + current_app.config.get('CALENDAR_CACHE_TTL', 60)
+    return calendar
+
+def invalidate_calendar():
+    # Called when the admin saves a new start date, the next call reloads it
+    global _expires_at
+    with _lock:
+        _expires_at = 0.0
+
+def get_week_of(timestamp):
+    return get_calendar().week_of(timestamp)
+
+def get_current_week_and_time():
     current_date = datetime.now(sg_tz)
-    
-    # Calculate the difference in days between the current date and the start date
-    delta = current_date - start_date
-    
-    # Calculate the current week number, ensuring it's within the valid range (1 to 8)
-    current_week = max(1, min(8, (delta.days // 7) + 1))
-    
-    return current_week
\ No newline at end of file
+    return get_calendar().week_of(current_date), current_date.strftime('%A %d %B %H:%M:%S')
+
+def get_current_week_number():
+    return get_calendar().week_of(datetime.now(sg_tz))